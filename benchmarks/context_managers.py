@@ -0,0 +1,88 @@
+"""
+Turns per second of the agent with different context managers.
+
+Every user talks to a skill which asks a question and answers, so every turn
+loads and stores a context. Redis is measured with fakeredis, an in-process fake,
+so its numbers don't include the network.
+
+    PYTHONPATH=src python benchmarks/context_managers.py
+"""
+import os
+import tempfile
+import time
+from typing import Any, Callable, Dict, List, Tuple
+
+from millet import Agent, BaseSkill
+from millet.context import BaseContextManager, RAMContextManager, RedisContextManager
+from millet.mmap_store import MmapContextManager
+from millet.skill import BaseSkillClassifier
+from millet.sqlite import SQLiteContextManager
+
+USERS = 200
+ROUNDS = 5
+
+
+class OrderSkill(BaseSkill):
+    def execute(self, message: str, user_id: str):
+        product = self.ask('What do you want to buy?')
+        count = self.ask(f'How many {product}?')
+        self.say(f'{count} {product} are ordered')
+
+
+class SkillClassifier(BaseSkillClassifier):
+    @property
+    def skills_map(self) -> Dict[str, BaseSkill]:
+        return {'order': OrderSkill()}
+
+    def classify(self, message: Any, user_id: str) -> List[str]:
+        return ['order']
+
+
+def measure(context_manager: BaseContextManager) -> float:
+    agent = Agent(skill_classifier=SkillClassifier(), context_manager=context_manager)
+    messages = ['hello', 'iPhone', '2']
+
+    turns = 0
+    started_at = time.perf_counter()
+    for _ in range(ROUNDS):
+        for message in messages:
+            for user in range(USERS):
+                agent.process_message(message, f'user{user}')
+                turns += 1
+    return turns / (time.perf_counter() - started_at)
+
+
+def context_managers(directory: str) -> List[Tuple[str, Callable[[], BaseContextManager]]]:
+    result = [
+        ('ram', RAMContextManager),
+        ('sqlite', lambda: SQLiteContextManager(os.path.join(directory, 'a.db'))),
+        ('sqlite, group commit', lambda: SQLiteContextManager(
+            os.path.join(directory, 'b.db'),
+            group_commit=True,
+        )),
+        ('mmap', lambda: MmapContextManager(os.path.join(directory, 'c.mmap'), slots=1024)),
+    ]
+
+    try:
+        import fakeredis
+    except ImportError:
+        pass
+    else:
+        result.append(('redis (fakeredis)', lambda: RedisContextManager(fakeredis.FakeRedis())))
+
+    return result
+
+
+def main() -> None:
+    with tempfile.TemporaryDirectory() as directory:
+        print(f'{"context manager":<24} {"turns/s":>10}')
+        for name, make_context_manager in context_managers(directory):
+            context_manager = make_context_manager()
+            turns_per_second = measure(context_manager)
+            if hasattr(context_manager, 'close'):
+                context_manager.close()
+            print(f'{name:<24} {turns_per_second:>10.0f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+"""
+Allocations per turn of a long dialogue.
+
+Every message is a large payload (like an update of a messenger platform),
+allocations of a turn should not depend on the length of the dialogue.
+
+    PYTHONPATH=src python benchmarks/history.py
+"""
+import tracemalloc
+from typing import Any, Dict, List
+
+from millet import Agent, BaseSkill, BaseSkillClassifier
+
+TURNS = 2000
+REPORT_EVERY = 250
+
+
+class ChatSkill(BaseSkill):
+
+    def execute(self, message: Any, user_id: str):
+        while True:
+            self.ask('next?')
+
+
+class SkillClassifier(BaseSkillClassifier):
+
+    @property
+    def skills_map(self) -> Dict[str, BaseSkill]:
+        return {
+            'chat': ChatSkill(),
+        }
+
+    def classify(self, message: Any, user_id: str) -> List[str]:
+        return ['chat']
+
+
+def payload(turn: int) -> dict:
+    return {
+        'update_id': turn,
+        'message': {'text': f'message {turn}', 'entities': [{'offset': i} for i in range(50)]},
+    }
+
+
+def main() -> None:
+    agent = Agent(skill_classifier=SkillClassifier())
+    conversation = agent.conversation_with_user('100500')
+
+    tracemalloc.start()
+    print(f'{"turn":>6} {"allocated per turn, KiB":>24}')
+
+    for turn in range(1, TURNS + 1):
+        message = payload(turn)
+
+        tracemalloc.reset_peak()
+        before, _ = tracemalloc.get_traced_memory()
+        conversation.process_message(message)
+        _, peak = tracemalloc.get_traced_memory()
+
+        if turn % REPORT_EVERY == 0:
+            print(f'{turn:>6} {(peak - before) / 1024:>24.1f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+"""
+Restart time of JournaledRAMContextManager with 1M contexts.
+
+Contexts are restored from a journal only and from a snapshot, reads are
+compared with RAMContextManager.
+
+    PYTHONPATH=src python benchmarks/journal.py [number of contexts]
+"""
+import sys
+import tempfile
+import time
+
+from millet.context import RAMContextManager
+from millet.journal import JournaledRAMContextManager
+
+BATCH_SIZE = 10000
+
+
+def user_context(user: int) -> dict:
+    return dict(
+        skill_names=['OrderSkill'],
+        state_names=['count'],
+        history=['hello', 'iPhone'],
+        context={'user': user},
+        calls_history={},
+        timeout_uid=None,
+        frame=None,
+    )
+
+
+def fill(context_manager: JournaledRAMContextManager, users: int) -> float:
+    started_at = time.perf_counter()
+    for start in range(0, users, BATCH_SIZE):
+        context_manager.set_many({
+            f'user{user}': user_context(user)
+            for user in range(start, min(start + BATCH_SIZE, users))
+        })
+    return time.perf_counter() - started_at
+
+
+def reads_per_second(context_manager, users: int) -> float:
+    user_ids = [f'user{user}' for user in range(0, users, 7)]
+    started_at = time.perf_counter()
+    for user_id in user_ids:
+        context_manager.get_user_context(user_id)
+    return len(user_ids) / (time.perf_counter() - started_at)
+
+
+def main() -> None:
+    users = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+
+    with tempfile.TemporaryDirectory() as directory:
+        context_manager = JournaledRAMContextManager(directory, snapshot_every=None)
+        print(f'write of {users} contexts to the journal: {fill(context_manager, users):.1f} s')
+        context_manager.close()
+        del context_manager
+
+        context_manager = JournaledRAMContextManager(directory, snapshot_every=None)
+        print(f'restore from the journal: {context_manager.restore_time:.1f} s')
+
+        started_at = time.perf_counter()
+        context_manager.snapshot()
+        print(f'snapshot: {time.perf_counter() - started_at:.1f} s')
+        context_manager.close()
+        del context_manager
+
+        context_manager = JournaledRAMContextManager(directory, snapshot_every=None)
+        print(f'restore from the snapshot: {context_manager.restore_time:.1f} s')
+        print(f'reads: {reads_per_second(context_manager, users):.0f}/s')
+        context_manager.close()
+
+        ram_context_manager = RAMContextManager()
+        ram_context_manager._storage = dict(context_manager._storage)
+        print(f'reads of RAMContextManager: {reads_per_second(ram_context_manager, users):.0f}/s')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+"""
+KeywordSkillClassifier against the naive classifier with chains of `in` checks.
+
+    PYTHONPATH=src python benchmarks/keyword_classifier.py
+"""
+import random
+import string
+import time
+from typing import Any, Dict, List
+
+from millet import BaseSkill, BaseSkillClassifier
+from millet.keywords import KeywordSkillClassifier
+
+SKILLS = 200
+TRIGGERS_PER_SKILL = 6
+MESSAGES = 5000
+
+random.seed(0)
+
+
+def random_word() -> str:
+    return ''.join(random.choices(string.ascii_lowercase, k=random.randint(4, 9)))
+
+
+class NaiveSkillClassifier(BaseSkillClassifier):
+
+    def __init__(self, triggers: Dict[str, List[str]]) -> None:
+        self._triggers = triggers
+
+    @property
+    def skills_map(self) -> Dict[str, BaseSkill]:
+        return {}
+
+    def classify(self, message: Any, user_id: str) -> List[str]:
+        message = message.lower()
+        skill_names = []
+        for skill_name, triggers in self._triggers.items():
+            for trigger in triggers:
+                if trigger in message:
+                    skill_names.append(skill_name)
+                    break
+        return skill_names
+
+
+def measure(skill_classifier: BaseSkillClassifier, messages: List[str]) -> float:
+    started_at = time.perf_counter()
+    for message in messages:
+        skill_classifier.classify(message, 'bob')
+    return (time.perf_counter() - started_at) / len(messages)
+
+
+def main() -> None:
+    vocabulary = [random_word() for _ in range(SKILLS * TRIGGERS_PER_SKILL * 2)]
+    triggers = {
+        f'skill-{i}': vocabulary[i * TRIGGERS_PER_SKILL:(i + 1) * TRIGGERS_PER_SKILL]
+        for i in range(SKILLS)
+    }
+    messages = [' '.join(random.choices(vocabulary, k=12)) for _ in range(MESSAGES)]
+
+    naive = NaiveSkillClassifier(triggers)
+
+    started_at = time.perf_counter()
+    keyword = KeywordSkillClassifier(
+        skills_map={skill_name: BaseSkill for skill_name in triggers},
+        triggers=triggers,
+        whole_words=False,
+    )
+    compile_time = time.perf_counter() - started_at
+
+    # substrings are matched by both classifiers, so results are the same
+    for message in messages[:100]:
+        assert naive.classify(message, 'bob') == keyword.classify(message, 'bob')
+
+    print(f'patterns: {SKILLS * TRIGGERS_PER_SKILL}, messages: {MESSAGES}')
+    print(f'compile keyword classifier: {compile_time * 1000:.1f} ms')
+    print(f'naive:   {measure(naive, messages) * 1e6:8.1f} us per message')
+    print(f'keyword: {measure(keyword, messages) * 1e6:8.1f} us per message')
+
+
+if __name__ == '__main__':
+    main()
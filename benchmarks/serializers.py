@@ -0,0 +1,105 @@
+"""
+Payload size and encode/decode time of user context serializers.
+
+msgpack and JSON serializers are safe to load, pickle based ones are not.
+
+    PYTHONPATH=src python benchmarks/serializers.py
+"""
+import random
+import time
+from typing import Any, Callable, List, Tuple
+
+from millet.context import PickleSerializer
+from millet.history import History
+from millet.serializers import BinarySerializer, JSONSerializer, MsgpackSerializer
+
+ROUNDS = 200
+
+random.seed(0)
+
+
+def update(turn: int) -> dict:
+    return {
+        'update_id': 100000 + turn,
+        'message': {
+            'message_id': turn,
+            'from': {'id': 100500, 'first_name': 'Bob', 'language_code': 'en'},
+            'chat': {'id': 100500, 'type': 'private'},
+            'date': 1700000000 + turn,
+            'text': ' '.join(random.choices(['hello', 'buy', 'iphone', 'please', 'now'], k=8)),
+        },
+    }
+
+
+def user_context(turns: int) -> dict:
+    return dict(
+        skill_names=['BuySkill'],
+        state_names=['payment'],
+        history=History(update(turn) for turn in range(turns)),
+        context={'age': '25', 'cart': [{'sku': i, 'price': 100.5} for i in range(5)]},
+        calls_history={'random.randint': History(random.randint(0, 100) for _ in range(turns))},
+        timeout_uid=None,
+        frame=None,
+    )
+
+
+def measure(dumps: Callable, loads: Callable, param: Any) -> Tuple[int, float, float]:
+    serialized_param = dumps(param)
+
+    started_at = time.perf_counter()
+    for _ in range(ROUNDS):
+        dumps(param)
+    dumps_time = (time.perf_counter() - started_at) / ROUNDS
+
+    started_at = time.perf_counter()
+    for _ in range(ROUNDS):
+        loads(serialized_param)
+    loads_time = (time.perf_counter() - started_at) / ROUNDS
+
+    return len(serialized_param), dumps_time, loads_time
+
+
+def serializers() -> List[Tuple[str, Callable, Callable]]:
+    legacy = PickleSerializer()
+    result = [
+        # PickleSerializer works with str, redis stores its utf-8 bytes
+        (
+            'pickle protocol 0',
+            lambda param: legacy.dumps(param).encode(),
+            lambda serialized_param: legacy.loads(serialized_param.decode()),
+        ),
+    ]
+
+    for compression in [None, 'zlib', 'lz4']:
+        try:
+            serializer = BinarySerializer(compression=compression)
+        except ImportError:
+            continue
+        result.append((f'binary, {compression}', serializer.dumps, serializer.loads))
+
+    for name, make_serializer in [
+        ('msgpack', MsgpackSerializer),
+        ('json, orjson', JSONSerializer),
+        ('json, stdlib', lambda: JSONSerializer(use_orjson=False)),
+    ]:
+        try:
+            serializer = make_serializer()
+        except ImportError:
+            continue
+        result.append((name, serializer.dumps, serializer.loads))
+
+    return result
+
+
+def main() -> None:
+    for turns in [1, 10, 100]:
+        param = user_context(turns)
+        print(f'history of {turns} messages')
+        print(f'  {"serializer":<20} {"bytes":>8} {"dumps, us":>10} {"loads, us":>10}')
+        for name, dumps, loads in serializers():
+            size, dumps_time, loads_time = measure(dumps, loads, param)
+            print(f'  {name:<20} {size:>8} {dumps_time * 1e6:>10.1f} {loads_time * 1e6:>10.1f}')
+
+
+if __name__ == '__main__':
+    main()
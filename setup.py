@@ -30,9 +30,25 @@ setup(
             'mkdocs',
             'redis',
             'isort',
+            'numpy',
+            'lz4',
+            'msgpack',
+            'orjson',
         ],
         'docs': [
             'mkdocs',
         ],
+        'embedding': [
+            'numpy',
+        ],
+        'lz4': [
+            'lz4',
+        ],
+        'msgpack': [
+            'msgpack',
+        ],
+        'orjson': [
+            'orjson',
+        ],
     },
 )
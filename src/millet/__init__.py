@@ -1,4 +1,10 @@
-from .agent import Agent, Conversation
-from .skill import BaseSkill, BaseSkillClassifier
+from .agent import Agent, AsyncAgent, AsyncConversation, Conversation, Event
+from .skill import (
+    BaseAsyncSkill,
+    BaseAsyncSkillClassifier,
+    BaseGeneratorSkill,
+    BaseSkill,
+    BaseSkillClassifier
+)
 
 __version__ = '3.0.0'
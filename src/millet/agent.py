@@ -1,12 +1,57 @@
-import builtins
-import sys
-from copy import deepcopy
-from typing import Any, List, Optional, Tuple
-from unittest import mock
+import asyncio
+import inspect
+import threading
+from typing import Any, Dict, Hashable, List, Optional, Tuple, Union
+
+from millet.cache import LRUCache
+from millet.context import (
+    BaseAsyncContextManager,
+    BaseContextManager,
+    CopyOnReadContext,
+    RAMContextManager,
+    UserContextChanges
+)
+from millet.history import History
+from millet.registry import SkillRegistry
+from millet.side_effects import get_interception_plan
+from millet.skill import (
+    BaseAsyncSkillClassifier,
+    BaseGeneratorSkill,
+    BaseSkill,
+    BaseSkillClassifier,
+    SkillFrames,
+    SkillResult
+)
+from millet.timeouts import (
+    BaseAsyncTimeoutsBroker,
+    BaseTimeoutsBroker,
+    MessageTimeOut
+)
+
+
+class Event:
+    """Message, action or timeout of a user for batch processing."""
 
-from millet.context import BaseContextManager, RAMContextManager
-from millet.skill import BaseSkill, BaseSkillClassifier
-from millet.timeouts import BaseTimeoutsBroker, MessageTimeOut
+    def __init__(
+        self,
+        user_id: str,
+        message: Optional[Any] = None,
+        is_action: bool = False,
+        timeout_uid: Optional[str] = None,
+    ) -> None:
+        self.user_id = user_id
+        self.message = message
+        self.is_action = is_action
+        self.timeout_uid = timeout_uid
+
+
+class _Turn:
+    """Processing of one event, the message is classified at most once."""
+
+    __slots__ = ('skill_names',)
+
+    def __init__(self) -> None:
+        self.skill_names: Optional[List[str]] = None
 
 
 class Conversation:
@@ -25,7 +70,224 @@ class Conversation:
         return self.agent.process_timeout(timeout_uid=timeout_uid, user_id=self.user_id)
 
 
-class Agent:
+class AsyncConversation:
+
+    def __init__(self, agent: 'AsyncAgent', user_id: str) -> None:
+        self.agent = agent
+        self.user_id = user_id
+
+    async def process_message(self, message: Any) -> List[Any]:
+        return await self.agent.process_message(message=message, user_id=self.user_id)
+
+    async def process_action(self, message: Any) -> List[Any]:
+        return await self.agent.process_action(message=message, user_id=self.user_id)
+
+    async def process_timeout(self, timeout_uid: str) -> List[Any]:
+        return await self.agent.process_timeout(timeout_uid=timeout_uid, user_id=self.user_id)
+
+
+class _BaseAgent:
+
+    def __init__(self, skill_classifier, context_manager, timeouts_broker) -> None:
+        self._skill_classifier = skill_classifier
+        self._context_manager = context_manager or RAMContextManager()
+        self._timeouts_broker = timeouts_broker
+        self._skill_registry = SkillRegistry(skill_classifier)
+        self._frames = SkillFrames()
+
+        self._classify_cache = None
+        if getattr(skill_classifier, 'is_deterministic', False):
+            self._classify_cache = LRUCache(max_size=skill_classifier.classify_cache_size)
+
+        self._avoided_writes = 0
+        self._avoided_writes_lock = threading.Lock()
+
+    @property
+    def skill_registry(self) -> SkillRegistry:
+        return self._skill_registry
+
+    @property
+    def classify_cache(self) -> Optional[LRUCache]:
+        return self._classify_cache
+
+    @property
+    def avoided_writes(self) -> int:
+        """Number of user contexts which weren't written because they weren't changed."""
+
+        return self._avoided_writes
+
+    def _count_avoided_writes(self, count: int) -> None:
+        if count:
+            with self._avoided_writes_lock:
+                self._avoided_writes += count
+
+    def _classify_cache_key(self, message: Any) -> Optional[Hashable]:
+        if self._classify_cache is None or isinstance(message, MessageTimeOut):
+            return None
+
+        key = self._skill_classifier.normalize_message(message)
+        try:
+            hash(key)
+        except TypeError:
+            return None
+        return key
+
+    def _cached_skill_names(self, key: Optional[Hashable]) -> Optional[List[str]]:
+        if key is None:
+            return None
+        return self._classify_cache.get(key)
+
+    def _cache_skill_names(self, key: Optional[Hashable], skill_names: List[str]) -> None:
+        if key is not None:
+            self._classify_cache.set(key, list(skill_names))
+
+    def _batch_turns(
+        self,
+        events: List[Event],
+        user_contexts: Dict[str, dict],
+    ) -> Tuple[List[_Turn], List[int]]:
+        """
+        Returns turns of the events and positions of the events to classify in one batch.
+
+        These are actions and the first messages of users without a dialogue,
+        their classification is needed anyway.
+        """
+
+        turns = [_Turn() for _ in events]
+        positions = []
+        seen_user_ids = set()
+
+        for position, event in enumerate(events):
+            is_first = event.user_id not in seen_user_ids
+            seen_user_ids.add(event.user_id)
+
+            if event.timeout_uid is not None:
+                continue
+            if event.is_action and self._skill_registry.action_routes.route(event.message):
+                continue
+            has_dialogue = bool(user_contexts[event.user_id]['skill_names'])
+            if not event.is_action and (has_dialogue or not is_first):
+                continue
+
+            key = self._classify_cache_key(event.message)
+            skill_names = self._cached_skill_names(key)
+            if skill_names is None:
+                positions.append(position)
+            else:
+                turns[position].skill_names = skill_names
+
+        return turns, positions
+
+    def _classified_batch(
+        self,
+        events: List[Event],
+        turns: List[_Turn],
+        positions: List[int],
+        skill_names_batch: List[List[str]],
+    ) -> None:
+        for position, skill_names in zip(positions, skill_names_batch):
+            turns[position].skill_names = skill_names
+            self._cache_skill_names(self._classify_cache_key(events[position].message), skill_names)
+
+    def _changed_user_contexts(
+        self,
+        user_contexts: Dict[str, dict],
+        new_user_contexts: Dict[str, dict],
+    ) -> Tuple[Dict[str, dict], Dict[str, UserContextChanges]]:
+        """Returns changed user contexts with their changes, unchanged ones aren't written."""
+
+        changed_user_contexts = {}
+        changes = {}
+        for user_id, new_user_context in new_user_contexts.items():
+            user_changes = UserContextChanges.between(user_contexts[user_id], new_user_context)
+            if not user_changes.is_empty:
+                changed_user_contexts[user_id] = new_user_context
+                changes[user_id] = user_changes
+
+        self._count_avoided_writes(len(new_user_contexts) - len(changed_user_contexts))
+        return changed_user_contexts, changes
+
+    def _call_skill(
+        self,
+        skill: BaseSkill,
+        message: Any,
+        user_id: str,
+        state_name: Optional[str],
+        user_context: dict,
+    ) -> SkillResult:
+        # skills change the context in place, the loaded one is kept intact
+        # for finding changes of the turn and for context managers which keep it
+        context = CopyOnReadContext(user_context['context']) if user_context['context'] else {}
+
+        if isinstance(skill, BaseGeneratorSkill):
+            return skill.run(
+                message=message,
+                user_id=user_id,
+                history=[],
+                state_name=state_name,
+                context=context,
+                frame=user_context.get('frame'),
+                frames=self._frames,
+            )
+
+        # skills don't modify history, so it's passed without copying
+        return skill.run(
+            message=message,
+            user_id=user_id,
+            history=user_context['history'],
+            state_name=state_name,
+            context=context,
+        )
+
+    def _new_user_context(self, skill_names: List[str]) -> dict:
+        return dict(
+            skill_names=skill_names,
+            state_names=[None for _ in skill_names],
+            history=[],
+            context={},
+            calls_history={},
+            timeout_uid=None,
+            frame=None,
+        )
+
+    def _continued_user_context(
+        self,
+        skill_name: str,
+        skill: BaseSkill,
+        skill_result: SkillResult,
+        message: Any,
+        user_context: dict,
+        calls_current: dict,
+    ) -> dict:
+        if skill_result.direct_to or not skill._replays_history:
+            history = []
+            calls_history = {}
+        else:
+            # histories share their items with the previous turn, only new items are added
+            history = History.of(user_context['history']).append(message)
+
+            calls_history = dict(user_context['calls_history'])
+            for func_name, results in calls_current.items():
+                func_calls_history = History.of(calls_history.get(func_name, ()))
+                calls_history[func_name] = func_calls_history.extend(results)
+
+        context = skill_result.context
+        if isinstance(context, CopyOnReadContext):
+            # values which weren't read are shared with the loaded context
+            context = dict(context)
+
+        return dict(
+            skill_names=[skill_name],
+            state_names=[skill_result.direct_to],
+            history=history,
+            context=context,
+            calls_history=calls_history,
+            timeout_uid=None,
+            frame=skill_result.frame,
+        )
+
+
+class Agent(_BaseAgent):
 
     def __init__(
         self,
@@ -33,10 +295,11 @@ class Agent:
         context_manager: Optional[BaseContextManager] = None,
         timeouts_broker: Optional[BaseTimeoutsBroker] = None,
     ) -> None:
-
-        self._skill_classifier = skill_classifier
-        self._context_manager = context_manager or RAMContextManager()
-        self._timeouts_broker = timeouts_broker
+        super().__init__(
+            skill_classifier=skill_classifier,
+            context_manager=context_manager,
+            timeouts_broker=timeouts_broker,
+        )
 
     def conversation_with_user(self, user_id: str) -> Conversation:
         return Conversation(agent=self, user_id=user_id)
@@ -62,7 +325,11 @@ class Agent:
 
         answers, new_user_context = result
 
-        self._context_manager.set_user_context(user_id, new_user_context)
+        changes = UserContextChanges.between(user_context, new_user_context)
+        if changes.is_empty:
+            self._count_avoided_writes(1)
+        else:
+            self._context_manager.update_user_context(user_id, new_user_context, changes)
         return answers
 
     def process_message(self, message: Any, user_id: str) -> List[Any]:
@@ -78,6 +345,65 @@ class Agent:
         )
         return result
 
+    def process_batch(self, events: List[Event]) -> List[List[Any]]:
+        """
+        Processes events in order with one bulk load and one bulk store of user contexts.
+
+        Returns answers for every event in the same order.
+        """
+
+        user_ids = list(dict.fromkeys(event.user_id for event in events))
+        user_contexts = self._context_manager.get_many(user_ids)
+        loaded_user_contexts = dict(user_contexts)
+
+        turns, positions = self._batch_turns(events, user_contexts)
+        if positions:
+            skill_names_batch = self._skill_classifier.classify_batch(
+                [events[position].message for position in positions],
+                [events[position].user_id for position in positions],
+            )
+            self._classified_batch(events, turns, positions, skill_names_batch)
+
+        answers = []
+        new_user_contexts = {}
+
+        for event, turn in zip(events, turns):
+            result = self._query(
+                message=event.message,
+                user_context=user_contexts[event.user_id],
+                user_id=event.user_id,
+                is_action=event.is_action,
+                timeout_uid=event.timeout_uid,
+                turn=turn,
+            )
+            if not result:
+                answers.append([])
+                continue
+
+            event_answers, new_user_context = result
+            user_contexts[event.user_id] = new_user_context
+            new_user_contexts[event.user_id] = new_user_context
+            answers.append(event_answers)
+
+        new_user_contexts, changes = self._changed_user_contexts(
+            loaded_user_contexts,
+            new_user_contexts,
+        )
+        if new_user_contexts:
+            self._context_manager.update_many(new_user_contexts, changes)
+        return answers
+
+    def _classify(self, message: Any, user_id: str, turn: _Turn) -> List[str]:
+        if turn.skill_names is None:
+            key = self._classify_cache_key(message)
+            skill_names = self._cached_skill_names(key)
+            if skill_names is None:
+                skill_names = self._skill_classifier.classify(message, user_id)
+                self._cache_skill_names(key, skill_names)
+            turn.skill_names = skill_names
+
+        return list(turn.skill_names)
+
     def _query(
         self,
         message: Optional[Any],
@@ -85,7 +411,10 @@ class Agent:
         user_id: str,
         is_action: bool,
         timeout_uid: Optional[str],
+        turn: Optional[_Turn] = None,
     ) -> Optional[Tuple[List[Any], dict]]:
+        if turn is None:
+            turn = _Turn()
 
         if timeout_uid is not None:
             if user_context['timeout_uid'] != timeout_uid:
@@ -93,140 +422,301 @@ class Agent:
             message = MessageTimeOut()
 
         if is_action:
-            actual_skill_names = self._skill_classifier.classify(message, user_id)
+            actual_skill_names = (
+                self._skill_registry.action_routes.route(message)
+                or self._classify(message, user_id, turn)
+            )
             if actual_skill_names:
-                actual_state_names = [None for _ in actual_skill_names]
+                self._frames.discard(user_context.get('frame'))
                 return self._query(
                     message=message,
-                    user_context=dict(
-                        skill_names=actual_skill_names,
-                        state_names=actual_state_names,
-                        history=[],
-                        context={},
-                        calls_history={},
-                        timeout_uid=None,
-                    ),
+                    user_context=self._new_user_context(actual_skill_names),
                     user_id=user_id,
                     is_action=False,
                     timeout_uid=None,
+                    turn=turn,
                 )
 
-        history = user_context['history']
+        if not user_context['skill_names']:
+            skill_names = self._classify(message, user_id, turn)
+            user_context = self._new_user_context(skill_names)
 
-        if user_context['skill_names']:
-            skill_names = user_context['skill_names']
-            state_names = user_context['state_names']
+        answers = []
+        new_user_context = self._new_user_context([])
+        new_timeout_uid = None
 
-            context = user_context['context']
+        for skill_name, state_name in zip(user_context['skill_names'], user_context['state_names']):
+            skill: BaseSkill = self._skill_registry[skill_name]
 
-            calls_history_global = deepcopy(user_context['calls_history'])
-            calls_history = deepcopy(user_context['calls_history'])
-        else:
-            skill_names = self._skill_classifier.classify(message, user_id)
-            state_names = [None for _ in skill_names]
+            skill_result, calls_current = self._run_skill(
+                skill=skill,
+                message=message,
+                user_id=user_id,
+                state_name=state_name,
+                user_context=user_context,
+            )
 
-            context = {}
+            if skill_result.timeout:
+                if self._timeouts_broker:
+                    new_timeout_uid = self._timeouts_broker.generate_timeout_uid(
+                        user_id=user_id,
+                        timeout=skill_result.timeout,
+                    )
+                    self._timeouts_broker.execute(
+                        user_id=user_id,
+                        timeout=skill_result.timeout,
+                        timeout_uid=new_timeout_uid,
+                    )
 
-            calls_history_global = {}
-            calls_history = {}
+            if not skill_result.is_relevant:
+                actual_skill_names = self._classify(message, user_id, turn)
+                if actual_skill_names:
+                    self._frames.discard(skill_result.frame)
+                    return self._query(
+                        message=message,
+                        user_context=self._new_user_context(actual_skill_names),
+                        user_id=user_id,
+                        is_action=False,
+                        timeout_uid=None,
+                        turn=turn,
+                    )
 
-        answers = []
+            answers.extend(skill_result.answers)
 
-        new_skill_names = []
-        new_state_names = []
-        new_history = []
-        new_context = {}
-        calls_new = {}
-        new_timeout_uid = None
+            if not skill_result.is_finished:
+                new_user_context = self._continued_user_context(
+                    skill_name=skill_name,
+                    skill=skill,
+                    skill_result=skill_result,
+                    message=message,
+                    user_context=user_context,
+                    calls_current=calls_current,
+                )
+                break
 
-        for skill_name, state_name in zip(skill_names, state_names):
-            skill: BaseSkill = self._skill_classifier.skills_map[skill_name]
+            # the next skills are started from scratch
+            user_context = self._new_user_context([])
+
+        new_user_context['timeout_uid'] = new_timeout_uid
+        return answers, new_user_context
+
+    def _run_skill(
+        self,
+        skill: BaseSkill,
+        message: Any,
+        user_id: str,
+        state_name: Optional[str],
+        user_context: dict,
+    ) -> Tuple[SkillResult, dict]:
+        plan = get_interception_plan(skill)
 
+        # a skill which isn't replayed (checkpoint mode, generator skill)
+        # doesn't need its side functions to be cached
+        if not plan or not skill._replays_history:
+            skill_result = self._call_skill(skill, message, user_id, state_name, user_context)
             calls_current = {}
+        else:
+            with plan.apply(user_context['calls_history']) as side_calls:
+                skill_result = self._call_skill(
+                    plan.intercepted(skill), message, user_id, state_name, user_context
+                )
+            calls_current = side_calls.current
 
-            def cached_decorator_func(func):
-                def cached_func(*args, **kwargs):
-                    if isinstance(func, mock.MagicMock):
-                        func_name = str(func)
-                    else:
-                        func_name = func.__name__
+        if inspect.isawaitable(skill_result):
+            skill_result.close()
+            raise TypeError(f'{skill.__class__.__name__} is async, use AsyncAgent')
 
-                    if func_name in calls_history and calls_history[func_name]:
-                        value = calls_history[func_name].pop(0)
-                        return value
+        return skill_result, calls_current
 
-                    if isinstance(getattr(func, '__self__', None), type):
-                        # it's cls method
-                        args = args[1:]
 
-                    result = func(*args, **kwargs)
+async def _resolve(value: Any) -> Any:
+    if inspect.isawaitable(value):
+        return await value
+    return value
 
-                    if func_name not in calls_current:
-                        calls_current[func_name] = []
-                    calls_current[func_name].append(result)
 
-                    return result
+class AsyncAgent(_BaseAgent):
+    """
+    Agent for asyncio applications.
 
-                return cached_func
+    Classifier, context manager and timeouts broker may be either async
+    or sync implementations, skills may be either async or sync skills.
+    """
 
-            cached_decorators = []
+    def __init__(
+        self,
+        skill_classifier: Union[BaseAsyncSkillClassifier, BaseSkillClassifier],
+        context_manager: Optional[Union[BaseAsyncContextManager, BaseContextManager]] = None,
+        timeouts_broker: Optional[Union[BaseAsyncTimeoutsBroker, BaseTimeoutsBroker]] = None,
+    ) -> None:
+        super().__init__(
+            skill_classifier=skill_classifier,
+            context_manager=context_manager,
+            timeouts_broker=timeouts_broker,
+        )
 
-            for side_func_name in skill.side_functions:
-                if str(side_func_name) in {'print', '<built-in function print>'}:
-                    side_func_name = 'print'
-                    side_func = builtins.print
-                else:
-                    side_func_path_parts = side_func_name.split('.')
-                    current_module = sys.modules[skill.__module__]
+    def conversation_with_user(self, user_id: str) -> AsyncConversation:
+        return AsyncConversation(agent=self, user_id=user_id)
 
-                    for side_func_path_part in side_func_path_parts:
-                        current_module = current_module.__dict__[side_func_path_part]
+    async def _process_event(
+        self,
+        user_id: str,
+        message: Optional[Any] = None,
+        is_action: bool = False,
+        timeout_uid: Optional[str] = None,
+    ) -> List[Any]:
+        user_context = await _resolve(self._context_manager.get_user_context(user_id))
 
-                    side_func = current_module
+        result = await self._query(
+            message=message,
+            user_context=user_context,
+            user_id=user_id,
+            is_action=is_action,
+            timeout_uid=timeout_uid,
+        )
+        if not result:
+            return []
 
-                side_func_full_path = '.'.join([skill.__module__, side_func_name])
-                decorator = mock.patch(
-                    target=side_func_full_path,
-                    new=cached_decorator_func(side_func),
-                )
-                cached_decorators.append(decorator)
-
-            for side_class, side_method_name in skill.side_methods:
-                if isinstance(side_class, str):
-                    if side_class == skill.__class__.__name__:
-                        side_class = skill.__class__
-                    else:
-                        side_class_parts = side_class.split('.')
-
-                        if side_class_parts[0] == 'self':
-                            side_class_parts = side_class_parts[1:]
-                            side_class = skill
-
-                            for side_class_part in side_class_parts:
-                                side_class = getattr(side_class, side_class_part)
-
-                side_method = getattr(side_class, side_method_name)
-                decorator = mock.patch.object(
-                    target=side_class,
-                    attribute=side_method_name,
-                    new=cached_decorator_func(side_method),
+        answers, new_user_context = result
+
+        changes = UserContextChanges.between(user_context, new_user_context)
+        if changes.is_empty:
+            self._count_avoided_writes(1)
+        else:
+            await _resolve(
+                self._context_manager.update_user_context(user_id, new_user_context, changes)
+            )
+        return answers
+
+    async def process_message(self, message: Any, user_id: str) -> List[Any]:
+        return await self._process_event(message=message, user_id=user_id)
+
+    async def process_action(self, message: Any, user_id: str) -> List[Any]:
+        return await self._process_event(message=message, user_id=user_id, is_action=True)
+
+    async def process_timeout(self, timeout_uid: str, user_id: str) -> List[Any]:
+        return await self._process_event(timeout_uid=timeout_uid, user_id=user_id)
+
+    async def process_batch(self, events: List[Event]) -> List[List[Any]]:
+        """
+        Processes events with one bulk load and one bulk store of user contexts.
+
+        Events of different users are processed concurrently, events of one user
+        are processed in order. Returns answers for every event in the same order.
+        """
+
+        events_by_user_id = {}
+        for position, event in enumerate(events):
+            events_by_user_id.setdefault(event.user_id, []).append((position, event))
+
+        user_contexts = await _resolve(
+            self._context_manager.get_many(list(events_by_user_id))
+        )
+
+        turns, positions = self._batch_turns(events, user_contexts)
+        if positions:
+            skill_names_batch = await _resolve(self._skill_classifier.classify_batch(
+                [events[position].message for position in positions],
+                [events[position].user_id for position in positions],
+            ))
+            self._classified_batch(events, turns, positions, skill_names_batch)
+
+        answers = [[] for _ in events]
+        new_user_contexts = {}
+
+        async def process_user_events(user_id: str, user_events: List[Tuple[int, Event]]):
+            user_context = user_contexts[user_id]
+
+            for position, event in user_events:
+                result = await self._query(
+                    message=event.message,
+                    user_context=user_context,
+                    user_id=user_id,
+                    is_action=event.is_action,
+                    timeout_uid=event.timeout_uid,
+                    turn=turns[position],
                 )
-                cached_decorators.append(decorator)
+                if not result:
+                    continue
+
+                answers[position], user_context = result
+                new_user_contexts[user_id] = user_context
+
+        await asyncio.gather(*[
+            process_user_events(user_id, user_events)
+            for user_id, user_events in events_by_user_id.items()
+        ])
+
+        changed_user_contexts, changes = self._changed_user_contexts(
+            user_contexts,
+            new_user_contexts,
+        )
+        if changed_user_contexts:
+            await _resolve(self._context_manager.update_many(changed_user_contexts, changes))
+        return answers
+
+    async def _classify(self, message: Any, user_id: str, turn: _Turn) -> List[str]:
+        if turn.skill_names is None:
+            key = self._classify_cache_key(message)
+            skill_names = self._cached_skill_names(key)
+            if skill_names is None:
+                skill_names = await _resolve(self._skill_classifier.classify(message, user_id))
+                self._cache_skill_names(key, skill_names)
+            turn.skill_names = skill_names
+
+        return list(turn.skill_names)
+
+    async def _query(
+        self,
+        message: Optional[Any],
+        user_context: dict,
+        user_id: str,
+        is_action: bool,
+        timeout_uid: Optional[str],
+        turn: Optional[_Turn] = None,
+    ) -> Optional[Tuple[List[Any], dict]]:
+        if turn is None:
+            turn = _Turn()
+
+        if timeout_uid is not None:
+            if user_context['timeout_uid'] != timeout_uid:
+                return None
+            message = MessageTimeOut()
 
-            def run_skill(*args):
-                skill_result = skill.run(
+        if is_action:
+            actual_skill_names = (
+                self._skill_registry.action_routes.route(message)
+                or await self._classify(message, user_id, turn)
+            )
+            if actual_skill_names:
+                self._frames.discard(user_context.get('frame'))
+                return await self._query(
                     message=message,
+                    user_context=self._new_user_context(actual_skill_names),
                     user_id=user_id,
-                    history=deepcopy(history),
-                    state_name=state_name,
-                    context=context,
+                    is_action=False,
+                    timeout_uid=None,
+                    turn=turn,
                 )
-                return skill_result
 
-            for dec in cached_decorators:
-                run_skill = dec(run_skill)
+        if not user_context['skill_names']:
+            skill_names = await self._classify(message, user_id, turn)
+            user_context = self._new_user_context(skill_names)
+
+        answers = []
+        new_user_context = self._new_user_context([])
+        new_timeout_uid = None
+
+        for skill_name, state_name in zip(user_context['skill_names'], user_context['state_names']):
+            skill: BaseSkill = self._skill_registry[skill_name]
 
-            skill_result = run_skill()
+            skill_result, calls_current = await self._run_skill(
+                skill=skill,
+                message=message,
+                user_id=user_id,
+                state_name=state_name,
+                user_context=user_context,
+            )
 
             if skill_result.timeout:
                 if self._timeouts_broker:
@@ -234,65 +724,64 @@ class Agent:
                         user_id=user_id,
                         timeout=skill_result.timeout,
                     )
-                    self._timeouts_broker.execute(
+                    await _resolve(self._timeouts_broker.execute(
                         user_id=user_id,
                         timeout=skill_result.timeout,
                         timeout_uid=new_timeout_uid,
-                    )
+                    ))
 
             if not skill_result.is_relevant:
-                actual_skill_names = self._skill_classifier.classify(message, user_id)
+                actual_skill_names = await self._classify(message, user_id, turn)
                 if actual_skill_names:
-                    actual_state_names = [None for _ in actual_skill_names]
-                    return self._query(
+                    self._frames.discard(skill_result.frame)
+                    return await self._query(
                         message=message,
-                        user_context=dict(
-                            skill_names=actual_skill_names,
-                            state_names=actual_state_names,
-                            history=[],
-                            context={},
-                            calls_history={},
-                            timeout_uid=None,
-                        ),
+                        user_context=self._new_user_context(actual_skill_names),
                         user_id=user_id,
                         is_action=False,
                         timeout_uid=None,
+                        turn=turn,
                     )
 
             answers.extend(skill_result.answers)
 
             if not skill_result.is_finished:
-                new_skill_names = [skill_name]
-                new_state_names = [skill_result.direct_to]
-
-                if skill_result.direct_to:
-                    new_history = []
-                    calls_new = []
-                else:
-                    new_history = history + [message]
-
-                    calls_new = calls_history_global
-                    for func_name in calls_current:
-                        if func_name not in calls_new:
-                            calls_new[func_name] = []
-                        calls_new[func_name].extend(calls_current[func_name])
-
-                new_context = skill_result.context
-
+                new_user_context = self._continued_user_context(
+                    skill_name=skill_name,
+                    skill=skill,
+                    skill_result=skill_result,
+                    message=message,
+                    user_context=user_context,
+                    calls_current=calls_current,
+                )
                 break
 
-            context = {}
-            history = []
-
-            calls_history_global = {}
-            calls_history = {}
+            # the next skills are started from scratch
+            user_context = self._new_user_context([])
 
-        new_user_context = dict(
-            skill_names=new_skill_names,
-            state_names=new_state_names,
-            history=new_history,
-            context=new_context,
-            calls_history=calls_new,
-            timeout_uid=new_timeout_uid,
-        )
+        new_user_context['timeout_uid'] = new_timeout_uid
         return answers, new_user_context
+
+    async def _run_skill(
+        self,
+        skill: BaseSkill,
+        message: Any,
+        user_id: str,
+        state_name: Optional[str],
+        user_context: dict,
+    ) -> Tuple[SkillResult, dict]:
+        plan = get_interception_plan(skill)
+
+        if not plan or not skill._replays_history:
+            skill_result = await _resolve(
+                self._call_skill(skill, message, user_id, state_name, user_context)
+            )
+            return skill_result, {}
+
+        with plan.apply(user_context['calls_history']) as side_calls:
+            skill_result = await _resolve(
+                self._call_skill(
+                    plan.intercepted(skill), message, user_id, state_name, user_context
+                )
+            )
+        return skill_result, side_calls.current
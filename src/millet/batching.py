@@ -0,0 +1,235 @@
+import asyncio
+import inspect
+import threading
+from typing import Any, Dict, Hashable, List, Optional, Set, Union
+
+from millet.skill import BaseAsyncSkillClassifier, BaseSkill, BaseSkillClassifier
+
+
+class _ClassifyRequest:
+
+    def __init__(self, message: Any, user_id: str) -> None:
+        self.message = message
+        self.user_id = user_id
+        self.skill_names: Optional[List[str]] = None
+        self.error: Optional[BaseException] = None
+        self.done = threading.Event()
+
+    def result(self) -> List[str]:
+        if self.error is not None:
+            raise self.error
+        return self.skill_names
+
+
+class _MicroBatchingMixin:
+
+    def __init__(
+        self,
+        skill_classifier: Union[BaseSkillClassifier, BaseAsyncSkillClassifier],
+        window: float,
+        max_batch_size: int,
+    ) -> None:
+        if max_batch_size <= 0:
+            raise ValueError('max_batch_size must be positive')
+
+        self._skill_classifier = skill_classifier
+        self._window = window
+        self._max_batch_size = max_batch_size
+
+        self.batches = 0
+        self.batched_messages = 0
+        self._stats_lock = threading.Lock()
+
+    @property
+    def skills_map(self) -> Dict[str, BaseSkill]:
+        return self._skill_classifier.skills_map
+
+    @property
+    def is_deterministic(self) -> bool:
+        return self._skill_classifier.is_deterministic
+
+    @property
+    def classify_cache_size(self) -> int:
+        return self._skill_classifier.classify_cache_size
+
+    @property
+    def mean_batch_size(self) -> float:
+        return self.batched_messages / self.batches if self.batches else 0.0
+
+    def normalize_message(self, message: Any) -> Hashable:
+        return self._skill_classifier.normalize_message(message)
+
+    def _count_batch(self, size: int) -> None:
+        with self._stats_lock:
+            self.batches += 1
+            self.batched_messages += size
+
+    @staticmethod
+    def _checked(skill_names_batch: List[List[str]], size: int) -> List[List[str]]:
+        skill_names_batch = list(skill_names_batch)
+        if len(skill_names_batch) != size:
+            raise ValueError(
+                f'classify_batch returned {len(skill_names_batch)} results for {size} messages'
+            )
+        return skill_names_batch
+
+    def _chunks(self, requests: list) -> List[list]:
+        size = self._max_batch_size
+        return [requests[i:i + size] for i in range(0, len(requests), size)]
+
+
+class MicroBatchingSkillClassifier(_MicroBatchingMixin, BaseSkillClassifier):
+    """
+    Collects classify requests of concurrent threads into batches.
+
+    The first request waits `window` seconds (less if `max_batch_size` requests
+    are collected) and classifies all collected messages with one `classify_batch`
+    call of the wrapped classifier.
+    """
+
+    def __init__(
+        self,
+        skill_classifier: BaseSkillClassifier,
+        window: float = 0.005,
+        max_batch_size: int = 64,
+    ) -> None:
+        super().__init__(
+            skill_classifier=skill_classifier,
+            window=window,
+            max_batch_size=max_batch_size,
+        )
+        self._pending: List[_ClassifyRequest] = []
+        self._has_leader = False
+        self._condition = threading.Condition()
+
+    def classify(self, message: Any, user_id: str) -> List[str]:
+        request = _ClassifyRequest(message=message, user_id=user_id)
+
+        with self._condition:
+            self._pending.append(request)
+            is_leader = not self._has_leader
+            self._has_leader = True
+
+            if len(self._pending) >= self._max_batch_size:
+                self._condition.notify_all()
+
+        if is_leader:
+            with self._condition:
+                self._condition.wait_for(
+                    lambda: len(self._pending) >= self._max_batch_size,
+                    timeout=self._window,
+                )
+                requests = self._pending
+                self._pending = []
+                self._has_leader = False
+
+            for chunk in self._chunks(requests):
+                self._execute(chunk)
+
+        request.done.wait()
+        return request.result()
+
+    def classify_batch(self, messages: List[Any], user_ids: List[str]) -> List[List[str]]:
+        return self._skill_classifier.classify_batch(messages, user_ids)
+
+    def _execute(self, requests: List[_ClassifyRequest]) -> None:
+        self._count_batch(len(requests))
+        try:
+            skill_names_batch = self._skill_classifier.classify_batch(
+                [request.message for request in requests],
+                [request.user_id for request in requests],
+            )
+            skill_names_batch = self._checked(skill_names_batch, len(requests))
+        except Exception as error:
+            for request in requests:
+                request.error = error
+        else:
+            for request, skill_names in zip(requests, skill_names_batch):
+                request.skill_names = skill_names
+        finally:
+            for request in requests:
+                if request.skill_names is None and request.error is None:
+                    request.error = RuntimeError('The batch was interrupted')
+                request.done.set()
+
+
+class AsyncMicroBatchingSkillClassifier(_MicroBatchingMixin, BaseAsyncSkillClassifier):
+    """
+    Collects classify requests of concurrent coroutines into batches.
+
+    Requests collected during `window` seconds (or `max_batch_size` requests)
+    are classified with one `classify_batch` call of the wrapped classifier,
+    which may be either async or sync.
+    """
+
+    def __init__(
+        self,
+        skill_classifier: Union[BaseAsyncSkillClassifier, BaseSkillClassifier],
+        window: float = 0.005,
+        max_batch_size: int = 64,
+    ) -> None:
+        super().__init__(
+            skill_classifier=skill_classifier,
+            window=window,
+            max_batch_size=max_batch_size,
+        )
+        self._pending: List[tuple] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        # the loop keeps only weak references to tasks
+        self._tasks: Set[asyncio.Task] = set()
+
+    async def classify(self, message: Any, user_id: str) -> List[str]:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((message, user_id, future))
+
+        if len(self._pending) >= self._max_batch_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self._window, self._flush)
+
+        return await future
+
+    async def classify_batch(self, messages: List[Any], user_ids: List[str]) -> List[List[str]]:
+        return await self._classify_batch(messages, user_ids)
+
+    def _flush(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+        requests = self._pending
+        self._pending = []
+
+        for chunk in self._chunks(requests):
+            task = asyncio.ensure_future(self._execute(chunk))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _classify_batch(self, messages: List[Any], user_ids: List[str]) -> List[List[str]]:
+        skill_names_batch = self._skill_classifier.classify_batch(messages, user_ids)
+        if inspect.isawaitable(skill_names_batch):
+            skill_names_batch = await skill_names_batch
+        return skill_names_batch
+
+    async def _execute(self, requests: List[tuple]) -> None:
+        self._count_batch(len(requests))
+        try:
+            skill_names_batch = await self._classify_batch(
+                [message for message, _, _ in requests],
+                [user_id for _, user_id, _ in requests],
+            )
+            skill_names_batch = self._checked(skill_names_batch, len(requests))
+        except Exception as error:
+            for _, _, future in requests:
+                if not future.done():
+                    future.set_exception(error)
+        else:
+            for (_, _, future), skill_names in zip(requests, skill_names_batch):
+                if not future.done():
+                    future.set_result(skill_names)
+        finally:
+            # the batch was cancelled, waiters aren't left hanging
+            for _, _, future in requests:
+                if not future.done():
+                    future.cancel()
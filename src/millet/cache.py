@@ -0,0 +1,114 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Hashable, Optional
+
+
+class LRUCache:
+    """Thread-safe cache of a bounded size, the least recently used item is evicted first."""
+
+    def __init__(self, max_size: int) -> None:
+        if max_size <= 0:
+            raise ValueError('max_size must be positive')
+
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._items
+
+    def get(self, key: Hashable, default: Optional[Any] = None) -> Any:
+        with self._lock:
+            try:
+                value = self._items[key]
+            except KeyError:
+                self.misses += 1
+                return default
+
+            self._items.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key: Hashable, value: Any) -> None:
+        with self._lock:
+            self._items[key] = value
+            self._items.move_to_end(key)
+
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._items.clear()
+
+
+class NegativeCache:
+    """
+    Thread-safe bounded set of keys known to be absent, entries expire after `ttl` seconds.
+
+    Every invalidation starts a new generation. A key is added only if no key was
+    invalidated since the generation read before the lookup, so a lookup racing
+    with a write never caches a stale miss.
+    """
+
+    def __init__(self, max_size: int = 100000, ttl: float = 30.0) -> None:
+        if max_size <= 0:
+            raise ValueError('max_size must be positive')
+        if ttl <= 0:
+            raise ValueError('ttl must be positive')
+
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._expires_at = OrderedDict()
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._expires_at)
+
+    def __contains__(self, key: Hashable) -> bool:
+        with self._lock:
+            expires_at = self._expires_at.get(key)
+            if expires_at is not None and expires_at <= time.monotonic():
+                del self._expires_at[key]
+                expires_at = None
+
+            if expires_at is None:
+                self.misses += 1
+                return False
+
+            self.hits += 1
+            return True
+
+    @property
+    def generation(self) -> int:
+        return self._generation
+
+    def add(self, key: Hashable, generation: Optional[int] = None) -> None:
+        with self._lock:
+            if generation is not None and generation != self._generation:
+                return
+
+            self._expires_at[key] = time.monotonic() + self.ttl
+            self._expires_at.move_to_end(key)
+
+            while len(self._expires_at) > self.max_size:
+                self._expires_at.popitem(last=False)
+
+    def invalidate(self, key: Hashable) -> None:
+        with self._lock:
+            self._generation += 1
+            self._expires_at.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._generation += 1
+            self._expires_at.clear()
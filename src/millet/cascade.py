@@ -0,0 +1,122 @@
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+from millet.skill import BaseSkill, BaseSkillClassifier
+
+
+class CascadeStage:
+    """Classifier of a cascade, its result is accepted if the confidence reaches the threshold."""
+
+    def __init__(
+        self,
+        skill_classifier: BaseSkillClassifier,
+        threshold: float = 0.0,
+        name: Optional[str] = None,
+    ) -> None:
+        self.skill_classifier = skill_classifier
+        self.threshold = threshold
+        self.name = name or skill_classifier.__class__.__name__
+
+
+class CascadeSkillClassifier(BaseSkillClassifier):
+    """
+    Tries stages in order and stops at the first stage which is confident.
+
+    Cheap stages (exact lookup, keywords) go first, so expensive models are
+    called only for messages which cheap stages can't route. The deciding stage
+    of every message is counted in `stage_hits`, None counts undecided messages.
+    """
+
+    def __init__(self, stages: List[CascadeStage]) -> None:
+        if not stages:
+            raise ValueError('Cascade must have stages')
+
+        stage_names = [stage.name for stage in stages]
+        if len(set(stage_names)) != len(stage_names):
+            raise ValueError(f'Names of stages must be unique, got {stage_names}')
+
+        self._stages = list(stages)
+        self._skills_map = {}
+        for stage in self._stages:
+            for skill_name, skill in stage.skill_classifier.skills_map.items():
+                self._skills_map.setdefault(skill_name, skill)
+
+        self.stage_hits: Dict[Optional[str], int] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def skills_map(self) -> Dict[str, BaseSkill]:
+        return self._skills_map
+
+    @property
+    def is_deterministic(self) -> bool:
+        return all(stage.skill_classifier.is_deterministic for stage in self._stages)
+
+    def classify(self, message: Any, user_id: str) -> List[str]:
+        skill_names, _, _ = self.decide(message, user_id)
+        return skill_names
+
+    def classify_batch(self, messages: List[Any], user_ids: List[str]) -> List[List[str]]:
+        return [skill_names for skill_names, _, _ in self.decide_batch(messages, user_ids)]
+
+    def score(self, message: Any, user_id: str) -> Tuple[List[str], float]:
+        skill_names, confidence, _ = self.decide(message, user_id)
+        return skill_names, confidence
+
+    def score_batch(
+        self,
+        messages: List[Any],
+        user_ids: List[str],
+    ) -> List[Tuple[List[str], float]]:
+        return [
+            (skill_names, confidence)
+            for skill_names, confidence, _ in self.decide_batch(messages, user_ids)
+        ]
+
+    def decide(self, message: Any, user_id: str) -> Tuple[List[str], float, Optional[str]]:
+        """Returns skill names, confidence and the name of the deciding stage."""
+
+        for stage in self._stages:
+            skill_names, confidence = stage.skill_classifier.score(message, user_id)
+            if skill_names and confidence >= stage.threshold:
+                self._count(stage.name)
+                return skill_names, confidence, stage.name
+
+        self._count(None)
+        return [], 0.0, None
+
+    def decide_batch(
+        self,
+        messages: List[Any],
+        user_ids: List[str],
+    ) -> List[Tuple[List[str], float, Optional[str]]]:
+        """Like decide, every stage scores all its undecided messages with one score_batch call."""
+
+        decisions = [([], 0.0, None) for _ in messages]
+        positions = list(range(len(messages)))
+
+        for stage in self._stages:
+            if not positions:
+                break
+
+            results = stage.skill_classifier.score_batch(
+                [messages[position] for position in positions],
+                [user_ids[position] for position in positions],
+            )
+
+            undecided_positions = []
+            for position, (skill_names, confidence) in zip(positions, results):
+                if skill_names and confidence >= stage.threshold:
+                    decisions[position] = (skill_names, confidence, stage.name)
+                    self._count(stage.name)
+                else:
+                    undecided_positions.append(position)
+            positions = undecided_positions
+
+        for _ in positions:
+            self._count(None)
+        return decisions
+
+    def _count(self, stage_name: Optional[str]) -> None:
+        with self._lock:
+            self.stage_hits[stage_name] = self.stage_hits.get(stage_name, 0) + 1
@@ -1,8 +1,20 @@
+import asyncio
+import json
 import pickle
+import threading
+import time
+import uuid
 from abc import ABC, abstractmethod
-from typing import Any, TypeVar
+from collections import OrderedDict
+from copy import deepcopy
+from typing import Any, Callable, Dict, List, Optional, Tuple, TypeVar, Union
+
+from millet.cache import NegativeCache
+from millet.history import History
+from millet.serializers import BaseSerializer, BinarySerializer
 
 Redis = TypeVar('Redis')
+AsyncRedis = TypeVar('AsyncRedis')
 
 
 # UserContext is dict for best compatibility
@@ -12,6 +24,175 @@ Redis = TypeVar('Redis')
 # context: dict
 # calls_history: dict
 # timeout_uid: Optional[str]
+# frame: Optional[dict] - position of a generator skill
+
+
+class UserContextChanges:
+    """
+    Difference of a new user context from the loaded one.
+
+    `fields` are new values of changed fields except history and calls_history,
+    `removed_fields` are names of removed fields. Appended messages and calls
+    are in `history` and `calls`, if a history doesn't continue the loaded one
+    it's rewritten entirely.
+    """
+
+    _appendable_fields = ('history', 'calls_history')
+
+    def __init__(
+        self,
+        fields: Dict[str, Any],
+        removed_fields: List[str],
+        history: List[Any],
+        history_rewritten: bool,
+        calls: List[Tuple[str, Any]],
+        calls_rewritten: bool,
+    ) -> None:
+        self.fields = fields
+        self.removed_fields = removed_fields
+        self.history = history
+        self.history_rewritten = history_rewritten
+        self.calls = calls
+        self.calls_rewritten = calls_rewritten
+
+    @property
+    def is_empty(self) -> bool:
+        return not (
+            self.fields
+            or self.removed_fields
+            or self.history
+            or self.history_rewritten
+            or self.calls
+            or self.calls_rewritten
+        )
+
+    @classmethod
+    def between(cls, user_context: dict, new_user_context: dict) -> 'UserContextChanges':
+        fields = {
+            field: value
+            for field, value in new_user_context.items()
+            if field not in cls._appendable_fields
+            and (field not in user_context or user_context[field] != value)
+        }
+        removed_fields = [
+            field
+            for field in user_context
+            if field not in new_user_context and field not in cls._appendable_fields
+        ]
+
+        history = History.of(new_user_context.get('history', ())).appended_since(
+            user_context.get('history', ())
+        )
+
+        calls = []
+        calls_history = user_context.get('calls_history', {})
+        new_calls_history = new_user_context.get('calls_history', {})
+        calls_rewritten = not set(calls_history) <= set(new_calls_history)
+
+        for func_name, results in new_calls_history.items():
+            if calls_rewritten:
+                break
+
+            appended_results = History.of(results).appended_since(calls_history.get(func_name, ()))
+            if appended_results is None:
+                calls_rewritten = True
+            else:
+                calls.extend((func_name, result) for result in appended_results)
+
+        if calls_rewritten:
+            calls = [
+                (func_name, result)
+                for func_name, results in new_calls_history.items()
+                for result in results
+            ]
+
+        return cls(
+            fields=fields,
+            removed_fields=removed_fields,
+            history=list(new_user_context.get('history', ())) if history is None else history,
+            history_rewritten=history is None,
+            calls=calls,
+            calls_rewritten=calls_rewritten,
+        )
+
+
+# values of these types can't be changed in place, so they aren't copied
+_immutable_types = frozenset({str, bytes, int, float, complex, bool, type(None)})
+
+
+class CopyOnReadContext(dict):
+    """
+    Context of a skill which shares values with the loaded context until they are read.
+
+    A value is deep-copied when it's read for the first time, so a skill may change it
+    in place, and values which aren't used during a turn aren't copied. The loaded
+    context is kept intact for finding changes of the turn.
+    """
+
+    __slots__ = ('_copied',)
+
+    def __init__(self, context: dict) -> None:
+        super().__init__(context)
+        self._copied = set()
+
+    def __getitem__(self, key: Any) -> Any:
+        value = super().__getitem__(key)
+        if key in self._copied:
+            return value
+
+        self._copied.add(key)
+        if type(value) not in _immutable_types:
+            value = deepcopy(value)
+            super().__setitem__(key, value)
+        return value
+
+    def __setitem__(self, key: Any, value: Any) -> None:
+        self._copied.add(key)
+        super().__setitem__(key, value)
+
+    def get(self, key: Any, default: Any = None) -> Any:
+        return self[key] if key in self else default
+
+    def setdefault(self, key: Any, default: Any = None) -> Any:
+        if key not in self:
+            self[key] = default
+        return self[key]
+
+    def pop(self, key: Any, *default: Any) -> Any:
+        if key not in self:
+            return super().pop(key, *default)
+        value = self[key]
+        del self[key]
+        return value
+
+    def popitem(self) -> Tuple[Any, Any]:
+        if not self:
+            raise KeyError('popitem(): dictionary is empty')
+        key = next(reversed(self))
+        return key, self.pop(key)
+
+    def values(self):
+        self._copy_all()
+        return super().values()
+
+    def items(self):
+        self._copy_all()
+        return super().items()
+
+    def copy(self) -> dict:
+        self._copy_all()
+        return dict(self)
+
+    def __or__(self, other: Any) -> dict:
+        return self.copy() | other
+
+    def __reduce__(self):
+        return dict, (self.copy(),)
+
+    def _copy_all(self) -> None:
+        for key in self:
+            if key not in self._copied:
+                self[key]
 
 
 class BaseContextManager(ABC):
@@ -24,6 +205,30 @@ class BaseContextManager(ABC):
     def get_user_context(self, user_id: str) -> dict:
         pass
 
+    def get_many(self, user_ids: List[str]) -> Dict[str, dict]:
+        return {user_id: self.get_user_context(user_id) for user_id in user_ids}
+
+    def set_many(self, user_contexts: Dict[str, dict]) -> None:
+        for user_id, user_context in user_contexts.items():
+            self.set_user_context(user_id, user_context)
+
+    # the agent passes changes of the loaded context, so a context manager
+    # may write only them instead of the whole context
+    def update_user_context(
+        self,
+        user_id: str,
+        user_context: dict,
+        changes: UserContextChanges,
+    ) -> None:
+        self.set_user_context(user_id, user_context)
+
+    def update_many(
+        self,
+        user_contexts: Dict[str, dict],
+        changes: Dict[str, UserContextChanges],
+    ) -> None:
+        self.set_many(user_contexts)
+
     @property
     def _empty_user_context(self) -> dict:
         return dict(
@@ -33,9 +238,45 @@ class BaseContextManager(ABC):
             context={},
             calls_history={},
             timeout_uid=None,
+            frame=None,
         )
 
 
+class BaseAsyncContextManager(ABC):
+
+    @abstractmethod
+    async def set_user_context(self, user_id: str, user_context: dict) -> None:
+        pass
+
+    @abstractmethod
+    async def get_user_context(self, user_id: str) -> dict:
+        pass
+
+    async def get_many(self, user_ids: List[str]) -> Dict[str, dict]:
+        return {user_id: await self.get_user_context(user_id) for user_id in user_ids}
+
+    async def set_many(self, user_contexts: Dict[str, dict]) -> None:
+        for user_id, user_context in user_contexts.items():
+            await self.set_user_context(user_id, user_context)
+
+    async def update_user_context(
+        self,
+        user_id: str,
+        user_context: dict,
+        changes: UserContextChanges,
+    ) -> None:
+        await self.set_user_context(user_id, user_context)
+
+    async def update_many(
+        self,
+        user_contexts: Dict[str, dict],
+        changes: Dict[str, UserContextChanges],
+    ) -> None:
+        await self.set_many(user_contexts)
+
+    _empty_user_context = BaseContextManager._empty_user_context
+
+
 class RAMContextManager(BaseContextManager):
 
     def __init__(self) -> None:
@@ -48,6 +289,132 @@ class RAMContextManager(BaseContextManager):
         return self._storage.get(user_id, self._empty_user_context)
 
 
+def _pickled_size(user_context: dict) -> int:
+    return len(pickle.dumps(user_context, pickle.HIGHEST_PROTOCOL))
+
+
+class _RAMEntry:
+
+    __slots__ = ('user_context', 'size', 'used_at')
+
+    def __init__(self, user_context: dict, size: int, used_at: float) -> None:
+        self.user_context = user_context
+        self.size = size
+        self.used_at = used_at
+
+
+class BoundedRAMContextManager(BaseContextManager):
+    """
+    Thread-safe RAM context manager of a bounded size.
+
+    Contexts are kept in the order of their last use. The least recently used context
+    is evicted when there are more than `max_size` contexts or they take more than
+    `max_bytes`, contexts which weren't used for `ttl` seconds expire. Finished dialogues
+    (empty contexts) aren't stored at all. Sizes are approximated by `sizeof`, by default
+    the length of the pickled context, and are computed only if `max_bytes` is set.
+    """
+
+    def __init__(
+        self,
+        max_size: Optional[int] = 100000,
+        max_bytes: Optional[int] = None,
+        ttl: Optional[float] = None,
+        sizeof: Optional[Callable[[dict], int]] = None,
+    ) -> None:
+        for name, value in (('max_size', max_size), ('max_bytes', max_bytes), ('ttl', ttl)):
+            if value is not None and value <= 0:
+                raise ValueError(f'{name} must be positive')
+
+        self.max_size = max_size
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._sizeof = sizeof or _pickled_size
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.bytes = 0
+
+        self._entries: 'OrderedDict[str, _RAMEntry]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, user_id: str) -> bool:
+        return user_id in self._entries
+
+    def get_user_context(self, user_id: str) -> dict:
+        now = time.monotonic()
+        with self._lock:
+            self._expire(now)
+
+            entry = self._entries.get(user_id)
+            if entry is None:
+                self.misses += 1
+                return self._empty_user_context
+
+            entry.used_at = now
+            self._entries.move_to_end(user_id)
+            self.hits += 1
+            return entry.user_context
+
+    def set_user_context(self, user_id: str, user_context: dict) -> None:
+        is_finished = user_context == self._empty_user_context
+        size = self._sizeof(user_context) if self.max_bytes is not None and not is_finished else 0
+
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.pop(user_id, None)
+            if entry is not None:
+                self.bytes -= entry.size
+
+            if not is_finished:
+                self._entries[user_id] = _RAMEntry(user_context, size, now)
+                self.bytes += size
+
+            self._expire(now)
+            self._evict()
+
+    def delete_user_context(self, user_id: str) -> None:
+        with self._lock:
+            entry = self._entries.pop(user_id, None)
+            if entry is not None:
+                self.bytes -= entry.size
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+
+    def _expire(self, now: float) -> None:
+        if self.ttl is None:
+            return
+
+        # entries are ordered by the last use, so expired ones are in the beginning
+        entries = self._entries
+        while entries:
+            user_id, entry = next(iter(entries.items()))
+            if now - entry.used_at < self.ttl:
+                break
+
+            del entries[user_id]
+            self.bytes -= entry.size
+            self.expirations += 1
+
+    def _evict(self) -> None:
+        entries = self._entries
+        while (
+            (self.max_size is not None and len(entries) > self.max_size)
+            # the last written context is kept even if it's larger than the budget
+            or (self.max_bytes is not None and self.bytes > self.max_bytes and len(entries) > 1)
+        ):
+            _, entry = entries.popitem(last=False)
+            self.bytes -= entry.size
+            self.evictions += 1
+
+
 class PickleSerializer:
 
     def loads(self, serialized_param: str) -> Any:
@@ -59,27 +426,577 @@ class PickleSerializer:
         return serialized_param
 
 
-class RedisContextManager(BaseContextManager):
+class _RedisContextManagerMixin:
+    """
+    Stores a user context in the key `<user_id>`.
+
+    With a negative cache users without a stored context are answered without a request
+    to Redis. Writes publish user ids to `invalidation_channel` and every
+    manager with a negative cache listens to it, so all workers sharing one Redis must
+    use the same channel. Invalidations lost while the connection is broken are covered
+    by clearing the cache and by the TTL of its entries. Empty contexts (finished dialogues)
+    are deleted instead of being stored, so their users are cached as absent again.
+    """
+
+    default_invalidation_channel = 'millet:contexts:invalidate'
 
-    def __init__(self, redis: Redis):
+    def __init__(
+        self,
+        redis: Union[Redis, AsyncRedis],
+        serializer: Optional[BaseSerializer] = None,
+        negative_cache: Optional[NegativeCache] = None,
+        invalidation_channel: Optional[str] = None,
+    ):
         self._redis = redis
-        self._serializer = PickleSerializer()
+        # reads contexts written by PickleSerializer as well
+        self._serializer = serializer or BinarySerializer()
+        self._negative_cache = negative_cache
+
+        if invalidation_channel is None and negative_cache is not None:
+            invalidation_channel = self.default_invalidation_channel
+        self._invalidation_channel = invalidation_channel
+        self._sender = uuid.uuid4().hex
+
+    @property
+    def negative_cache(self) -> Optional[NegativeCache]:
+        return self._negative_cache
 
-    def _serialize_user_context(self, user_context: dict) -> str:
+    def _serialize_user_context(self, user_context: dict) -> bytes:
         return self._serializer.dumps(user_context)
 
-    def _deserialize_user_context(self, serialized_user_context: str) -> dict:
+    def _deserialize_user_context(self, serialized_user_context: bytes) -> dict:
         return self._serializer.loads(serialized_user_context)
 
+    def _load_user_context(self, serialized_user_context: Optional[bytes]) -> dict:
+        if not serialized_user_context:
+            return self._empty_user_context
+
+        user_context = self._deserialize_user_context(serialized_user_context)
+        return user_context
+
+    def _user_ids_to_load(self, user_ids: List[str]) -> Tuple[List[str], int]:
+        if self._negative_cache is None:
+            return user_ids, 0
+
+        # the generation is read before the lookup, see NegativeCache
+        generation = self._negative_cache.generation
+        return [user_id for user_id in user_ids if user_id not in self._negative_cache], generation
+
+    def _loaded_user_contexts(
+        self,
+        user_ids: List[str],
+        loaded_user_ids: List[str],
+        serialized_user_contexts: List[Optional[bytes]],
+        generation: int,
+    ) -> Dict[str, dict]:
+        loaded = dict(zip(loaded_user_ids, serialized_user_contexts))
+
+        if self._negative_cache is not None:
+            for user_id, serialized_user_context in loaded.items():
+                if serialized_user_context is None:
+                    self._negative_cache.add(user_id, generation)
+
+        return {
+            user_id: self._load_user_context(loaded.get(user_id))
+            for user_id in user_ids
+        }
+
+    def _queue_set_many(
+        self,
+        pipeline,
+        user_contexts: Dict[str, dict],
+    ) -> Tuple[List[str], List[str]]:
+        """Queues writes of contexts and deletes of empty ones, returns written and deleted users."""
+
+        empty_user_context = self._empty_user_context
+        written_user_ids = []
+        deleted_user_ids = []
+        for user_id, user_context in user_contexts.items():
+            if user_context == empty_user_context:
+                deleted_user_ids.append(user_id)
+            else:
+                written_user_ids.append(user_id)
+                pipeline.set(user_id, self._serialize_user_context(user_context))
+
+        if deleted_user_ids:
+            pipeline.delete(*deleted_user_ids)
+        self._queue_invalidation(pipeline, written_user_ids)
+        return written_user_ids, deleted_user_ids
+
+    def _queue_invalidation(self, pipeline, user_ids: List[str]) -> None:
+        # a delete doesn't make cached misses stale, so only writes are published
+        if self._invalidation_channel is not None and user_ids:
+            pipeline.publish(
+                self._invalidation_channel,
+                json.dumps({'sender': self._sender, 'user_ids': user_ids}),
+            )
+
+    def _written(
+        self,
+        written_user_ids: List[str],
+        deleted_user_ids: List[str],
+        generation: int,
+    ) -> None:
+        if self._negative_cache is None:
+            return
+
+        # deleted users are added with the generation read before the write,
+        # so they aren't added if a context of theirs was written meanwhile
+        for user_id in deleted_user_ids:
+            self._negative_cache.add(user_id, generation)
+        self._invalidate(written_user_ids)
+
+    def _invalidate(self, user_ids: List[str]) -> None:
+        if self._negative_cache is not None:
+            for user_id in user_ids:
+                self._negative_cache.invalidate(user_id)
+
+    def _on_invalidation(self, message: dict) -> None:
+        invalidation = json.loads(message['data'])
+        # own writes are invalidated when they are done
+        if invalidation['sender'] != self._sender:
+            self._invalidate(invalidation['user_ids'])
+
+
+class RedisContextManager(_RedisContextManagerMixin, BaseContextManager):
+
+    def __init__(
+        self,
+        redis: Redis,
+        serializer: Optional[BaseSerializer] = None,
+        negative_cache: Optional[NegativeCache] = None,
+        invalidation_channel: Optional[str] = None,
+    ):
+        super().__init__(
+            redis=redis,
+            serializer=serializer,
+            negative_cache=negative_cache,
+            invalidation_channel=invalidation_channel,
+        )
+
+        self._listener = None
+        if negative_cache is not None:
+            pubsub = redis.pubsub(ignore_subscribe_messages=True)
+            pubsub.subscribe(**{self._invalidation_channel: self._on_invalidation})
+            self._listener = pubsub.run_in_thread(
+                sleep_time=0.1,
+                daemon=True,
+                exception_handler=self._on_listener_error,
+            )
+
+    def close(self) -> None:
+        """Stops listening to invalidations of the negative cache."""
+
+        if self._listener is not None:
+            self._listener.stop()
+            self._listener.join()
+            self._listener = None
+
     def set_user_context(self, user_id: str, user_context: dict) -> None:
+        if self._invalidation_channel is not None or user_context == self._empty_user_context:
+            self.set_many({user_id: user_context})
+            return
+
         serialized_user_context = self._serialize_user_context(user_context)
         self._redis.set(user_id, serialized_user_context)
 
     def get_user_context(self, user_id: str) -> dict:
+        if self._negative_cache is not None:
+            return self.get_many([user_id])[user_id]
+
         serialized_user_context = self._redis.get(user_id)
-        if not serialized_user_context:
-            return self._empty_user_context
+        return self._load_user_context(serialized_user_context)
+
+    def delete_user_context(self, user_id: str) -> None:
+        self.delete_many([user_id])
+
+    def get_many(self, user_ids: List[str]) -> Dict[str, dict]:
+        if not user_ids:
+            return {}
+
+        user_ids_to_load, generation = self._user_ids_to_load(user_ids)
+        serialized_user_contexts = self._redis.mget(user_ids_to_load) if user_ids_to_load else []
+        return self._loaded_user_contexts(
+            user_ids,
+            user_ids_to_load,
+            serialized_user_contexts,
+            generation,
+        )
+
+    def set_many(self, user_contexts: Dict[str, dict]) -> None:
+        if not user_contexts:
+            return
+
+        generation = self._negative_cache.generation if self._negative_cache is not None else 0
+        pipeline = self._redis.pipeline(transaction=self._invalidation_channel is not None)
+        written_user_ids, deleted_user_ids = self._queue_set_many(pipeline, user_contexts)
+        pipeline.execute()
+        self._written(written_user_ids, deleted_user_ids, generation)
+
+    def delete_many(self, user_ids: List[str]) -> None:
+        if not user_ids:
+            return
+
+        generation = self._negative_cache.generation if self._negative_cache is not None else 0
+        self._redis.delete(*user_ids)
+        self._written([], user_ids, generation)
+
+    def _on_listener_error(self, error: Exception, pubsub, listener) -> None:
+        # invalidations may be lost while the connection is broken
+        self._negative_cache.clear()
+        time.sleep(1.0)
+
+
+class AsyncRedisContextManager(_RedisContextManagerMixin, BaseAsyncContextManager):
+
+    def __init__(
+        self,
+        redis: AsyncRedis,
+        serializer: Optional[BaseSerializer] = None,
+        negative_cache: Optional[NegativeCache] = None,
+        invalidation_channel: Optional[str] = None,
+    ):
+        super().__init__(
+            redis=redis,
+            serializer=serializer,
+            negative_cache=negative_cache,
+            invalidation_channel=invalidation_channel,
+        )
+        self._pubsub = None
+        self._listener = None
+        # created in the loop of the manager
+        self._listener_lock: Optional[asyncio.Lock] = None
+
+    async def close(self) -> None:
+        """Stops listening to invalidations of the negative cache."""
+
+        if self._listener is not None:
+            self._listener.cancel()
+            try:
+                await self._listener
+            except asyncio.CancelledError:
+                pass
+            # aclose appeared in redis 5, reset is deprecated there
+            close = getattr(self._pubsub, 'aclose', None) or self._pubsub.reset
+            await close()
+            self._listener = None
+            self._pubsub = None
+
+    async def set_user_context(self, user_id: str, user_context: dict) -> None:
+        if self._invalidation_channel is not None or user_context == self._empty_user_context:
+            await self.set_many({user_id: user_context})
+            return
+
+        serialized_user_context = self._serialize_user_context(user_context)
+        await self._redis.set(user_id, serialized_user_context)
+
+    async def get_user_context(self, user_id: str) -> dict:
+        if self._negative_cache is not None:
+            return (await self.get_many([user_id]))[user_id]
+
+        serialized_user_context = await self._redis.get(user_id)
+        return self._load_user_context(serialized_user_context)
+
+    async def delete_user_context(self, user_id: str) -> None:
+        await self.delete_many([user_id])
+
+    async def get_many(self, user_ids: List[str]) -> Dict[str, dict]:
+        if not user_ids:
+            return {}
+
+        if self._negative_cache is not None and self._listener is None:
+            await self._start_listener()
+
+        user_ids_to_load, generation = self._user_ids_to_load(user_ids)
+        serialized_user_contexts = (
+            await self._redis.mget(user_ids_to_load) if user_ids_to_load else []
+        )
+        return self._loaded_user_contexts(
+            user_ids,
+            user_ids_to_load,
+            serialized_user_contexts,
+            generation,
+        )
+
+    async def set_many(self, user_contexts: Dict[str, dict]) -> None:
+        if not user_contexts:
+            return
+
+        generation = self._negative_cache.generation if self._negative_cache is not None else 0
+        pipeline = self._redis.pipeline(transaction=self._invalidation_channel is not None)
+        written_user_ids, deleted_user_ids = self._queue_set_many(pipeline, user_contexts)
+        await pipeline.execute()
+        self._written(written_user_ids, deleted_user_ids, generation)
+
+    async def delete_many(self, user_ids: List[str]) -> None:
+        if not user_ids:
+            return
+
+        generation = self._negative_cache.generation if self._negative_cache is not None else 0
+        await self._redis.delete(*user_ids)
+        self._written([], user_ids, generation)
+
+    async def _start_listener(self) -> None:
+        if self._listener_lock is None:
+            self._listener_lock = asyncio.Lock()
+
+        # coroutines which missed the listener wait for the first one to start it
+        async with self._listener_lock:
+            if self._listener is not None:
+                return
+
+            # the subscription is confirmed before the first miss is cached
+            pubsub = self._redis.pubsub(ignore_subscribe_messages=True)
+            await pubsub.subscribe(self._invalidation_channel)
+            self._pubsub = pubsub
+            self._listener = asyncio.ensure_future(self._listen())
+
+    async def _listen(self) -> None:
+        while True:
+            try:
+                message = await self._pubsub.get_message(
+                    ignore_subscribe_messages=True,
+                    timeout=1.0,
+                )
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                # invalidations may be lost while the connection is broken
+                self._negative_cache.clear()
+                await asyncio.sleep(1.0)
+                continue
+
+            if message is not None:
+                self._on_invalidation(message)
+
+
+class _FieldRedisContextManagerMixin:
+    """
+    Stores every field of a user context separately.
+
+    Fields except history and calls_history are stored in the hash `<user_id>:fields`,
+    messages of history are appended to the list `<user_id>:history` and calls of side
+    functions to the list `<user_id>:calls`, so a write is proportional to changes.
+    A context is written as changes of the empty context, so its fields are loaded
+    on top of the empty context. Keys of finished dialogues (empty contexts) are deleted.
+    """
+
+    _scalar_fields_suffix = ':fields'
+    _history_suffix = ':history'
+    _calls_suffix = ':calls'
+
+    def __init__(
+        self,
+        redis: Union[Redis, AsyncRedis],
+        serializer: Optional[BaseSerializer] = None,
+        key_prefix: str = '',
+    ):
+        self._redis = redis
+        self._serializer = serializer or BinarySerializer()
+        self._key_prefix = key_prefix
+
+    def _keys(self, user_id: str) -> Tuple[str, str, str]:
+        key = f'{self._key_prefix}{user_id}'
+        return (
+            key + self._scalar_fields_suffix,
+            key + self._history_suffix,
+            key + self._calls_suffix,
+        )
+
+    def _queue_get(self, pipeline, user_id: str) -> None:
+        fields_key, history_key, calls_key = self._keys(user_id)
+        pipeline.hgetall(fields_key)
+        pipeline.lrange(history_key, 0, -1)
+        pipeline.lrange(calls_key, 0, -1)
+
+    def _load_user_context(
+        self,
+        serialized_fields: Dict[bytes, bytes],
+        serialized_history: List[bytes],
+        serialized_calls: List[bytes],
+    ) -> dict:
+        user_context = self._empty_user_context
+        if not (serialized_fields or serialized_history or serialized_calls):
+            return user_context
+
+        load_value = self._serializer.load_value
+
+        # fields equal to the empty context may be not stored, they are taken from it
+        for field, serialized_value in serialized_fields.items():
+            user_context[field.decode()] = load_value(serialized_value)
+        user_context['history'] = History(load_value(message) for message in serialized_history)
+
+        calls_history = {}
+        for serialized_call in serialized_calls:
+            func_name, result = load_value(serialized_call)
+            calls_history.setdefault(func_name, []).append(result)
+        user_context['calls_history'] = {
+            func_name: History(results) for func_name, results in calls_history.items()
+        }
 
-        serialized_user_context = serialized_user_context.decode()
-        user_context = self._deserialize_user_context(serialized_user_context)
         return user_context
+
+    def _queue_set(self, pipeline, user_id: str, user_context: dict) -> None:
+        self._queue_update(
+            pipeline=pipeline,
+            user_id=user_id,
+            user_context=user_context,
+            changes=UserContextChanges.between(self._empty_user_context, user_context),
+            rewrite=True,
+        )
+
+    def _queue_update(
+        self,
+        pipeline,
+        user_id: str,
+        user_context: dict,
+        changes: UserContextChanges,
+        rewrite: bool = False,
+    ) -> None:
+        if user_context == self._empty_user_context:
+            pipeline.delete(*self._keys(user_id))
+            return
+
+        fields_key, history_key, calls_key = self._keys(user_id)
+        dump_value = self._serializer.dump_value
+
+        if rewrite:
+            pipeline.delete(fields_key)
+        if changes.removed_fields:
+            pipeline.hdel(fields_key, *changes.removed_fields)
+        if changes.fields:
+            pipeline.hset(fields_key, mapping={
+                field: dump_value(value) for field, value in changes.fields.items()
+            })
+
+        if rewrite or changes.history_rewritten:
+            pipeline.delete(history_key)
+        if changes.history:
+            pipeline.rpush(history_key, *[dump_value(message) for message in changes.history])
+
+        if rewrite or changes.calls_rewritten:
+            pipeline.delete(calls_key)
+        if changes.calls:
+            pipeline.rpush(calls_key, *[dump_value(list(call)) for call in changes.calls])
+
+
+class FieldRedisContextManager(_FieldRedisContextManagerMixin, BaseContextManager):
+
+    def __init__(
+        self,
+        redis: Redis,
+        serializer: Optional[BaseSerializer] = None,
+        key_prefix: str = '',
+    ):
+        super().__init__(redis=redis, serializer=serializer, key_prefix=key_prefix)
+
+    def set_user_context(self, user_id: str, user_context: dict) -> None:
+        self.set_many({user_id: user_context})
+
+    def get_user_context(self, user_id: str) -> dict:
+        return self.get_many([user_id])[user_id]
+
+    def get_many(self, user_ids: List[str]) -> Dict[str, dict]:
+        if not user_ids:
+            return {}
+
+        pipeline = self._redis.pipeline(transaction=True)
+        for user_id in user_ids:
+            self._queue_get(pipeline, user_id)
+        results = pipeline.execute()
+
+        return {
+            user_id: self._load_user_context(*results[3 * i:3 * i + 3])
+            for i, user_id in enumerate(user_ids)
+        }
+
+    def set_many(self, user_contexts: Dict[str, dict]) -> None:
+        if not user_contexts:
+            return
+
+        pipeline = self._redis.pipeline(transaction=True)
+        for user_id, user_context in user_contexts.items():
+            self._queue_set(pipeline, user_id, user_context)
+        pipeline.execute()
+
+    def update_user_context(
+        self,
+        user_id: str,
+        user_context: dict,
+        changes: UserContextChanges,
+    ) -> None:
+        self.update_many({user_id: user_context}, {user_id: changes})
+
+    def update_many(
+        self,
+        user_contexts: Dict[str, dict],
+        changes: Dict[str, UserContextChanges],
+    ) -> None:
+        if not user_contexts:
+            return
+
+        pipeline = self._redis.pipeline(transaction=True)
+        for user_id, user_context in user_contexts.items():
+            self._queue_update(pipeline, user_id, user_context, changes[user_id])
+        pipeline.execute()
+
+
+class AsyncFieldRedisContextManager(_FieldRedisContextManagerMixin, BaseAsyncContextManager):
+
+    def __init__(
+        self,
+        redis: AsyncRedis,
+        serializer: Optional[BaseSerializer] = None,
+        key_prefix: str = '',
+    ):
+        super().__init__(redis=redis, serializer=serializer, key_prefix=key_prefix)
+
+    async def set_user_context(self, user_id: str, user_context: dict) -> None:
+        await self.set_many({user_id: user_context})
+
+    async def get_user_context(self, user_id: str) -> dict:
+        return (await self.get_many([user_id]))[user_id]
+
+    async def get_many(self, user_ids: List[str]) -> Dict[str, dict]:
+        if not user_ids:
+            return {}
+
+        pipeline = self._redis.pipeline(transaction=True)
+        for user_id in user_ids:
+            self._queue_get(pipeline, user_id)
+        results = await pipeline.execute()
+
+        return {
+            user_id: self._load_user_context(*results[3 * i:3 * i + 3])
+            for i, user_id in enumerate(user_ids)
+        }
+
+    async def set_many(self, user_contexts: Dict[str, dict]) -> None:
+        if not user_contexts:
+            return
+
+        pipeline = self._redis.pipeline(transaction=True)
+        for user_id, user_context in user_contexts.items():
+            self._queue_set(pipeline, user_id, user_context)
+        await pipeline.execute()
+
+    async def update_user_context(
+        self,
+        user_id: str,
+        user_context: dict,
+        changes: UserContextChanges,
+    ) -> None:
+        await self.update_many({user_id: user_context}, {user_id: changes})
+
+    async def update_many(
+        self,
+        user_contexts: Dict[str, dict],
+        changes: Dict[str, UserContextChanges],
+    ) -> None:
+        if not user_contexts:
+            return
+
+        pipeline = self._redis.pipeline(transaction=True)
+        for user_id, user_context in user_contexts.items():
+            self._queue_update(pipeline, user_id, user_context, changes[user_id])
+        await pipeline.execute()
@@ -0,0 +1,200 @@
+import json
+import os
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+from millet.skill import BaseSkill, BaseSkillClassifier
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover
+    np = None
+
+# encodes texts into a matrix of embeddings, one row per text
+Encoder = Callable[[List[str]], Any]
+
+
+def _require_numpy() -> None:
+    if np is None:
+        raise ImportError('numpy is required for embeddings, install millet[embedding]')
+
+
+def _normalized(vectors: Any) -> Any:
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    if vectors.ndim != 2:
+        raise ValueError(f'Encoder must return a matrix, got an array of shape {vectors.shape}')
+
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    return vectors / norms
+
+
+class EmbeddingIndex:
+    """
+    Normalized embeddings of example utterances of skills.
+
+    Examples of one skill are stored in consecutive rows of one float32 matrix,
+    `offsets` are the first rows of the skills. The index is built offline,
+    saved to a directory and loaded with memory mapping, so processes loading
+    the same index share its pages.
+    """
+
+    _vectors_file = 'vectors.npy'
+    _meta_file = 'index.json'
+
+    def __init__(self, skill_names: List[str], vectors: Any, offsets: Sequence[int]) -> None:
+        _require_numpy()
+
+        if len(skill_names) != len(offsets):
+            raise ValueError('Every skill must have an offset')
+
+        self.skill_names = list(skill_names)
+        self.vectors = vectors
+        self.offsets = np.asarray(offsets, dtype=np.intp)
+
+    def __len__(self) -> int:
+        return len(self.vectors)
+
+    @classmethod
+    def build(cls, examples: Dict[str, List[str]], encoder: Encoder) -> 'EmbeddingIndex':
+        _require_numpy()
+
+        skill_names = []
+        offsets = []
+        texts = []
+
+        for skill_name, skill_examples in examples.items():
+            if not skill_examples:
+                continue
+            skill_names.append(skill_name)
+            offsets.append(len(texts))
+            texts.extend(skill_examples)
+
+        if not texts:
+            raise ValueError('Index must contain examples')
+
+        return cls(skill_names=skill_names, vectors=_normalized(encoder(texts)), offsets=offsets)
+
+    def save(self, path: str) -> None:
+        os.makedirs(path, exist_ok=True)
+        np.save(os.path.join(path, self._vectors_file), np.ascontiguousarray(self.vectors))
+
+        with open(os.path.join(path, self._meta_file), 'w', encoding='utf8') as f:
+            json.dump({'skill_names': self.skill_names, 'offsets': self.offsets.tolist()}, f)
+
+    @classmethod
+    def load(cls, path: str, mmap: bool = True) -> 'EmbeddingIndex':
+        _require_numpy()
+
+        vectors = np.load(
+            os.path.join(path, cls._vectors_file),
+            mmap_mode='r' if mmap else None,
+        )
+        with open(os.path.join(path, cls._meta_file), encoding='utf8') as f:
+            meta = json.load(f)
+
+        return cls(skill_names=meta['skill_names'], vectors=vectors, offsets=meta['offsets'])
+
+    def skill_scores(self, vectors: Any) -> Any:
+        """Returns the best similarity of every message to examples of every skill."""
+
+        similarities = vectors @ self.vectors.T
+        return np.maximum.reduceat(similarities, self.offsets, axis=1)
+
+
+class EmbeddingSkillClassifier(BaseSkillClassifier):
+    """
+    Classifier by similarity of a message to example utterances of skills.
+
+    A batch of messages is encoded with one encoder call and scored with one
+    matrix multiplication. Up to `top_k` skills with similarity above
+    `threshold` are returned, the most similar first.
+    """
+
+    def __init__(
+        self,
+        skills_map: Dict[str, Any],
+        index: EmbeddingIndex,
+        encoder: Encoder,
+        threshold: float = 0.5,
+        top_k: int = 1,
+    ) -> None:
+        _require_numpy()
+
+        unknown_skill_names = set(index.skill_names) - set(skills_map)
+        if unknown_skill_names:
+            raise ValueError(f'Skills {sorted(unknown_skill_names)} of the index are not found')
+
+        self._skills_map = dict(skills_map)
+        self._index = index
+        self._encoder = encoder
+        self._threshold = threshold
+        self._top_k = top_k
+
+    @property
+    def skills_map(self) -> Dict[str, BaseSkill]:
+        return self._skills_map
+
+    def message_text(self, message: Any) -> Optional[str]:
+        """Returns the text of the message, override it for messages of other types."""
+
+        return message if isinstance(message, str) else None
+
+    def classify(self, message: Any, user_id: str) -> List[str]:
+        return self.classify_batch([message], [user_id])[0]
+
+    def classify_batch(self, messages: List[Any], user_ids: List[str]) -> List[List[str]]:
+        return [skill_names for skill_names, _ in self.score_batch(messages, user_ids)]
+
+    def score(self, message: Any, user_id: str) -> Tuple[List[str], float]:
+        return self.score_batch([message], [user_id])[0]
+
+    def score_batch(
+        self,
+        messages: List[Any],
+        user_ids: List[str],
+    ) -> List[Tuple[List[str], float]]:
+        """Returns skills above the threshold and the best similarity as the confidence."""
+
+        results = []
+        for ranked in self.rank_batch(messages):
+            skill_names = [
+                skill_name
+                for skill_name, similarity in ranked
+                if similarity >= self._threshold
+            ]
+            confidence = max(ranked[0][1], 0.0) if ranked else 0.0
+            results.append((skill_names, confidence))
+        return results
+
+    def rank_batch(self, messages: List[Any]) -> List[List[Tuple[str, float]]]:
+        """Returns top_k skills with similarities for every message, the most similar first."""
+
+        ranked_batch = [[] for _ in messages]
+
+        positions = []
+        texts = []
+        for position, message in enumerate(messages):
+            text = self.message_text(message)
+            if text:
+                positions.append(position)
+                texts.append(text)
+
+        if not texts:
+            return ranked_batch
+
+        scores = self._index.skill_scores(_normalized(self._encoder(texts)))
+        top_k = min(self._top_k, scores.shape[1])
+
+        if top_k < scores.shape[1]:
+            candidates = np.argpartition(-scores, top_k - 1, axis=1)[:, :top_k]
+        else:
+            candidates = np.broadcast_to(np.arange(scores.shape[1]), scores.shape)
+
+        for row, position in enumerate(positions):
+            row_candidates = sorted(candidates[row], key=lambda column: -scores[row, column])
+            ranked_batch[position] = [
+                (self._index.skill_names[column], float(scores[row, column]))
+                for column in row_candidates
+            ]
+
+        return ranked_batch
@@ -0,0 +1,103 @@
+import threading
+from collections.abc import Sequence
+from typing import Any, Iterable, Iterator, Optional
+
+_lock = threading.Lock()
+
+
+class History(Sequence):
+    """
+    Immutable sequence with cheap append and structural sharing.
+
+    Histories created by appending to the same history share one buffer,
+    so appending a message doesn't copy the previous messages. A buffer is
+    copied only when a history which is not the longest one is appended
+    with a different value.
+    """
+
+    __slots__ = ('_items', '_length')
+
+    def __init__(self, items: Optional[Iterable[Any]] = None) -> None:
+        self._items = list(items) if items is not None else []
+        self._length = len(self._items)
+
+    @classmethod
+    def of(cls, items: Iterable[Any]) -> 'History':
+        if isinstance(items, History):
+            return items
+        return cls(items)
+
+    @classmethod
+    def _shared(cls, items: list, length: int) -> 'History':
+        history = cls.__new__(cls)
+        history._items = items
+        history._length = length
+        return history
+
+    def append(self, value: Any) -> 'History':
+        with _lock:
+            items = self._items
+            if len(items) == self._length:
+                items.append(value)
+                return self._shared(items, self._length + 1)
+
+            if items[self._length] is value:
+                return self._shared(items, self._length + 1)
+
+        items = items[:self._length]
+        items.append(value)
+        return self._shared(items, len(items))
+
+    def extend(self, values: Iterable[Any]) -> 'History':
+        history = self
+        for value in values:
+            history = history.append(value)
+        return history
+
+    def appended_since(self, other: Sequence[Any]) -> Optional[list]:
+        """
+        Returns items appended to `other` to get this history.
+
+        None means that this history doesn't continue `other`.
+        """
+
+        if isinstance(other, History) and other._items is self._items:
+            if other._length <= self._length:
+                return self._items[other._length:self._length]
+            return None
+
+        if not other:
+            return list(self)
+        return None
+
+    def __len__(self) -> int:
+        return self._length
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return self._items[:self._length][index]
+
+        if index < 0:
+            index += self._length
+        if not 0 <= index < self._length:
+            raise IndexError('history index out of range')
+        return self._items[index]
+
+    def __iter__(self) -> Iterator[Any]:
+        items = self._items
+        for index in range(self._length):
+            yield items[index]
+
+    def __eq__(self, other: Any) -> bool:
+        if not isinstance(other, (History, list, tuple)):
+            return NotImplemented
+        return len(self) == len(other) and all(a == b for a, b in zip(self, other))
+
+    __hash__ = None
+
+    def __repr__(self) -> str:
+        return f'History({list(self)!r})'
+
+    def __reduce__(self):
+        # only the visible part is stored, the shared buffer isn't
+        return History, (self._items[:self._length],)
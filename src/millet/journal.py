@@ -0,0 +1,276 @@
+import gc
+import os
+import pickle
+import re
+import struct
+import threading
+import time
+import zlib
+from typing import Dict, List, Optional, Tuple
+
+from millet.context import RAMContextManager
+
+# a record of the journal is the checksum and the length of its payload followed by the payload
+_header = struct.Struct('<II')
+
+_file_name = re.compile(r'(snapshot|journal)-(\d+)\.(pickle|log)')
+
+_fsync_policies = ('always', 'interval', 'never')
+
+
+class JournaledRAMContextManager(RAMContextManager):
+    """
+    RAM context manager which survives restarts.
+
+    Writes are appended to a journal, every `snapshot_every` writes the storage is saved
+    to a snapshot in the background and older files are removed. On start the latest
+    snapshot is loaded and newer journals are replayed, a torn record at the end of
+    a journal is dropped. Reads are served from the dict as before.
+
+    Every write is passed to the OS. `fsync` is 'always' (every write is synced to disk),
+    'interval' (once in `fsync_interval` seconds, writes of the last interval may be lost
+    on a crash of the OS) or 'never' (it's left to the OS). Finished dialogues (empty
+    contexts) are removed instead of being stored.
+
+    Pickled records of stored contexts are kept along with the dict, so a snapshot
+    writes them out without pickling: writers are blocked only while the records are
+    listed, and contexts modified in place after they were set don't change a snapshot.
+    It takes about twice the memory of `RAMContextManager`.
+    """
+
+    _snapshot_chunk_size = 10000
+
+    def __init__(
+        self,
+        directory: str,
+        fsync: str = 'interval',
+        fsync_interval: float = 1.0,
+        snapshot_every: Optional[int] = 100000,
+    ) -> None:
+        if fsync not in _fsync_policies:
+            raise ValueError(f'fsync must be one of {_fsync_policies}, got {fsync}')
+        if fsync_interval <= 0:
+            raise ValueError('fsync_interval must be positive')
+        if snapshot_every is not None and snapshot_every <= 0:
+            raise ValueError('snapshot_every must be positive')
+
+        super().__init__()
+        self._directory = directory
+        self._fsync = fsync
+        self._snapshot_every = snapshot_every
+
+        self.snapshots = 0
+        self.restore_time: Optional[float] = None
+
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._snapshot_lock = threading.Lock()
+        self._snapshotting = False
+        # pickled records of stored contexts, a snapshot is made of them
+        self._records: Dict[str, bytes] = {}
+        self._journal_records = 0
+        self._unsynced = False
+
+        # the cyclic GC would scan all restored contexts again and again
+        gc_was_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            self._generation = self._restore()
+        finally:
+            if gc_was_enabled:
+                gc.enable()
+        self._journal = open(self._path('journal', self._generation), 'ab')
+
+        self._closed = threading.Event()
+        self._syncer = None
+        if fsync == 'interval':
+            self._syncer = threading.Thread(
+                target=self._sync_periodically,
+                args=(fsync_interval,),
+                daemon=True,
+            )
+            self._syncer.start()
+
+    def set_user_context(self, user_id: str, user_context: dict) -> None:
+        self.set_many({user_id: user_context})
+
+    def delete_user_context(self, user_id: str) -> None:
+        record = _record((user_id, None))
+        with self._lock:
+            self._storage.pop(user_id, None)
+            self._records.pop(user_id, None)
+            self._append([record])
+
+    def set_many(self, user_contexts: Dict[str, dict]) -> None:
+        empty_user_context = self._empty_user_context
+        entries = []
+        for user_id, user_context in user_contexts.items():
+            if user_context == empty_user_context:
+                user_context = None
+            # contexts are pickled before the lock is taken
+            entries.append((user_id, user_context, _record((user_id, user_context))))
+
+        with self._lock:
+            for user_id, user_context, record in entries:
+                if user_context is None:
+                    self._storage.pop(user_id, None)
+                    self._records.pop(user_id, None)
+                else:
+                    self._storage[user_id] = user_context
+                    self._records[user_id] = record
+            self._append([record for _, _, record in entries])
+
+    def snapshot(self) -> None:
+        """Saves the storage to a snapshot and removes older snapshots and journals."""
+
+        with self._snapshot_lock:
+            with self._lock:
+                self._sync()
+                self._journal.close()
+                self._generation += 1
+                generation = self._generation
+                self._journal = open(self._path('journal', generation), 'ab')
+                self._journal_records = 0
+                # records are immutable, so the snapshot is written outside of the lock
+                records = list(self._records.values())
+
+            path = self._path('snapshot', generation)
+            with open(path + '.tmp', 'wb') as f:
+                for start in range(0, len(records), self._snapshot_chunk_size):
+                    f.write(b''.join(records[start:start + self._snapshot_chunk_size]))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(path + '.tmp', path)
+            self._sync_directory()
+
+            self._remove_files(older_than=generation)
+            self.snapshots += 1
+
+    def close(self) -> None:
+        self._closed.set()
+        if self._syncer is not None:
+            self._syncer.join()
+            self._syncer = None
+
+        with self._snapshot_lock, self._lock:
+            self._sync()
+            self._journal.close()
+
+    def _append(self, records: List[bytes]) -> None:
+        self._journal.write(b''.join(records))
+        self._journal.flush()
+        self._unsynced = True
+        if self._fsync == 'always':
+            self._sync()
+
+        self._journal_records += len(records)
+        if (
+            self._snapshot_every is not None
+            and self._journal_records >= self._snapshot_every
+            and not self._snapshotting
+        ):
+            self._snapshotting = True
+            threading.Thread(target=self._snapshot_in_background, daemon=True).start()
+
+    def _snapshot_in_background(self) -> None:
+        try:
+            self.snapshot()
+        finally:
+            self._snapshotting = False
+
+    def _sync(self) -> None:
+        if self._unsynced:
+            self._journal.flush()
+            if self._fsync != 'never':
+                os.fsync(self._journal.fileno())
+            self._unsynced = False
+
+    def _sync_periodically(self, fsync_interval: float) -> None:
+        while not self._closed.wait(fsync_interval):
+            with self._lock:
+                if not self._journal.closed:
+                    self._sync()
+
+    def _restore(self) -> int:
+        started_at = time.perf_counter()
+        files = self._files()
+
+        snapshot_generations = sorted(files['snapshot'])
+        journal_generations = sorted(files['journal'])
+        generation = snapshot_generations[-1] if snapshot_generations else 0
+
+        if snapshot_generations:
+            # a snapshot is made of records of the journal
+            self._replay(self._path('snapshot', generation))
+
+        journal_generations = [g for g in journal_generations if g >= generation]
+        for journal_generation in journal_generations:
+            self._replay(self._path('journal', journal_generation))
+
+        self._remove_files(older_than=generation)
+        # snapshots which weren't completed before a crash
+        for file_name in os.listdir(self._directory):
+            if file_name.endswith('.tmp') and _file_name.fullmatch(file_name[:-len('.tmp')]):
+                os.remove(os.path.join(self._directory, file_name))
+
+        self.restore_time = time.perf_counter() - started_at
+        return max(journal_generations + [generation, 1])
+
+    def _replay(self, path: str) -> None:
+        with open(path, 'rb') as f:
+            data = f.read()
+
+        storage = self._storage
+        records = self._records
+        position = 0
+        while position + _header.size <= len(data):
+            checksum, length = _header.unpack_from(data, position)
+            start = position + _header.size
+            payload = data[start:start + length]
+            if len(payload) < length or zlib.crc32(payload) != checksum:
+                break
+
+            user_id, user_context = pickle.loads(payload)
+            if user_context is None:
+                storage.pop(user_id, None)
+                records.pop(user_id, None)
+            else:
+                storage[user_id] = user_context
+                records[user_id] = data[position:start + length]
+            position = start + length
+
+        if position < len(data):
+            # the last write was torn by a crash
+            with open(path, 'r+b') as f:
+                f.truncate(position)
+
+    def _files(self) -> Dict[str, List[int]]:
+        files = {'snapshot': [], 'journal': []}
+        for file_name in os.listdir(self._directory):
+            match = _file_name.fullmatch(file_name)
+            if match:
+                files[match.group(1)].append(int(match.group(2)))
+        return files
+
+    def _remove_files(self, older_than: int) -> None:
+        for kind, generations in self._files().items():
+            for generation in generations:
+                if generation < older_than:
+                    os.remove(self._path(kind, generation))
+
+    def _path(self, kind: str, generation: int) -> str:
+        extension = 'pickle' if kind == 'snapshot' else 'log'
+        return os.path.join(self._directory, f'{kind}-{generation:08d}.{extension}')
+
+    def _sync_directory(self) -> None:
+        if hasattr(os, 'O_DIRECTORY'):
+            fd = os.open(self._directory, os.O_RDONLY | os.O_DIRECTORY)
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+
+
+def _record(entry: Tuple[str, Optional[dict]]) -> bytes:
+    payload = pickle.dumps(entry, pickle.HIGHEST_PROTOCOL)
+    return _header.pack(zlib.crc32(payload), len(payload)) + payload
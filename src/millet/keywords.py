@@ -0,0 +1,234 @@
+import re
+from collections import deque
+from typing import Any, Dict, Hashable, Iterable, Iterator, List, Optional, Tuple
+
+from millet.skill import BaseSkill, BaseSkillClassifier
+
+
+class AhoCorasick:
+    """Automaton which finds all occurrences of many phrases in one pass over a text."""
+
+    def __init__(self, phrases: Iterable[Tuple[str, Any]]) -> None:
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._outputs: List[Tuple[Tuple[int, Any], ...]] = [()]
+
+        for phrase, value in phrases:
+            self._add(phrase, value)
+        self._link()
+
+    def __len__(self) -> int:
+        return len(self._goto)
+
+    def _add(self, phrase: str, value: Any) -> None:
+        if not phrase:
+            raise ValueError('Phrase must not be empty')
+
+        state = 0
+        for char in phrase:
+            next_state = self._goto[state].get(char)
+            if next_state is None:
+                next_state = len(self._goto)
+                self._goto.append({})
+                self._fail.append(0)
+                self._outputs.append(())
+                self._goto[state][char] = next_state
+            state = next_state
+
+        self._outputs[state] += ((len(phrase), value),)
+
+    def _link(self) -> None:
+        # breadth-first, so the failure state of a state is linked before the state
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self._goto[state].items():
+                queue.append(next_state)
+
+                fail = self._fail[state]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                fail = self._goto[fail].get(char, 0)
+
+                self._fail[next_state] = fail
+                self._outputs[next_state] += self._outputs[fail]
+
+    def search(self, text: str) -> Iterator[Tuple[int, int, Any]]:
+        """Yields start, end and value of every occurrence of the phrases."""
+
+        goto, fail, outputs = self._goto, self._fail, self._outputs
+
+        state = 0
+        for index, char in enumerate(text):
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+
+            for length, value in outputs[state]:
+                yield index - length + 1, index + 1, value
+
+
+class ExactSkillClassifier(BaseSkillClassifier):
+    """Classifier by exact messages, for example payloads of buttons or fixed phrases."""
+
+    is_deterministic = True
+
+    def __init__(self, skills_map: Dict[str, Any], messages: Dict[Hashable, List[str]]) -> None:
+        self._skills_map = dict(skills_map)
+        self._messages = {message: list(skill_names) for message, skill_names in messages.items()}
+
+    @property
+    def skills_map(self) -> Dict[str, BaseSkill]:
+        return self._skills_map
+
+    def classify(self, message: Any, user_id: str) -> List[str]:
+        try:
+            return list(self._messages.get(message, ()))
+        except TypeError:  # unhashable message
+            return []
+
+
+def _is_word_char(char: str) -> bool:
+    return char.isalnum() or char == '_'
+
+
+class KeywordSkillClassifier(BaseSkillClassifier):
+    """
+    Classifier by trigger phrases, commands and regular expressions of skills.
+
+    Skills declare them in `triggers`, `commands` and `patterns` or they are passed
+    explicitly by skill names. All trigger phrases are compiled into one Aho-Corasick
+    automaton and all patterns into one regular expression with a named group per skill,
+    so a message is scanned once whatever the number of skills. Patterns of different
+    skills are joined, so they must not refer to groups by numbers.
+    Skill names are returned in the order of skills_map.
+    """
+
+    def __init__(
+        self,
+        skills_map: Dict[str, Any],
+        triggers: Optional[Dict[str, Iterable[str]]] = None,
+        commands: Optional[Dict[str, Iterable[str]]] = None,
+        patterns: Optional[Dict[str, Iterable[str]]] = None,
+        whole_words: bool = True,
+        case_sensitive: bool = False,
+    ) -> None:
+        self._skills_map = dict(skills_map)
+        self._skill_names = list(self._skills_map)
+        self._whole_words = whole_words
+        self._case_sensitive = case_sensitive
+
+        phrases = []
+        self._commands: Dict[str, List[int]] = {}
+        # patterns and indexes of skills by names of their groups
+        skill_patterns: Dict[str, str] = {}
+        self._pattern_skills: Dict[str, int] = {}
+
+        for skill_index, skill_name in enumerate(self._skill_names):
+            for trigger in self._declared(skill_name, 'triggers', triggers):
+                phrases.append((self._normalize(trigger), skill_index))
+
+            for command in self._declared(skill_name, 'commands', commands):
+                command = self._normalize(command.lstrip('/'))
+                self._commands.setdefault(command, []).append(skill_index)
+
+            declared_patterns = list(self._declared(skill_name, 'patterns', patterns))
+            if declared_patterns:
+                group = f'skill{skill_index}'
+                skill_patterns[group] = '|'.join(f'(?:{p})' for p in declared_patterns)
+                self._pattern_skills[group] = skill_index
+
+        self._automaton = AhoCorasick(phrases)
+
+        self._pattern = None
+        if skill_patterns:
+            # the first lookahead finds positions where any pattern matches, the optional
+            # ones capture every skill which matches there, matches may overlap
+            self._pattern = re.compile(
+                '(?=' + '|'.join(f'(?:{pattern})' for pattern in skill_patterns.values()) + ')'
+                + ''.join(
+                    f'(?:(?=(?P<{group}>{pattern})))?'
+                    for group, pattern in skill_patterns.items()
+                ),
+                0 if case_sensitive else re.IGNORECASE,
+            )
+
+    @property
+    def skills_map(self) -> Dict[str, BaseSkill]:
+        return self._skills_map
+
+    def message_text(self, message: Any) -> Optional[str]:
+        """Returns the text of the message, override it for messages of other types."""
+
+        return message if isinstance(message, str) else None
+
+    def classify(self, message: Any, user_id: str) -> List[str]:
+        skill_indexes = self._match(message)
+        return [self._skill_names[skill_index] for skill_index in sorted(skill_indexes)]
+
+    def _match(self, message: Any) -> set:
+        text = self.message_text(message)
+        if not text:
+            return set()
+
+        skill_indexes = set()
+
+        command = self._command(text)
+        if command is not None:
+            skill_indexes.update(self._commands.get(command, ()))
+
+        normalized_text = self._normalize(text)
+        for start, end, skill_index in self._automaton.search(normalized_text):
+            if skill_index in skill_indexes:
+                continue
+            if self._whole_words and not self._is_whole_word(normalized_text, start, end):
+                continue
+            skill_indexes.add(skill_index)
+
+        if self._pattern is not None:
+            skill_indexes.update(self._match_patterns(text))
+
+        return skill_indexes
+
+    def _match_patterns(self, text: str) -> set:
+        skill_indexes = set()
+        for match in self._pattern.finditer(text):
+            for group, value in match.groupdict().items():
+                if value is not None:
+                    skill_indexes.add(self._pattern_skills[group])
+            if len(skill_indexes) == len(self._pattern_skills):
+                break
+        return skill_indexes
+
+    def _declared(
+        self,
+        skill_name: str,
+        attribute: str,
+        explicit: Optional[Dict[str, Iterable[str]]],
+    ) -> Iterable[str]:
+        if explicit is not None and skill_name in explicit:
+            return explicit[skill_name]
+        # skill classes (lazy skills) declare them as well as skill instances
+        return getattr(self._skills_map[skill_name], attribute, ())
+
+    def _normalize(self, text: str) -> str:
+        return text if self._case_sensitive else text.casefold()
+
+    def _command(self, text: str) -> Optional[str]:
+        text = text.lstrip()
+        if not text.startswith('/'):
+            return None
+
+        parts = text[1:].split(maxsplit=1)
+        command = parts[0] if parts else ''
+        # commands in group chats are addressed as /command@bot
+        command = command.split('@', 1)[0]
+        return self._normalize(command)
+
+    @staticmethod
+    def _is_whole_word(text: str, start: int, end: int) -> bool:
+        if start > 0 and _is_word_char(text[start - 1]) and _is_word_char(text[start]):
+            return False
+        if end < len(text) and _is_word_char(text[end]) and _is_word_char(text[end - 1]):
+            return False
+        return True
@@ -0,0 +1,319 @@
+import errno
+import hashlib
+import mmap
+import os
+import struct
+import threading
+import time
+from typing import Optional, Tuple
+
+from millet.context import BaseContextManager
+from millet.serializers import BaseSerializer, BinarySerializer
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    fcntl = None
+
+_magic = b'MILLETMM'
+# magic, number of slots, size of a slot
+_file_header = struct.Struct('<8sQI')
+# state, length of the user id, length of the context, hash of the user id
+_slot_header = struct.Struct('<BxHIQ')
+
+_EMPTY = 0
+_USED = 1
+_DELETED = 2
+# the context is stored in the overflow context manager
+_OVERFLOW = 3
+
+# locks of a process are shared by its threads, so threads are excluded by thread locks
+_thread_locks_count = 256
+
+
+class MmapContextManager(BaseContextManager):
+    """
+    Context manager in a memory-mapped file shared by worker processes of one host.
+
+    The file is an open addressing hash table of `slots` slots of `slot_size` bytes,
+    a slot keeps a user id and its serialized context, which is read from the mapped
+    memory without copying. An operation with a user locks the home slot of the user,
+    writers also lock the written slot, so locks don't deadlock. Processes are excluded
+    by fcntl record locks and threads of a process by thread locks. Contexts which
+    don't fit a slot are stored in `overflow` if it's given. Finished dialogues (empty
+    contexts) are deleted instead of being stored. The table doesn't grow, slots of
+    deleted contexts are reused and emptied when they end a chain.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        slots: int = 65536,
+        slot_size: int = 4096,
+        serializer: Optional[BaseSerializer] = None,
+        overflow: Optional[BaseContextManager] = None,
+    ) -> None:
+        if fcntl is None:
+            raise ImportError('MmapContextManager requires fcntl, it works on POSIX systems only')
+        if slots <= 0:
+            raise ValueError('slots must be positive')
+        if slot_size <= _slot_header.size:
+            raise ValueError(f'slot_size must be larger than {_slot_header.size}')
+
+        self._path = path
+        self._serializer = serializer or BinarySerializer()
+        self._overflow = overflow
+
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        fcntl.lockf(self._fd, fcntl.LOCK_EX, _file_header.size, 0)
+        try:
+            if os.fstat(self._fd).st_size == 0:
+                # the file is sparse, zeroed slots are empty
+                os.ftruncate(self._fd, _file_header.size + slots * slot_size)
+                os.pwrite(self._fd, _file_header.pack(_magic, slots, slot_size), 0)
+            else:
+                magic, slots, slot_size = _file_header.unpack(
+                    os.pread(self._fd, _file_header.size, 0)
+                )
+                if magic != _magic:
+                    raise ValueError(f'{path} is not a file of MmapContextManager')
+        finally:
+            fcntl.lockf(self._fd, fcntl.LOCK_UN, _file_header.size, 0)
+
+        self.slots = slots
+        self.slot_size = slot_size
+        self._size = _file_header.size + slots * slot_size
+        self._mmap = mmap.mmap(self._fd, self._size)
+
+        self._key_thread_locks = [threading.Lock() for _ in range(_thread_locks_count)]
+        self._slot_thread_locks = [threading.Lock() for _ in range(_thread_locks_count)]
+        self._compaction_thread_lock = threading.Lock()
+
+    def get_user_context(self, user_id: str) -> dict:
+        key = user_id.encode()
+        key_hash, home = self._hash(key)
+
+        self._lock_key(home, shared=True)
+        try:
+            slot = self._find(key, key_hash, home)[0]
+            if slot is None:
+                return self._empty_user_context
+
+            # the slot of the user is changed only under the lock of the user
+            offset = self._offset(slot)
+            state, key_length, value_length, _ = _slot_header.unpack_from(self._mmap, offset)
+            if state == _OVERFLOW:
+                return self._overflow.get_user_context(user_id)
+
+            start = offset + _slot_header.size + key_length
+            with memoryview(self._mmap) as view:
+                with view[start:start + value_length] as value:
+                    return self._serializer.loads(value)
+        finally:
+            self._unlock_key(home)
+
+    def set_user_context(self, user_id: str, user_context: dict) -> None:
+        if user_context == self._empty_user_context:
+            self.delete_user_context(user_id)
+            return
+
+        key = user_id.encode()
+        key_hash, home = self._hash(key)
+        value = self._serializer.dumps(user_context)
+
+        is_overflow = _slot_header.size + len(key) + len(value) > self.slot_size
+        if _slot_header.size + len(key) > self.slot_size or (is_overflow and not self._overflow):
+            raise ValueError(
+                f'Context of {user_id} takes {len(value)} bytes and doesn\'t fit a slot, '
+                f'increase slot_size or pass overflow'
+            )
+
+        self._lock_key(home)
+        try:
+            while True:
+                slot, free_slot = self._find(key, key_hash, home)
+                target = slot if slot is not None else free_slot
+                if target is None:
+                    raise RuntimeError(f'All {self.slots} slots of {self._path} are used')
+
+                offset = self._offset(target)
+                self._lock_slot(target)
+                try:
+                    if target != slot and self._find(key, key_hash, home) != (None, target):
+                        # the free slot was taken by another user or a slot before it was
+                        # emptied, the chain is probed again
+                        continue
+
+                    was_overflow = target == slot and self._mmap[offset] == _OVERFLOW
+                    if is_overflow:
+                        self._overflow.set_user_context(user_id, user_context)
+                        self._write_slot(offset, _OVERFLOW, key, key_hash, b'')
+                    else:
+                        self._write_slot(offset, _USED, key, key_hash, value)
+                        if was_overflow:
+                            self._overflow.set_user_context(user_id, self._empty_user_context)
+                    return
+                finally:
+                    self._unlock_slot(target)
+        finally:
+            self._unlock_key(home)
+
+    def delete_user_context(self, user_id: str) -> None:
+        key = user_id.encode()
+        key_hash, home = self._hash(key)
+
+        self._lock_key(home)
+        try:
+            slot = self._find(key, key_hash, home)[0]
+            if slot is None:
+                return
+
+            offset = self._offset(slot)
+            self._lock_slot(slot)
+            try:
+                if self._mmap[offset] == _OVERFLOW:
+                    self._overflow.set_user_context(user_id, self._empty_user_context)
+                self._mmap[offset] = _DELETED
+            finally:
+                self._unlock_slot(slot)
+        finally:
+            self._unlock_key(home)
+
+        self._empty_deleted_slots(slot)
+
+    def close(self) -> None:
+        self._mmap.close()
+        os.close(self._fd)
+
+    def _hash(self, key: bytes) -> Tuple[int, int]:
+        # hash() is randomized per process, so a stable hash is used
+        key_hash = int.from_bytes(hashlib.blake2b(key, digest_size=8).digest(), 'little')
+        return key_hash, key_hash % self.slots
+
+    def _offset(self, slot: int) -> int:
+        return _file_header.size + slot * self.slot_size
+
+    def _find(self, key: bytes, key_hash: int, home: int) -> Tuple[Optional[int], Optional[int]]:
+        """
+        Returns the slot of the key and the first free slot of its chain.
+
+        Slots are read without locks: a state is one byte, a used slot never becomes
+        empty directly, a deleted slot becomes empty only before an empty slot, and the
+        slot of the key isn't changed while the key is locked, so a write of another slot
+        can't make the key found in a wrong slot or missed.
+        """
+
+        mmap_ = self._mmap
+        free_slot = None
+        for probe in range(self.slots):
+            slot = (home + probe) % self.slots
+            offset = self._offset(slot)
+
+            state, key_length, _, slot_key_hash = _slot_header.unpack_from(mmap_, offset)
+            if state == _EMPTY:
+                return None, slot if free_slot is None else free_slot
+            if state == _DELETED:
+                if free_slot is None:
+                    free_slot = slot
+            elif slot_key_hash == key_hash:
+                key_offset = offset + _slot_header.size
+                if mmap_[key_offset:key_offset + key_length] == key:
+                    return slot, free_slot
+
+        return None, free_slot
+
+    def _empty_deleted_slots(self, slot: int) -> None:
+        """
+        Empties the deleted slot and deleted slots before it if the slot after it is empty.
+
+        No chain goes through an empty slot, so such slots aren't a part of any chain and
+        lookups of missing users stop earlier. Only this method locks two slots at once,
+        it's run by one thread of all processes at a time, so locks can't deadlock.
+        """
+
+        self._lock(self._compaction_thread_lock, fcntl.LOCK_EX, self._size + self.slots)
+        try:
+            for _ in range(self.slots):
+                next_slot = (slot + 1) % self.slots
+                if next_slot == slot or not self._empty_deleted_slot(slot, next_slot):
+                    return
+                slot = (slot - 1) % self.slots
+        finally:
+            self._unlock(self._compaction_thread_lock, self._size + self.slots)
+
+    def _empty_deleted_slot(self, slot: int, next_slot: int) -> bool:
+        offset, next_offset = self._offset(slot), self._offset(next_slot)
+        # the slots share a thread lock if the table has 256 * n + 1 slots
+        next_thread_lock = None
+        if next_slot % _thread_locks_count != slot % _thread_locks_count:
+            next_thread_lock = self._slot_thread_locks[next_slot % _thread_locks_count]
+
+        self._lock_slot(slot)
+        try:
+            self._lock(next_thread_lock, fcntl.LOCK_EX, next_offset)
+            try:
+                if self._mmap[offset] != _DELETED or self._mmap[next_offset] != _EMPTY:
+                    return False
+                self._mmap[offset] = _EMPTY
+                return True
+            finally:
+                self._unlock(next_thread_lock, next_offset)
+        finally:
+            self._unlock_slot(slot)
+
+    def _write_slot(self, offset: int, state: int, key: bytes, key_hash: int, value: bytes) -> None:
+        start = offset + _slot_header.size
+        self._mmap[start:start + len(key)] = key
+        start += len(key)
+        self._mmap[start:start + len(value)] = value
+        self._mmap[offset:offset + _slot_header.size] = _slot_header.pack(
+            state, len(key), len(value), key_hash,
+        )
+
+    # locks of users and the lock of the compaction are bytes after the end of the file,
+    # they may be locked beyond it
+
+    def _lock_key(self, home: int, shared: bool = False) -> None:
+        self._lock(
+            self._key_thread_locks[home % _thread_locks_count],
+            fcntl.LOCK_SH if shared else fcntl.LOCK_EX,
+            self._size + home,
+        )
+
+    def _unlock_key(self, home: int) -> None:
+        self._unlock(self._key_thread_locks[home % _thread_locks_count], self._size + home)
+
+    def _lock_slot(self, slot: int) -> None:
+        self._lock(
+            self._slot_thread_locks[slot % _thread_locks_count],
+            fcntl.LOCK_EX,
+            self._offset(slot),
+        )
+
+    def _unlock_slot(self, slot: int) -> None:
+        self._unlock(self._slot_thread_locks[slot % _thread_locks_count], self._offset(slot))
+
+    def _lock(self, thread_lock: Optional[threading.Lock], operation: int, offset: int) -> None:
+        if thread_lock is not None:
+            thread_lock.acquire()
+        try:
+            while True:
+                try:
+                    fcntl.lockf(self._fd, operation, 1, offset)
+                    return
+                except OSError as e:
+                    # record locks belong to processes, so the kernel may take waits of
+                    # different threads for a deadlock, locks are always taken in order
+                    # of users, the compaction and slots, so the wait is retried
+                    if e.errno != errno.EDEADLK:
+                        raise
+                    time.sleep(0.001)
+        except BaseException:
+            if thread_lock is not None:
+                thread_lock.release()
+            raise
+
+    def _unlock(self, thread_lock: Optional[threading.Lock], offset: int) -> None:
+        fcntl.lockf(self._fd, fcntl.LOCK_UN, 1, offset)
+        if thread_lock is not None:
+            thread_lock.release()
@@ -0,0 +1,153 @@
+import threading
+import time
+from typing import Any, Callable, Dict, Hashable, List, Optional, Union
+
+from millet.skill import BaseSkill
+
+SkillFactory = Callable[[], BaseSkill]
+
+
+class ActionRoutes:
+    """
+    Routing table of action payloads declared by skills.
+
+    Payloads are looked up in a dict, string payloads are also looked up by their
+    prefixes of declared lengths, the longest declared prefix wins.
+    """
+
+    def __init__(self) -> None:
+        self._actions: Dict[Hashable, List[str]] = {}
+        self._prefixes: Dict[str, List[str]] = {}
+        self._prefix_lengths: List[int] = []
+
+    def add(self, skill_name: str, actions: List[Hashable], action_prefixes: List[str]) -> None:
+        for action in actions:
+            self._actions.setdefault(action, []).append(skill_name)
+
+        for prefix in action_prefixes:
+            if not prefix:
+                raise ValueError(f'Action prefix of {skill_name} must not be empty')
+            self._prefixes.setdefault(prefix, []).append(skill_name)
+
+        self._prefix_lengths = sorted({len(prefix) for prefix in self._prefixes}, reverse=True)
+
+    def route(self, payload: Any) -> List[str]:
+        try:
+            skill_names = self._actions.get(payload)
+        except TypeError:  # unhashable payload
+            return []
+
+        if skill_names:
+            return list(skill_names)
+
+        if isinstance(payload, str):
+            for length in self._prefix_lengths:
+                skill_names = self._prefixes.get(payload[:length])
+                if skill_names:
+                    return list(skill_names)
+
+        return []
+
+
+class SkillRegistry:
+    """
+    Skills of a classifier resolved once.
+
+    `skills_map` of the classifier is read on the first lookup. Its values may be
+    skills or factories (for example skill classes): a factory is called the first
+    time its skill is used, so expensive skills are built only when they are needed.
+    """
+
+    def __init__(self, skill_classifier: Any) -> None:
+        self._skill_classifier = skill_classifier
+        self._entries: Optional[Dict[str, Union[BaseSkill, SkillFactory]]] = None
+        self._skills: Dict[str, BaseSkill] = {}
+        self._locks: Dict[str, threading.Lock] = {}
+        self._lock = threading.Lock()
+        self._action_routes: Optional[ActionRoutes] = None
+
+        self.skills_map_time: Optional[float] = None
+        self.construction_times: Dict[str, float] = {}
+
+    def __getitem__(self, skill_name: str) -> BaseSkill:
+        skill = self._skills.get(skill_name)
+        if skill is not None:
+            return skill
+
+        entries = self._resolve_entries()
+        entry = entries[skill_name]
+        if isinstance(entry, BaseSkill):
+            return entry
+
+        with self._locks[skill_name]:
+            skill = self._skills.get(skill_name)
+            if skill is None:
+                started_at = time.perf_counter()
+                skill = entry()
+                self.construction_times[skill_name] = time.perf_counter() - started_at
+                self._skills[skill_name] = skill
+        return skill
+
+    def __contains__(self, skill_name: str) -> bool:
+        return skill_name in self._resolve_entries()
+
+    def names(self):
+        return self._resolve_entries().keys()
+
+    @property
+    def action_routes(self) -> ActionRoutes:
+        """Actions declared by skills, skill classes declare them without being built."""
+
+        action_routes = self._action_routes
+        if action_routes is None:
+            action_routes = ActionRoutes()
+            for skill_name, entry in self._resolve_entries().items():
+                action_routes.add(
+                    skill_name=skill_name,
+                    actions=getattr(entry, 'actions', ()),
+                    action_prefixes=getattr(entry, 'action_prefixes', ()),
+                )
+            self._action_routes = action_routes
+        return action_routes
+
+    def preload(self) -> None:
+        """Builds all skills now, for example on startup of an application."""
+
+        for skill_name in self.names():
+            self[skill_name]
+
+    def reset(self) -> None:
+        """Forgets resolved skills, `skills_map` is read again on the next lookup."""
+
+        with self._lock:
+            self._entries = None
+            self._action_routes = None
+            self._skills = {}
+            self._locks = {}
+            self.skills_map_time = None
+            self.construction_times = {}
+
+    def _resolve_entries(self) -> Dict[str, Union[BaseSkill, SkillFactory]]:
+        entries = self._entries
+        if entries is not None:
+            return entries
+
+        with self._lock:
+            if self._entries is None:
+                started_at = time.perf_counter()
+                entries = dict(self._skill_classifier.skills_map)
+                self.skills_map_time = time.perf_counter() - started_at
+
+                for skill_name, entry in entries.items():
+                    if isinstance(entry, BaseSkill):
+                        self._skills[skill_name] = entry
+                    elif callable(entry):
+                        self._locks[skill_name] = threading.Lock()
+                    else:
+                        raise TypeError(
+                            f'Skill {skill_name} must be a skill or a factory of skills, '
+                            f'got {entry!r}'
+                        )
+
+                self._entries = entries
+            return self._entries
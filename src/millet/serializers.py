@@ -0,0 +1,385 @@
+import json
+import pickle
+import zlib
+from abc import ABC, abstractmethod
+from typing import Any, Callable, Dict, Optional, Tuple, Type, Union
+
+from millet.history import History
+from millet.timeouts import MessageTimeOut
+
+try:
+    import lz4.frame as lz4_frame
+except ImportError:  # pragma: no cover
+    lz4_frame = None
+
+try:
+    import msgpack
+except ImportError:  # pragma: no cover
+    msgpack = None
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+
+class SerializationError(ValueError):
+    pass
+
+
+class BaseSerializer(ABC):
+
+    @abstractmethod
+    def dumps(self, param: Any) -> bytes:
+        pass
+
+    @abstractmethod
+    def loads(self, serialized_param: bytes) -> Any:
+        pass
+
+    # a single field of a user context or a message, used by context managers
+    # which store fields separately
+    def dump_value(self, value: Any) -> bytes:
+        return self.dumps(value)
+
+    def load_value(self, serialized_value: bytes) -> Any:
+        return self.loads(serialized_value)
+
+
+class CodecRegistry:
+    """
+    Codecs of types which msgpack and JSON don't support, like messages of platforms.
+
+    A codec encodes an object into a value of supported types and decodes it back,
+    encoded objects are stored together with the name of the codec.
+    """
+
+    def __init__(self) -> None:
+        self._by_type: Dict[type, Tuple[str, Callable[[Any], Any]]] = {}
+        self._by_name: Dict[str, Callable[[Any], Any]] = {}
+
+    def register(
+        self,
+        type_: Type,
+        name: str,
+        encode: Callable[[Any], Any],
+        decode: Callable[[Any], Any],
+    ) -> None:
+        if name in self._by_name:
+            raise ValueError(f'Codec {name} is already registered')
+
+        self._by_type[type_] = (name, encode)
+        self._by_name[name] = decode
+
+    def copy(self) -> 'CodecRegistry':
+        registry = CodecRegistry()
+        registry._by_type = dict(self._by_type)
+        registry._by_name = dict(self._by_name)
+        return registry
+
+    def encode(self, obj: Any) -> Tuple[str, Any]:
+        codec = self._by_type.get(type(obj))
+        if codec is None:
+            for type_ in type(obj).__mro__[1:]:
+                codec = self._by_type.get(type_)
+                if codec is not None:
+                    break
+            else:
+                raise SerializationError(
+                    f'Object of type {type(obj).__name__} is not serializable, register a codec'
+                )
+
+        name, encode = codec
+        return name, encode(obj)
+
+    def decode(self, name: str, value: Any) -> Any:
+        try:
+            decode = self._by_name[name]
+        except KeyError:
+            raise SerializationError(f'Codec {name} is not registered')
+        return decode(value)
+
+
+def default_codecs() -> CodecRegistry:
+    """Returns a new registry with codecs of millet types, register your codecs there."""
+
+    codecs = CodecRegistry()
+    codecs.register(
+        MessageTimeOut,
+        'millet.MessageTimeOut',
+        encode=lambda message: None,
+        decode=lambda value: MessageTimeOut(),
+    )
+    return codecs
+
+
+class UserContextSchema:
+    """
+    Positional encoding of user contexts, names of fields aren't stored.
+
+    The encoded context is a list of the schema version, the mask of present
+    fields, values of present fields and a dict of unknown fields.
+    """
+
+    version = 1
+    fields = (
+        'skill_names',
+        'state_names',
+        'history',
+        'context',
+        'calls_history',
+        'timeout_uid',
+        'frame',
+    )
+
+    @classmethod
+    def encode(cls, user_context: dict) -> list:
+        mask = 0
+        values = []
+        for position, field in enumerate(cls.fields):
+            if field not in user_context:
+                continue
+
+            mask |= 1 << position
+            value = user_context[field]
+            if field == 'history':
+                value = list(value)
+            elif field == 'calls_history':
+                value = {func_name: list(results) for func_name, results in value.items()}
+            values.append(value)
+
+        extra = {key: value for key, value in user_context.items() if key not in cls.fields}
+        return [cls.version, mask, *values, extra]
+
+    @classmethod
+    def decode(cls, encoded: list) -> dict:
+        version, mask, *values, extra = encoded
+        if version > cls.version:
+            raise SerializationError(f'Unsupported schema version {version}')
+
+        user_context = {}
+        values = iter(values)
+        for position, field in enumerate(cls.fields):
+            if not mask & (1 << position):
+                continue
+
+            value = next(values)
+            if field == 'history':
+                value = History(value)
+            elif field == 'calls_history':
+                value = {func_name: History(results) for func_name, results in value.items()}
+            user_context[field] = value
+
+        user_context.update(extra)
+        return user_context
+
+
+def _compress_zlib(data: bytes) -> bytes:
+    return zlib.compress(data, 1)
+
+
+def _compress_lz4(data: bytes) -> bytes:
+    return lz4_frame.compress(data)
+
+
+def _decompress_lz4(data: bytes) -> bytes:
+    if lz4_frame is None:
+        raise SerializationError('lz4 is required to load the data, install millet[lz4]')
+    return lz4_frame.decompress(data)
+
+
+class BinarySerializer(BaseSerializer):
+    """
+    Pickle of the highest protocol in a versioned binary envelope.
+
+    The envelope is a marker byte, a format version byte and a compression byte
+    followed by the payload. Payloads larger than `compression_threshold` bytes
+    are compressed if it makes them smaller. Data without the marker is loaded
+    as a plain pickle, so blobs of PickleSerializer (protocol 0) are still read.
+    """
+
+    # isn't a first byte of a pickle: protocol 0 pickles are ASCII, other start with PROTO (0x80)
+    marker = 0xB1
+    version = 1
+
+    _compressions = {
+        None: 0,
+        'zlib': 1,
+        'lz4': 2,
+    }
+    _compressors = {
+        1: _compress_zlib,
+        2: _compress_lz4,
+    }
+    _decompressors = {
+        0: lambda data: data,
+        1: zlib.decompress,
+        2: _decompress_lz4,
+    }
+
+    def __init__(
+        self,
+        compression: Optional[str] = 'zlib',
+        compression_threshold: int = 1024,
+    ) -> None:
+        if compression not in self._compressions:
+            raise ValueError(f'Unknown compression {compression}')
+        if compression == 'lz4' and lz4_frame is None:
+            raise ImportError('lz4 is required for lz4 compression, install millet[lz4]')
+
+        self._compression = self._compressions[compression]
+        self._compression_threshold = compression_threshold
+
+    def dumps(self, param: Any) -> bytes:
+        return self._pack(pickle.dumps(param, pickle.HIGHEST_PROTOCOL))
+
+    def loads(self, serialized_param: Union[bytes, str]) -> Any:
+        if isinstance(serialized_param, str):
+            serialized_param = serialized_param.encode()
+
+        if not serialized_param or serialized_param[0] != self.marker:
+            # a blob of PickleSerializer
+            return pickle.loads(serialized_param)
+
+        return pickle.loads(self._unpack(serialized_param))
+
+    def _pack(self, payload: bytes) -> bytes:
+        compression = 0
+        if self._compression and len(payload) > self._compression_threshold:
+            compressed_payload = self._compressors[self._compression](payload)
+            if len(compressed_payload) < len(payload):
+                compression = self._compression
+                payload = compressed_payload
+
+        return bytes((self.marker, self.version, compression)) + payload
+
+    def _unpack(self, data: bytes) -> bytes:
+        if len(data) < 3:
+            raise SerializationError('Data is truncated')
+
+        version, compression = data[1], data[2]
+        if version > self.version:
+            raise SerializationError(f'Unsupported format version {version}')
+        if compression not in self._decompressors:
+            raise SerializationError(f'Unknown compression {compression}')
+
+        return self._decompressors[compression](data[3:])
+
+
+class MsgpackSerializer(BaseSerializer):
+    """
+    Schema-aware msgpack serializer of user contexts, it's safe to load from shared storage.
+
+    Objects of other types are stored by codecs as msgpack extension types.
+    """
+
+    _codec_ext_type = 1
+
+    def __init__(self, codecs: Optional[CodecRegistry] = None) -> None:
+        if msgpack is None:
+            raise ImportError('msgpack is required for MsgpackSerializer, install millet[msgpack]')
+
+        self._codecs = codecs or default_codecs()
+
+    def dumps(self, param: Any) -> bytes:
+        return self._pack(UserContextSchema.encode(param))
+
+    def loads(self, serialized_param: bytes) -> Any:
+        return UserContextSchema.decode(self._unpack(serialized_param))
+
+    def dump_value(self, value: Any) -> bytes:
+        return self._pack(value)
+
+    def load_value(self, serialized_value: bytes) -> Any:
+        return self._unpack(serialized_value)
+
+    def _pack(self, value: Any) -> bytes:
+        return msgpack.packb(value, default=self._default, use_bin_type=True)
+
+    def _unpack(self, data: bytes) -> Any:
+        return msgpack.unpackb(data, ext_hook=self._ext_hook, raw=False, strict_map_key=False)
+
+    def _default(self, obj: Any) -> Any:
+        if isinstance(obj, History):
+            return list(obj)
+
+        name, value = self._codecs.encode(obj)
+        return msgpack.ExtType(self._codec_ext_type, self._pack([name, value]))
+
+    def _ext_hook(self, code: int, data: bytes) -> Any:
+        if code != self._codec_ext_type:
+            return msgpack.ExtType(code, data)
+
+        name, value = self._unpack(data)
+        return self._codecs.decode(name, value)
+
+
+class JSONSerializer(BaseSerializer):
+    """
+    Schema-aware JSON serializer of user contexts, it's safe to load from shared storage.
+
+    orjson is used if it's installed. Objects of other types are stored by codecs
+    as objects with the `__millet__` key.
+    """
+
+    _tag = '__millet__'
+
+    def __init__(self, codecs: Optional[CodecRegistry] = None, use_orjson: bool = True) -> None:
+        self._codecs = codecs or default_codecs()
+        self._orjson = orjson if use_orjson else None
+        self._encoded_tag = json.dumps(self._tag).encode()
+
+    def dumps(self, param: Any) -> bytes:
+        return self.dump_value(UserContextSchema.encode(param))
+
+    def loads(self, serialized_param: Union[bytes, str]) -> Any:
+        return UserContextSchema.decode(self.load_value(serialized_param))
+
+    def dump_value(self, value: Any) -> bytes:
+        if self._orjson is not None:
+            try:
+                return self._orjson.dumps(value, default=self._default)
+            except self._orjson.JSONEncodeError as error:
+                raise SerializationError(str(error)) from error
+
+        return json.dumps(
+            value,
+            default=self._default,
+            ensure_ascii=False,
+            separators=(',', ':'),
+        ).encode()
+
+    def load_value(self, serialized_value: Union[bytes, memoryview, str]) -> Any:
+        if isinstance(serialized_value, str):
+            serialized_value = serialized_value.encode()
+        elif isinstance(serialized_value, memoryview):
+            serialized_value = serialized_value.tobytes()
+
+        if self._orjson is None:
+            return json.loads(serialized_value, object_hook=self._object_hook)
+
+        value = self._orjson.loads(serialized_value)
+        # orjson has no object hook, tagged objects are decoded only if they are there
+        if self._encoded_tag in serialized_value:
+            value = self._decode_tagged(value)
+        return value
+
+    def _default(self, obj: Any) -> Any:
+        if isinstance(obj, History):
+            return list(obj)
+
+        name, value = self._codecs.encode(obj)
+        return {self._tag: name, 'value': value}
+
+    def _object_hook(self, obj: dict) -> Any:
+        if self._tag in obj:
+            return self._codecs.decode(obj[self._tag], obj['value'])
+        return obj
+
+    def _decode_tagged(self, value: Any) -> Any:
+        if isinstance(value, list):
+            return [self._decode_tagged(item) for item in value]
+        if isinstance(value, dict):
+            value = {key: self._decode_tagged(item) for key, item in value.items()}
+            return self._object_hook(value)
+        return value
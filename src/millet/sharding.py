@@ -0,0 +1,294 @@
+import asyncio
+import bisect
+import hashlib
+import threading
+from concurrent.futures import Executor, ThreadPoolExecutor
+from typing import Dict, Iterable, List, Optional, Tuple, TypeVar
+
+from millet.context import BaseAsyncContextManager, BaseContextManager, UserContextChanges
+
+ContextManager = TypeVar('ContextManager', BaseContextManager, BaseAsyncContextManager)
+
+
+def _hash(key: str) -> int:
+    # hash() is randomized per process, positions must be the same in every worker
+    return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), 'little')
+
+
+class HashRing:
+    """
+    Consistent hashing of keys to nodes.
+
+    Every node has `vnodes` points on the ring and a key belongs to the node of the
+    first point after the hash of the key. Adding or removing a node moves only keys
+    of its points, about 1/N of all keys.
+    """
+
+    def __init__(self, nodes: Iterable[str] = (), vnodes: int = 160) -> None:
+        if vnodes <= 0:
+            raise ValueError('vnodes must be positive')
+
+        self.vnodes = vnodes
+        self._nodes: List[str] = []
+        # points and their nodes are replaced together, so lookups don't need the lock
+        self._ring: Tuple[List[int], List[str]] = ([], [])
+        self._lock = threading.Lock()
+
+        for node in nodes:
+            self.add(node)
+
+    @property
+    def nodes(self) -> List[str]:
+        return list(self._nodes)
+
+    def copy(self) -> 'HashRing':
+        ring = HashRing(vnodes=self.vnodes)
+        with self._lock:
+            ring._nodes = list(self._nodes)
+            ring._ring = self._ring
+        return ring
+
+    def add(self, node: str) -> None:
+        with self._lock:
+            if node in self._nodes:
+                raise ValueError(f'Node {node} is already added')
+
+            ring = list(zip(*self._ring))
+            ring.extend((_hash(f'{node}#{vnode}'), node) for vnode in range(self.vnodes))
+            self._set_ring(ring)
+            self._nodes.append(node)
+
+    def remove(self, node: str) -> None:
+        with self._lock:
+            if node not in self._nodes:
+                raise KeyError(node)
+
+            ring = [(point, point_node) for point, point_node in zip(*self._ring)
+                    if point_node != node]
+            self._set_ring(ring)
+            self._nodes.remove(node)
+
+    def node(self, key: str) -> str:
+        points, point_nodes = self._ring
+        if not points:
+            raise LookupError('Ring has no nodes')
+
+        index = bisect.bisect(points, _hash(key))
+        return point_nodes[index if index < len(points) else 0]
+
+    def _set_ring(self, ring: List[Tuple[int, str]]) -> None:
+        ring.sort()
+        self._ring = ([point for point, _ in ring], [node for _, node in ring])
+
+
+class _ShardedContextManagerMixin:
+
+    def __init__(self, shards: Dict[str, ContextManager], vnodes: int = 160) -> None:
+        if not shards:
+            raise ValueError('Shards must be given')
+
+        shards = dict(shards)
+        # the ring and the shards are never changed, a new pair replaces them together,
+        # so a lookup always finds the shard of a node
+        self._routing: Tuple[HashRing, Dict[str, ContextManager]] = (
+            HashRing(shards, vnodes=vnodes),
+            shards,
+        )
+        self._shards_lock = threading.Lock()
+
+    @property
+    def shards(self) -> Dict[str, ContextManager]:
+        return dict(self._routing[1])
+
+    def shard_name(self, user_id: str) -> str:
+        return self._routing[0].node(user_id)
+
+    def shard(self, user_id: str) -> ContextManager:
+        ring, shards = self._routing
+        return shards[ring.node(user_id)]
+
+    def add_shard(self, name: str, context_manager: ContextManager) -> None:
+        """Adds a shard, contexts of users moved to it have to be migrated by the caller."""
+
+        with self._shards_lock:
+            ring, shards = self._routing
+            if name in shards:
+                raise ValueError(f'Shard {name} is already added')
+
+            ring = ring.copy()
+            ring.add(name)
+
+            shards = dict(shards)
+            shards[name] = context_manager
+            self._routing = (ring, shards)
+
+    def remove_shard(self, name: str) -> ContextManager:
+        with self._shards_lock:
+            ring, shards = self._routing
+            ring = ring.copy()
+            ring.remove(name)
+
+            shards = dict(shards)
+            context_manager = shards.pop(name)
+            self._routing = (ring, shards)
+            return context_manager
+
+    def _split(self, user_ids: Iterable[str]) -> List[Tuple[ContextManager, List[str]]]:
+        ring, shards = self._routing
+        user_ids_by_shard = {}
+        for user_id in user_ids:
+            user_ids_by_shard.setdefault(ring.node(user_id), []).append(user_id)
+        return [
+            (shards[shard_name], shard_user_ids)
+            for shard_name, shard_user_ids in user_ids_by_shard.items()
+        ]
+
+
+class ShardedContextManager(_ShardedContextManagerMixin, BaseContextManager):
+    """
+    Spreads users across context managers with consistent hashing.
+
+    Bulk operations are split by shards and run concurrently in `executor`,
+    by default in a thread pool with a thread per shard, which grows with added shards.
+    """
+
+    def __init__(
+        self,
+        shards: Dict[str, BaseContextManager],
+        vnodes: int = 160,
+        executor: Optional[Executor] = None,
+    ) -> None:
+        super().__init__(shards=shards, vnodes=vnodes)
+        self._executor = executor
+        self._own_executor = None
+        self._own_executor_workers = 0
+        self._own_executor_lock = threading.Lock()
+
+    def get_user_context(self, user_id: str) -> dict:
+        return self.shard(user_id).get_user_context(user_id)
+
+    def set_user_context(self, user_id: str, user_context: dict) -> None:
+        self.shard(user_id).set_user_context(user_id, user_context)
+
+    def update_user_context(
+        self,
+        user_id: str,
+        user_context: dict,
+        changes: UserContextChanges,
+    ) -> None:
+        self.shard(user_id).update_user_context(user_id, user_context, changes)
+
+    def get_many(self, user_ids: List[str]) -> Dict[str, dict]:
+        results = self._run([
+            (shard.get_many, (shard_user_ids,))
+            for shard, shard_user_ids in self._split(user_ids)
+        ])
+
+        user_contexts = {}
+        for result in results:
+            user_contexts.update(result)
+        return {user_id: user_contexts[user_id] for user_id in user_ids}
+
+    def set_many(self, user_contexts: Dict[str, dict]) -> None:
+        self._run([
+            (shard.set_many, (
+                {user_id: user_contexts[user_id] for user_id in shard_user_ids},
+            ))
+            for shard, shard_user_ids in self._split(user_contexts)
+        ])
+
+    def update_many(
+        self,
+        user_contexts: Dict[str, dict],
+        changes: Dict[str, UserContextChanges],
+    ) -> None:
+        self._run([
+            (shard.update_many, (
+                {user_id: user_contexts[user_id] for user_id in shard_user_ids},
+                {user_id: changes[user_id] for user_id in shard_user_ids},
+            ))
+            for shard, shard_user_ids in self._split(user_contexts)
+        ])
+
+    def close(self) -> None:
+        with self._own_executor_lock:
+            if self._own_executor is not None:
+                self._own_executor.shutdown()
+                self._own_executor = None
+                self._own_executor_workers = 0
+
+    def _run(self, calls: List[Tuple]) -> List:
+        if len(calls) <= 1:
+            return [func(*args) for func, args in calls]
+
+        if self._executor is not None:
+            futures = [self._executor.submit(func, *args) for func, args in calls]
+        else:
+            # calls are submitted under the lock, so the executor isn't replaced meanwhile
+            with self._own_executor_lock:
+                shards_count = len(self._routing[1])
+                if self._own_executor_workers < shards_count:
+                    if self._own_executor is not None:
+                        # submitted calls are finished by threads of the old executor
+                        self._own_executor.shutdown(wait=False)
+                    self._own_executor_workers = shards_count
+                    self._own_executor = ThreadPoolExecutor(
+                        max_workers=self._own_executor_workers,
+                        thread_name_prefix='millet-shard',
+                    )
+                futures = [self._own_executor.submit(func, *args) for func, args in calls]
+
+        return [future.result() for future in futures]
+
+
+class AsyncShardedContextManager(_ShardedContextManagerMixin, BaseAsyncContextManager):
+    """Spreads users across async context managers, bulk operations of shards are gathered."""
+
+    def __init__(self, shards: Dict[str, BaseAsyncContextManager], vnodes: int = 160) -> None:
+        super().__init__(shards=shards, vnodes=vnodes)
+
+    async def get_user_context(self, user_id: str) -> dict:
+        return await self.shard(user_id).get_user_context(user_id)
+
+    async def set_user_context(self, user_id: str, user_context: dict) -> None:
+        await self.shard(user_id).set_user_context(user_id, user_context)
+
+    async def update_user_context(
+        self,
+        user_id: str,
+        user_context: dict,
+        changes: UserContextChanges,
+    ) -> None:
+        await self.shard(user_id).update_user_context(user_id, user_context, changes)
+
+    async def get_many(self, user_ids: List[str]) -> Dict[str, dict]:
+        results = await asyncio.gather(*[
+            shard.get_many(shard_user_ids)
+            for shard, shard_user_ids in self._split(user_ids)
+        ])
+
+        user_contexts = {}
+        for result in results:
+            user_contexts.update(result)
+        return {user_id: user_contexts[user_id] for user_id in user_ids}
+
+    async def set_many(self, user_contexts: Dict[str, dict]) -> None:
+        await asyncio.gather(*[
+            shard.set_many(
+                {user_id: user_contexts[user_id] for user_id in shard_user_ids}
+            )
+            for shard, shard_user_ids in self._split(user_contexts)
+        ])
+
+    async def update_many(
+        self,
+        user_contexts: Dict[str, dict],
+        changes: Dict[str, UserContextChanges],
+    ) -> None:
+        await asyncio.gather(*[
+            shard.update_many(
+                {user_id: user_contexts[user_id] for user_id in shard_user_ids},
+                {user_id: changes[user_id] for user_id in shard_user_ids},
+            )
+            for shard, shard_user_ids in self._split(user_contexts)
+        ])
@@ -0,0 +1,463 @@
+import builtins
+import inspect
+import operator
+import sys
+import threading
+import types
+import weakref
+from contextvars import ContextVar
+from functools import partial
+from typing import Any, Callable, List, Optional, Set
+
+# calls of the side functions of the skill which is running now
+_side_calls = ContextVar('millet_side_calls', default=None)
+
+
+class SideCalls:
+    """
+    Calls of side functions during one run of a skill.
+
+    Results from history are returned instead of calling a side function again,
+    results of new calls are collected in current.
+    """
+
+    def __init__(self, plan: 'InterceptionPlan', history: dict) -> None:
+        self.plan = plan
+        self.history = history
+        self.current = {}
+        self._positions = {}
+
+    def call(self, func_name: str, func: Callable, args: tuple, kwargs: dict) -> Any:
+        if self._has_cached(func_name):
+            return self._pop_cached(func_name)
+
+        result = func(*args, **kwargs)
+        self._record(func_name, result)
+        return result
+
+    async def async_call(self, func_name: str, func: Callable, args: tuple, kwargs: dict) -> Any:
+        if self._has_cached(func_name):
+            return self._pop_cached(func_name)
+
+        result = await func(*args, **kwargs)
+        self._record(func_name, result)
+        return result
+
+    def _has_cached(self, func_name: str) -> bool:
+        cached_results = self.history.get(func_name)
+        return bool(cached_results) and self._positions.get(func_name, 0) < len(cached_results)
+
+    def _pop_cached(self, func_name: str) -> Any:
+        position = self._positions.get(func_name, 0)
+        self._positions[func_name] = position + 1
+        return self.history[func_name][position]
+
+    def _record(self, func_name: str, result: Any) -> None:
+        if func_name not in self.current:
+            self.current[func_name] = []
+        self.current[func_name].append(result)
+
+
+class ModuleProxy(types.ModuleType):
+    """
+    Module as it's seen by a skill.
+
+    Dispatchers of side functions are attributes of the proxy, other attributes
+    are read from the module, so the module itself isn't patched.
+    """
+
+    def __init__(self, module: types.ModuleType) -> None:
+        super().__init__(module.__name__)
+        # these are read from the module as well
+        for attribute in ('__doc__', '__package__', '__loader__', '__spec__'):
+            del self.__dict__[attribute]
+        self.__dict__['__millet_module__'] = module
+
+    def __getattr__(self, attribute: str) -> Any:
+        return getattr(self.__dict__['__millet_module__'], attribute)
+
+    def __repr__(self) -> str:
+        return f'<proxy of {self.__dict__["__millet_module__"]!r}>'
+
+
+class SkillGlobals(dict):
+    """
+    Globals of the skill module as they're seen by an intercepted skill.
+
+    Dispatchers of side functions and proxies of modules are kept here, other names
+    are read from the module. Functions of the module are rebound to these globals,
+    so side functions are intercepted in helpers of the skill module too.
+    """
+
+    def __init__(self, module: types.ModuleType) -> None:
+        super().__init__(__builtins__=module.__dict__.get('__builtins__', builtins.__dict__))
+        self.module_globals = module.__dict__
+        self._functions = weakref.WeakKeyDictionary()
+
+    def __missing__(self, name: str) -> Any:
+        value = self.module_globals[name]
+        if isinstance(value, types.FunctionType) and value.__globals__ is self.module_globals:
+            return self.rebind(value)
+        return value
+
+    def rebind(self, func: types.FunctionType) -> types.FunctionType:
+        rebound = self._functions.get(func)
+        if rebound is None:
+            rebound = types.FunctionType(
+                func.__code__, self, func.__name__, func.__defaults__, func.__closure__
+            )
+            rebound.__kwdefaults__ = func.__kwdefaults__
+            rebound.__dict__.update(func.__dict__)
+            rebound.__qualname__ = func.__qualname__
+            rebound.__module__ = func.__module__
+            rebound.__doc__ = func.__doc__
+            rebound.__annotations__ = func.__annotations__
+            self._functions[func] = rebound
+        return rebound
+
+
+class Interception:
+    """
+    Side function `attribute` of `owner`, interceptions of one attribute are equal.
+
+    Globals of a skill and module proxies are seen by one skill only, so their
+    dispatchers are kept there. Other owners (classes, objects) get a dispatcher
+    only while skills which intercept it are running.
+    """
+
+    def __init__(self, owner: Any, attribute: str) -> None:
+        self.owner = owner
+        self.attribute = attribute
+
+    @property
+    def is_scoped(self) -> bool:
+        return not isinstance(self.owner, (SkillGlobals, ModuleProxy))
+
+    def __eq__(self, other: Any) -> bool:
+        if not isinstance(other, Interception):
+            return NotImplemented
+        return self.owner is other.owner and self.attribute == other.attribute
+
+    def __hash__(self) -> int:
+        return hash((id(self.owner), self.attribute))
+
+
+def _dispatcher(interception: Interception, func: Callable, resolve: Callable) -> Callable:
+    func_name = getattr(func, '__name__', None) or str(func)
+
+    if inspect.iscoroutinefunction(func):
+        async def dispatcher(*args, **kwargs):
+            current = resolve()
+            calls = _side_calls.get()
+            if calls is None or interception not in calls.plan.interceptions:
+                return await current(*args, **kwargs)
+            return await calls.async_call(func_name, current, args, kwargs)
+    else:
+        def dispatcher(*args, **kwargs):
+            current = resolve()
+            calls = _side_calls.get()
+            if calls is None or interception not in calls.plan.interceptions:
+                return current(*args, **kwargs)
+            return calls.call(func_name, current, args, kwargs)
+
+    dispatcher.__name__ = func_name
+    dispatcher.__wrapped__ = func
+    return dispatcher
+
+
+_MISSING = object()
+
+
+class _Installation:
+    """Dispatcher of a side method, it's set on the owner while intercepting skills run."""
+
+    def __init__(self, interception: Interception) -> None:
+        self.interception = interception
+        self.count = 0
+        self.original = _MISSING
+        self.dispatcher = None
+
+    def install(self) -> None:
+        owner = self.interception.owner
+        attribute = self.interception.attribute
+
+        original = vars(owner).get(attribute, _MISSING)
+        if _installation_of(original) is self:
+            # the dispatcher was put back by the end of a patch (mock.patch)
+            original = self.original
+        self.original = original
+
+        wrapper = None
+        if isinstance(owner, type):
+            func = inspect.getattr_static(owner, attribute)
+            if isinstance(func, (classmethod, staticmethod)):
+                wrapper = type(func)
+                func = func.__func__
+            elif not isinstance(func, types.FunctionType):
+                # a patched method isn't bound to instances
+                wrapper = staticmethod
+        else:
+            func = getattr(owner, attribute)
+
+        dispatcher = _dispatcher(self.interception, func, lambda: func)
+        dispatcher.__millet_installation__ = self
+        self.dispatcher = wrapper(dispatcher) if wrapper else dispatcher
+        setattr(owner, attribute, self.dispatcher)
+
+    def uninstall(self) -> None:
+        owner = self.interception.owner
+        attribute = self.interception.attribute
+
+        # a patch which has replaced the dispatcher is left as it is
+        if vars(owner).get(attribute) is not self.dispatcher:
+            return
+        if self.original is _MISSING:
+            delattr(owner, attribute)
+        else:
+            setattr(owner, attribute, self.original)
+
+
+def _installation_of(raw: Any) -> Optional[_Installation]:
+    if isinstance(raw, (classmethod, staticmethod)):
+        raw = raw.__func__
+    return getattr(raw, '__millet_installation__', None)
+
+
+class InterceptionPlan:
+    """
+    Side functions and side methods of a skill resolved once.
+
+    Side functions of the skill module are intercepted in a view of the skill,
+    which runs with its own globals, side methods get dispatchers only while
+    the skill runs. Patched side functions (mock.patch) are looked up on every call.
+    """
+
+    def __init__(self, interceptions: List[Interception], view: Any = None) -> None:
+        self.interceptions = frozenset(interceptions)
+        self.view = view
+        self._scoped = [interception for interception in self.interceptions
+                        if interception.is_scoped]
+
+    def __bool__(self) -> bool:
+        return bool(self.interceptions)
+
+    def intercepted(self, skill: Any) -> Any:
+        """Returns the skill as it's run while the plan is applied."""
+
+        return skill if self.view is None else self.view
+
+    def apply(self, calls_history: dict) -> '_AppliedPlan':
+        return _AppliedPlan(self, SideCalls(plan=self, history=calls_history))
+
+    def _install(self) -> None:
+        with _lock:
+            for interception in self._scoped:
+                installation = _installations.get(interception)
+                if installation is None:
+                    installation = _installations[interception] = _Installation(interception)
+                installation.count += 1
+                if installation.count == 1:
+                    installation.install()
+
+    def _uninstall(self) -> None:
+        with _lock:
+            for interception in self._scoped:
+                installation = _installations[interception]
+                installation.count -= 1
+                if installation.count == 0:
+                    del _installations[interception]
+                    installation.uninstall()
+
+
+class _AppliedPlan:
+
+    def __init__(self, plan: InterceptionPlan, calls: SideCalls) -> None:
+        self.plan = plan
+        self.calls = calls
+        self._token = None
+
+    def __enter__(self) -> SideCalls:
+        if self.plan._scoped:
+            self.plan._install()
+        self._token = _side_calls.set(self.calls)
+        return self.calls
+
+    def __exit__(self, *exc_info) -> None:
+        _side_calls.reset(self._token)
+        if self.plan._scoped:
+            self.plan._uninstall()
+
+
+_plans = weakref.WeakKeyDictionary()
+# side methods which are intercepted by running skills
+_installations = {}
+_lock = threading.RLock()
+
+
+def _is_namespace(owner: Any) -> bool:
+    return isinstance(owner, (SkillGlobals, ModuleProxy))
+
+
+def _member(owner: Any, name: str) -> Any:
+    if isinstance(owner, SkillGlobals):
+        return owner[name] if name in owner else owner.module_globals[name]
+    if isinstance(owner, ModuleProxy) and name not in owner.__dict__:
+        return getattr(owner.__dict__['__millet_module__'], name)
+    if isinstance(owner, ModuleProxy):
+        return owner.__dict__[name]
+    return getattr(owner, name)
+
+
+def _set_member(namespace: Any, name: str, value: Any) -> None:
+    if isinstance(namespace, SkillGlobals):
+        namespace[name] = value
+    else:
+        namespace.__dict__[name] = value
+
+
+def _resolve_side_function(skill, side_func_name: str, namespace: SkillGlobals) -> Interception:
+    module_globals = namespace.module_globals
+
+    if str(side_func_name) in {'print', '<built-in function print>'}:
+        interception = Interception(owner=namespace, attribute='print')
+        namespace['print'] = _dispatcher(
+            interception,
+            module_globals.get('print', builtins.print),
+            lambda: module_globals.get('print', builtins.print),
+        )
+        return interception
+
+    *owner_path, attribute = side_func_name.split('.')
+
+    owner = namespace
+    for part in owner_path:
+        try:
+            value = _member(owner, part)
+        except (KeyError, AttributeError):
+            raise ValueError(
+                f'Side function {side_func_name} of {skill.__class__.__name__} is not found'
+            )
+
+        if _is_namespace(owner) and isinstance(value, types.ModuleType):
+            # the skill gets its own view of the module, other code isn't affected
+            if not isinstance(value, ModuleProxy):
+                value = ModuleProxy(value)
+                _set_member(owner, part, value)
+        owner = value
+
+    if isinstance(owner, SkillGlobals):
+        resolve = partial(operator.getitem, module_globals, attribute)
+    elif isinstance(owner, ModuleProxy):
+        resolve = partial(getattr, owner.__dict__['__millet_module__'], attribute)
+    else:
+        # other objects get a dispatcher while the skill runs
+        resolve = partial(getattr, owner, attribute)
+
+    try:
+        func = resolve()
+    except (KeyError, AttributeError):
+        raise ValueError(
+            f'Side function {side_func_name} of {skill.__class__.__name__} is not found'
+        )
+
+    interception = Interception(owner=owner, attribute=attribute)
+    if _is_namespace(owner):
+        _set_member(owner, attribute, _dispatcher(interception, func, resolve))
+    return interception
+
+
+def _resolve_side_method(skill, side_class: Any, side_method_name: str) -> Interception:
+    if isinstance(side_class, str):
+        if side_class == skill.__class__.__name__:
+            side_class = skill.__class__
+        else:
+            side_class_parts = side_class.split('.')
+
+            if side_class_parts[0] == 'self':
+                side_class_parts = side_class_parts[1:]
+                side_class = skill
+
+                for side_class_part in side_class_parts:
+                    side_class = getattr(side_class, side_class_part)
+
+    if isinstance(side_class, str) or not hasattr(side_class, side_method_name):
+        raise ValueError(
+            f'Side method {side_class}.{side_method_name} '
+            f'of {skill.__class__.__name__} is not found'
+        )
+
+    return Interception(owner=side_class, attribute=side_method_name)
+
+
+def _intercepted_view(skill, namespace: SkillGlobals, excluded: Set[str]) -> Any:
+    """
+    Returns the skill with methods of the skill module rebound to its globals.
+
+    The view is an instance of a subclass of the skill class, which shares attributes
+    with the skill. Side methods of the skill class aren't rebound, they are intercepted
+    on the class.
+    """
+
+    cls = skill.__class__
+    module_globals = namespace.module_globals
+    members = dict(__module__=cls.__module__, __qualname__=cls.__qualname__)
+
+    for klass in reversed(cls.__mro__):
+        for name, value in vars(klass).items():
+            if name.startswith('__') or name in excluded:
+                continue
+
+            func = value.__func__ if isinstance(value, (classmethod, staticmethod)) else value
+            if isinstance(func, types.FunctionType) and func.__globals__ is module_globals:
+                rebound = namespace.rebind(func)
+                members[name] = rebound if func is value else type(value)(rebound)
+            else:
+                # a subclass has overridden the method with one from another module
+                members.pop(name, None)
+
+    view = object.__new__(type(cls)(cls.__name__, (cls,), members))
+    view.__dict__ = skill.__dict__
+    return view
+
+
+def compile_interception_plan(skill) -> InterceptionPlan:
+    namespace = SkillGlobals(sys.modules[skill.__module__])
+    interceptions = []
+
+    for side_func_name in skill.side_functions:
+        interceptions.append(_resolve_side_function(skill, side_func_name, namespace))
+
+    for side_class, side_method_name in skill.side_methods:
+        interceptions.append(_resolve_side_method(skill, side_class, side_method_name))
+
+    view = None
+    if any(not interception.is_scoped for interception in interceptions):
+        cls = skill.__class__
+        excluded = {
+            interception.attribute for interception in interceptions
+            if interception.is_scoped
+            and (interception.owner is skill or interception.owner in cls.__mro__)
+        }
+        view = _intercepted_view(skill, namespace, excluded)
+
+    return InterceptionPlan(interceptions, view=view)
+
+
+def get_interception_plan(skill) -> InterceptionPlan:
+    """Returns the interception plan of the skill, it's compiled once per skill instance."""
+
+    try:
+        plan = _plans.get(skill)
+    except TypeError:  # unhashable skill
+        with _lock:
+            return compile_interception_plan(skill)
+
+    if plan is not None:
+        return plan
+
+    with _lock:
+        plan = _plans.get(skill)
+        if plan is None:
+            plan = compile_interception_plan(skill)
+            _plans[skill] = plan
+        return plan
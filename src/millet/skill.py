@@ -1,6 +1,25 @@
+import inspect
+import threading
+import uuid
 from abc import ABC, abstractmethod
-from typing import Any, Dict, List, Optional, Union
-
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Generator,
+    Hashable,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+    Union
+)
+
+from millet.history import History
 from millet.timeouts import MessageTimeOut, MessageTimeOutException
 
 
@@ -27,6 +46,7 @@ class SkillResult:
         direct_to: Optional[str],
         context: dict,
         timeout: Optional[int],
+        frame: Optional[dict] = None,
     ) -> None:
         self.answers = answers
         self.is_relevant = is_relevant
@@ -34,23 +54,82 @@ class SkillResult:
         self.direct_to = direct_to
         self.context = context
         self.timeout = timeout
+        self.frame = frame
+
+
+class SkillExecution:
+    """State of one run of a skill, skill instances themselves are shared between users."""
+
+    def __init__(self, history: Sequence[Any], context: dict, state_name: str) -> None:
+        # history isn't modified, the position of the next replayed message is kept instead
+        self.history = history
+        self.position = 0
+        self.answers = []
+        self.context = context
+        self.state_name = state_name
+
+
+_current_execution = ContextVar('millet_skill_execution', default=None)
 
 
 class BaseSkill(ABC):
 
     initial_state_name = 'execute'
 
-    _history = []
-    _answers = []
-
-    context = {}
+    # In checkpoint mode a dialogue is resumed from the last state instead of
+    # being replayed from the beginning: `ask` and `specify` without `direct_to`
+    # direct to the current state, so progress is kept in the state and context.
+    checkpoint_mode = False
 
     side_functions = []
     side_methods = []
 
+    # used by KeywordSkillClassifier: phrases, commands (like '/start') and regular
+    # expressions which start the skill
+    triggers = []
+    commands = []
+    patterns = []
+
+    # payloads of actions (buttons, callbacks) and prefixes of payloads which start
+    # the skill, the agent routes them by a lookup without the classifier
+    actions = []
+    action_prefixes = []
+
+    @property
+    def _execution(self) -> SkillExecution:
+        execution = _current_execution.get()
+        if execution is None:
+            raise RuntimeError(f'{self.__class__.__name__} is not running')
+        return execution
+
+    @property
+    def _history(self) -> Sequence[Any]:
+        return self._execution.history
+
+    @property
+    def _answers(self) -> List[Any]:
+        return self._execution.answers
+
+    @property
+    def _state_name(self) -> str:
+        return self._execution.state_name
+
+    @property
+    def context(self) -> dict:
+        return self._execution.context
+
+    @context.setter
+    def context(self, context: dict) -> None:
+        self._execution.context = context
+
+    @property
+    def _replays_history(self) -> bool:
+        return not self.checkpoint_mode
+
     @property
     def _is_silent_mood(self):
-        return bool(self._history)
+        execution = self._execution
+        return execution.position < len(execution.history)
 
     def say(self, message: Any) -> None:
         self._have_new_message(message=message)
@@ -94,7 +173,9 @@ class BaseSkill(ABC):
         timeout: Optional[int],
     ) -> Any:
         if self._is_silent_mood:
-            message = self._history.pop(0)
+            execution = self._execution
+            message = execution.history[execution.position]
+            execution.position += 1
             if isinstance(message, MessageTimeOut):
                 raise MessageTimeOutException
             else:
@@ -103,6 +184,9 @@ class BaseSkill(ABC):
         if callable(direct_to):
             direct_to = direct_to.__name__
 
+        if direct_to is None and self.checkpoint_mode:
+            direct_to = self._state_name
+
         raise SkillSignal(
             is_relevant=is_relevant,
             direct_to=direct_to,
@@ -113,55 +197,353 @@ class BaseSkill(ABC):
         self,
         message: Any,
         user_id: str,
-        history: List[Any],
+        history: Sequence[Any],
         state_name: Optional[str],
         context: dict,
     ) -> SkillResult:
-        self._history = history
-        self._history.append(message)
-
-        self._answers = []
-        self.context = context
+        history = History.of(history).append(message)
 
-        initial_message = self._history.pop(0)
+        with self._executing(history, context, state_name) as state_name:
+            # the first message is the initial message of the state, the rest are replayed
+            self._execution.position = 1
+            return self._run_state(history[0], user_id, state_name)
 
+    @contextmanager
+    def _executing(
+        self,
+        history: Sequence[Any],
+        context: dict,
+        state_name: Optional[str],
+    ) -> Iterator[str]:
         if not state_name:
             state_name = self.initial_state_name
 
-        state = getattr(self, state_name)
+        execution = SkillExecution(history=history, context=context, state_name=state_name)
+        token = _current_execution.set(execution)
+        try:
+            yield state_name
+        finally:
+            _current_execution.reset(token)
 
-        is_finished = False
-        is_relevant = True
-        direct_to = None
-        timeout = None
+    def _run_state(self, initial_message: Any, user_id: str, state_name: str) -> SkillResult:
+        state = getattr(self, state_name)
 
         try:
             answer = state(initial_message, user_id)
-            if answer is not None:
-                self._answers.append(answer)
-            is_finished = True
         except SkillSignal as signal:
-            is_relevant = signal.is_relevant
-            direct_to = signal.direct_to
-            timeout = signal.timeout
+            return self._signal_result(signal)
+
+        return self._finished_result(answer)
 
+    def _signal_result(self, signal: SkillSignal) -> SkillResult:
         return SkillResult(
             answers=self._answers,
+            is_relevant=signal.is_relevant,
+            is_finished=False,
+            direct_to=signal.direct_to,
+            context=self.context,
+            timeout=signal.timeout,
+        )
+
+    def _finished_result(self, answer: Any) -> SkillResult:
+        if answer is not None:
+            self._answers.append(answer)
+
+        return SkillResult(
+            answers=self._answers,
+            is_relevant=True,
+            is_finished=True,
+            direct_to=None,
+            context=self.context,
+            timeout=None,
+        )
+
+
+class BaseAsyncSkill(BaseSkill):
+    """Skill with async states, which can await inside: `await self.client.get(...)`."""
+
+    async def run(
+        self,
+        message: Any,
+        user_id: str,
+        history: Sequence[Any],
+        state_name: Optional[str],
+        context: dict,
+    ) -> SkillResult:
+        history = History.of(history).append(message)
+
+        with self._executing(history, context, state_name) as state_name:
+            self._execution.position = 1
+            return await self._run_state(history[0], user_id, state_name)
+
+    async def _run_state(self, initial_message: Any, user_id: str, state_name: str) -> SkillResult:
+        state = getattr(self, state_name)
+
+        try:
+            answer = await state(initial_message, user_id)
+        except SkillSignal as signal:
+            return self._signal_result(signal)
+
+        return self._finished_result(answer)
+
+
+class SkillFrames:
+    """Suspended states of generator skills, bounded by max_size (LRU)."""
+
+    def __init__(self, max_size: int = 10000) -> None:
+        self._max_size = max_size
+        self._frames = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._frames)
+
+    def add(self, generator: Generator) -> str:
+        frame_id = uuid.uuid4().hex
+        with self._lock:
+            self._frames[frame_id] = generator
+            while len(self._frames) > self._max_size:
+                _, evicted = self._frames.popitem(last=False)
+                evicted.close()
+        return frame_id
+
+    def pop(self, frame_id: str) -> Optional[Generator]:
+        with self._lock:
+            return self._frames.pop(frame_id, None)
+
+    def discard(self, frame: Optional[dict]) -> None:
+        if not frame:
+            return
+
+        generator = self.pop(frame['frame_id'])
+        if generator is not None:
+            generator.close()
+
+
+_frames = SkillFrames()
+
+
+class BaseGeneratorSkill(BaseSkill):
+    """
+    Skill with generator states: `answer = yield self.ask(...)`.
+
+    The agent drives a state step by step, so a dialogue is neither unwound
+    by exceptions nor replayed. Suspended generators live in SkillFrames of
+    the current process, the frame in the user context keeps the state and
+    its initial message. If a generator was lost (restart of the process,
+    eviction, another worker), the state is started again with its initial
+    message and the answer to the lost question is dropped.
+    """
+
+    @property
+    def _replays_history(self) -> bool:
+        return False
+
+    def _have_new_message(self, *, message: Any):
+        self._answers.append(message)
+
+    def _need_new_message(
+        self,
+        is_relevant: bool,
+        direct_to: Optional[Union[str, callable]],
+        timeout: Optional[int],
+    ) -> SkillSignal:
+        if callable(direct_to):
+            direct_to = direct_to.__name__
+
+        return SkillSignal(
             is_relevant=is_relevant,
-            is_finished=is_finished,
             direct_to=direct_to,
-            context=self.context,
             timeout=timeout,
         )
 
+    def run(
+        self,
+        message: Any,
+        user_id: str,
+        history: List[Any],
+        state_name: Optional[str],
+        context: dict,
+        frame: Optional[dict] = None,
+        frames: Optional[SkillFrames] = None,
+    ) -> SkillResult:
+        if frames is None:
+            frames = _frames
+
+        generator = None
+        initial_message = message
+
+        if frame:
+            generator = frames.pop(frame['frame_id'])
+            state_name = frame['state']
+            initial_message = frame['message']
+            if generator is None:
+                # lost steps aren't replayed, their side functions would run again,
+                # so the state starts over instead of taking the answer as its initial message
+                message = initial_message
+
+        with self._executing([], context, state_name) as state_name:
+            return self._resume(message, user_id, state_name, generator, initial_message, frames)
+
+    def _resume(
+        self,
+        message: Any,
+        user_id: str,
+        state_name: str,
+        generator: Optional[Generator],
+        initial_message: Any,
+        frames: SkillFrames,
+    ) -> SkillResult:
+        if generator is None:
+            state = getattr(self, state_name)
+            signal = state(message, user_id)
+
+            if inspect.isgenerator(signal):
+                generator = signal
+                signal = self._send(generator, None)
+        else:
+            signal = self._send_message(generator, message)
+
+        if not isinstance(signal, SkillSignal):
+            return self._finished_result(signal)
+
+        direct_to = signal.direct_to
+        new_frame = None
+
+        if generator is None:
+            # a plain state returned `self.ask(...)`, it is started again
+            direct_to = direct_to or state_name
+        elif direct_to:
+            generator.close()
+        else:
+            new_frame = dict(
+                frame_id=frames.add(generator),
+                state=state_name,
+                message=initial_message,
+            )
+
+        return SkillResult(
+            answers=self._answers,
+            is_relevant=signal.is_relevant,
+            is_finished=False,
+            direct_to=direct_to,
+            context=self.context,
+            timeout=signal.timeout,
+            frame=new_frame,
+        )
+
+    def _send_message(self, generator: Generator, message: Any) -> Any:
+        if isinstance(message, MessageTimeOut):
+            return self._send(generator, None, MessageTimeOutException())
+        return self._send(generator, message)
+
+    def _send(
+        self,
+        generator: Generator,
+        value: Any,
+        exception: Optional[Exception] = None,
+    ) -> Any:
+        """Resumes a state until the next signal, returns the result of the state otherwise."""
+
+        try:
+            if exception is not None:
+                signal = generator.throw(exception)
+            else:
+                signal = generator.send(value)
+
+            while signal is None:  # `yield self.say(...)`
+                signal = generator.send(None)
+        except StopIteration as stop:
+            return _Finished(stop.value)
+
+        if not isinstance(signal, SkillSignal):
+            generator.close()
+            raise TypeError(f'State must yield ask/specify signals, got {signal!r}')
+
+        return signal
+
+    def _finished_result(self, answer: Any) -> SkillResult:
+        if isinstance(answer, _Finished):
+            answer = answer.value
+
+        return super()._finished_result(answer)
+
+
+class _Finished:
+
+    def __init__(self, value: Any) -> None:
+        self.value = value
+
 
 class BaseSkillClassifier(ABC):
 
+    # results of a deterministic classifier depend only on the normalized message,
+    # so the agent caches them between turns and users
+    is_deterministic = False
+    classify_cache_size = 10000
+
+    # skills_map is read once by the agent, its values are skills or factories
+    # of skills (for example skill classes) which are called on the first use
     @property
     @abstractmethod
-    def skills_map(self) -> Dict[str, BaseSkill]:
+    def skills_map(self) -> Dict[str, Union[BaseSkill, Callable[[], BaseSkill]]]:
         pass
 
     @abstractmethod
     def classify(self, message: Any, user_id: str) -> List[str]:
         pass
+
+    def classify_batch(self, messages: List[Any], user_ids: List[str]) -> List[List[str]]:
+        """Classifies many messages at once, override it if the classifier is faster on batches."""
+
+        return [self.classify(message, user_id) for message, user_id in zip(messages, user_ids)]
+
+    def score(self, message: Any, user_id: str) -> Tuple[List[str], float]:
+        """Returns skill names with the confidence of the classifier from 0 to 1."""
+
+        skill_names = self.classify(message, user_id)
+        return skill_names, 1.0 if skill_names else 0.0
+
+    def score_batch(
+        self,
+        messages: List[Any],
+        user_ids: List[str],
+    ) -> List[Tuple[List[str], float]]:
+        return [self.score(message, user_id) for message, user_id in zip(messages, user_ids)]
+
+    def normalize_message(self, message: Any) -> Hashable:
+        """Returns the key of the message in the cache of a deterministic classifier."""
+
+        return message
+
+
+class BaseAsyncSkillClassifier(ABC):
+
+    # results of a deterministic classifier depend only on the normalized message,
+    # so the agent caches them between turns and users
+    is_deterministic = False
+    classify_cache_size = 10000
+
+    # skills_map is read once by the agent, its values are skills or factories
+    # of skills (for example skill classes) which are called on the first use
+    @property
+    @abstractmethod
+    def skills_map(self) -> Dict[str, Union[BaseSkill, Callable[[], BaseSkill]]]:
+        pass
+
+    @abstractmethod
+    async def classify(self, message: Any, user_id: str) -> List[str]:
+        pass
+
+    async def classify_batch(self, messages: List[Any], user_ids: List[str]) -> List[List[str]]:
+        """Classifies many messages at once, override it if the classifier is faster on batches."""
+
+        return [
+            await self.classify(message, user_id)
+            for message, user_id in zip(messages, user_ids)
+        ]
+
+    def normalize_message(self, message: Any) -> Hashable:
+        """Returns the key of the message in the cache of a deterministic classifier."""
+
+        return message
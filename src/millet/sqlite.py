@@ -0,0 +1,161 @@
+import re
+import sqlite3
+import threading
+from typing import Dict, List, Optional
+
+from millet.context import BaseContextManager
+from millet.serializers import BaseSerializer, BinarySerializer
+
+# SQLite before 3.32 limits the number of parameters of a statement by 999
+_MAX_PARAMETERS = 999
+
+
+class SQLiteContextManager(BaseContextManager):
+    """
+    Durable context manager of a single node, one row with a context blob per user.
+
+    The database works in WAL mode, so reads don't wait for writes. With `group_commit`
+    writes are committed by `commit_batch_size` contexts or every `commit_interval`
+    seconds instead of one transaction per write, writes which aren't committed yet
+    are lost if the process crashes. The connection is shared by threads under a lock.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        serializer: Optional[BaseSerializer] = None,
+        table: str = 'user_contexts',
+        group_commit: bool = False,
+        commit_interval: float = 0.05,
+        commit_batch_size: int = 100,
+        synchronous: str = 'NORMAL',
+    ) -> None:
+        if not re.fullmatch(r'[A-Za-z_][A-Za-z0-9_]*', table):
+            raise ValueError(f'Invalid table name {table}')
+        if synchronous.upper() not in ('OFF', 'NORMAL', 'FULL', 'EXTRA'):
+            raise ValueError(f'Invalid synchronous mode {synchronous}')
+        if commit_interval <= 0:
+            raise ValueError('commit_interval must be positive')
+        if commit_batch_size <= 0:
+            raise ValueError('commit_batch_size must be positive')
+
+        self._serializer = serializer or BinarySerializer()
+        self._group_commit = group_commit
+        self._commit_batch_size = commit_batch_size
+
+        # transactions are managed explicitly
+        self._connection = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute(f'PRAGMA synchronous={synchronous}')
+        self._connection.execute(
+            f'CREATE TABLE IF NOT EXISTS {table} '
+            f'(user_id TEXT PRIMARY KEY, context BLOB NOT NULL) WITHOUT ROWID'
+        )
+
+        # statements are prepared once and reused from the statement cache of the connection
+        self._select = f'SELECT context FROM {table} WHERE user_id = ?'
+        self._select_many = f'SELECT user_id, context FROM {table} WHERE user_id IN ({{}})'
+        self._upsert = f'INSERT OR REPLACE INTO {table} (user_id, context) VALUES (?, ?)'
+        self._delete = f'DELETE FROM {table} WHERE user_id = ?'
+
+        self.commits = 0
+        self._uncommitted = 0
+        self._lock = threading.Lock()
+
+        self._closed = threading.Event()
+        self._committer = None
+        if group_commit:
+            self._committer = threading.Thread(
+                target=self._commit_periodically,
+                args=(commit_interval,),
+                daemon=True,
+            )
+            self._committer.start()
+
+    def get_user_context(self, user_id: str) -> dict:
+        with self._lock:
+            row = self._connection.execute(self._select, (user_id,)).fetchone()
+
+        if row is None:
+            return self._empty_user_context
+        return self._serializer.loads(row[0])
+
+    def set_user_context(self, user_id: str, user_context: dict) -> None:
+        self.set_many({user_id: user_context})
+
+    def delete_user_context(self, user_id: str) -> None:
+        with self._lock:
+            self._write(self._delete, [(user_id,)])
+
+    def get_many(self, user_ids: List[str]) -> Dict[str, dict]:
+        serialized_user_contexts = {}
+        with self._lock:
+            for start in range(0, len(user_ids), _MAX_PARAMETERS):
+                chunk = user_ids[start:start + _MAX_PARAMETERS]
+                statement = self._select_many.format(', '.join('?' * len(chunk)))
+                serialized_user_contexts.update(self._connection.execute(statement, chunk))
+
+        return {
+            user_id: (
+                self._serializer.loads(serialized_user_contexts[user_id])
+                if user_id in serialized_user_contexts
+                else self._empty_user_context
+            )
+            for user_id in user_ids
+        }
+
+    def set_many(self, user_contexts: Dict[str, dict]) -> None:
+        if not user_contexts:
+            return
+
+        rows = [
+            (user_id, self._serializer.dumps(user_context))
+            for user_id, user_context in user_contexts.items()
+        ]
+        with self._lock:
+            self._write(self._upsert, rows)
+
+    def commit(self) -> None:
+        """Commits writes collected by group commit."""
+
+        with self._lock:
+            self._commit()
+
+    def close(self) -> None:
+        self._closed.set()
+        if self._committer is not None:
+            self._committer.join()
+            self._committer = None
+
+        with self._lock:
+            self._commit()
+            self._connection.close()
+
+    def _write(self, statement: str, rows: List[tuple]) -> None:
+        connection = self._connection
+        if not connection.in_transaction:
+            connection.execute('BEGIN')
+
+        # a failed write doesn't roll back other writes of the group
+        connection.execute('SAVEPOINT write')
+        try:
+            connection.executemany(statement, rows)
+        except Exception:
+            connection.execute('ROLLBACK TO write')
+            raise
+        finally:
+            connection.execute('RELEASE write')
+
+        self._uncommitted += len(rows)
+        if not self._group_commit or self._uncommitted >= self._commit_batch_size:
+            self._commit()
+
+    def _commit(self) -> None:
+        if self._connection.in_transaction:
+            self._connection.execute('COMMIT')
+            self.commits += 1
+        self._uncommitted = 0
+
+    def _commit_periodically(self, commit_interval: float) -> None:
+        while not self._closed.wait(commit_interval):
+            self.commit()
@@ -0,0 +1,245 @@
+import threading
+from abc import ABC, abstractmethod
+from typing import Dict, List, Optional, TypeVar
+
+from millet.cache import LRUCache
+from millet.context import BaseContextManager, UserContextChanges
+
+Redis = TypeVar('Redis')
+
+
+class BaseContextVersions(ABC):
+    """Version stamps of user contexts shared by workers."""
+
+    @abstractmethod
+    def get_many(self, user_ids: List[str]) -> Dict[str, Optional[int]]:
+        pass
+
+    @abstractmethod
+    def bump_many(self, user_ids: List[str]) -> Dict[str, int]:
+        """Returns new versions of the contexts, they are unique for every write."""
+
+
+class RedisContextVersions(BaseContextVersions):
+    """Versions in the keys `<key_prefix><user_id>`, a write increments the version."""
+
+    def __init__(self, redis: Redis, key_prefix: str = 'millet:version:') -> None:
+        self._redis = redis
+        self._key_prefix = key_prefix
+
+    def get_many(self, user_ids: List[str]) -> Dict[str, Optional[int]]:
+        if not user_ids:
+            return {}
+
+        versions = self._redis.mget([self._key_prefix + user_id for user_id in user_ids])
+        return {
+            user_id: int(version) if version is not None else None
+            for user_id, version in zip(user_ids, versions)
+        }
+
+    def bump_many(self, user_ids: List[str]) -> Dict[str, int]:
+        if not user_ids:
+            return {}
+
+        pipeline = self._redis.pipeline(transaction=False)
+        for user_id in user_ids:
+            pipeline.incr(self._key_prefix + user_id)
+        return dict(zip(user_ids, pipeline.execute()))
+
+
+class TieredContextManager(BaseContextManager):
+    """
+    Bounded local LRU of deserialized contexts in front of another context manager.
+
+    Reads are served from the local cache. If `versions` are given, the version of
+    a cached context is compared with the shared one, so a copy which another worker
+    has overwritten (for example after routing of users has changed) is loaded again;
+    without `versions` the local copy is trusted, it's safe with sticky routing only.
+
+    Writes go to the backend at once (write-through) or, with `write_behind`, are
+    collected and written in the background when `batch_size` contexts are collected
+    or every `flush_interval` seconds, a failed flush is counted and retried.
+    Call `close` on shutdown to write the rest.
+    """
+
+    def __init__(
+        self,
+        backend: BaseContextManager,
+        max_size: int = 10000,
+        versions: Optional[BaseContextVersions] = None,
+        write_behind: bool = False,
+        flush_interval: float = 0.1,
+        batch_size: int = 100,
+    ) -> None:
+        if flush_interval <= 0:
+            raise ValueError('flush_interval must be positive')
+        if batch_size <= 0:
+            raise ValueError('batch_size must be positive')
+
+        self._backend = backend
+        self._versions = versions
+        self._write_behind = write_behind
+        self._batch_size = batch_size
+        # values are contexts with their versions, None is the version of an unflushed context
+        self._local = LRUCache(max_size=max_size)
+
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+        self.flushes = 0
+        self.failed_flushes = 0
+
+        self._pending: Dict[str, dict] = {}
+        self._flushing: Dict[str, dict] = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+
+        self._closed = threading.Event()
+        self._is_full = threading.Event()
+        self._flusher = None
+        if write_behind:
+            self._flusher = threading.Thread(
+                target=self._flush_periodically,
+                args=(flush_interval,),
+                daemon=True,
+            )
+            self._flusher.start()
+
+    def get_user_context(self, user_id: str) -> dict:
+        return self.get_many([user_id])[user_id]
+
+    def set_user_context(self, user_id: str, user_context: dict) -> None:
+        self.set_many({user_id: user_context})
+
+    def update_user_context(
+        self,
+        user_id: str,
+        user_context: dict,
+        changes: UserContextChanges,
+    ) -> None:
+        self.update_many({user_id: user_context}, {user_id: changes})
+
+    def get_many(self, user_ids: List[str]) -> Dict[str, dict]:
+        user_contexts = {}
+
+        with self._lock:
+            for user_id in user_ids:
+                if user_id in self._pending:
+                    user_contexts[user_id] = self._pending[user_id]
+                elif user_id in self._flushing:
+                    user_contexts[user_id] = self._flushing[user_id]
+
+        user_ids_to_check = [user_id for user_id in user_ids if user_id not in user_contexts]
+        # versions are read before contexts, so a context is never cached with a newer version
+        versions = self._versions.get_many(user_ids_to_check) if self._versions else {}
+
+        user_ids_to_load = []
+        stale = 0
+        for user_id in user_ids_to_check:
+            cached = self._local.get(user_id)
+            if cached is not None and (self._versions is None or cached[1] == versions[user_id]):
+                user_contexts[user_id] = cached[0]
+            else:
+                stale += cached is not None
+                user_ids_to_load.append(user_id)
+
+        with self._lock:
+            self.hits += len(user_ids_to_check) - len(user_ids_to_load)
+            self.misses += len(user_ids_to_load)
+            self.stale += stale
+
+        if user_ids_to_load:
+            loaded_user_contexts = self._backend.get_many(user_ids_to_load)
+            for user_id, user_context in loaded_user_contexts.items():
+                self._local.set(user_id, (user_context, versions.get(user_id)))
+            user_contexts.update(loaded_user_contexts)
+
+        return {user_id: user_contexts[user_id] for user_id in user_ids}
+
+    def set_many(self, user_contexts: Dict[str, dict]) -> None:
+        self.update_many(user_contexts, None)
+
+    def update_many(
+        self,
+        user_contexts: Dict[str, dict],
+        changes: Optional[Dict[str, UserContextChanges]],
+    ) -> None:
+        if not user_contexts:
+            return
+
+        if not self._write_behind:
+            self._write(user_contexts, changes)
+            return
+
+        # changes of several turns aren't merged, flushed contexts are written entirely
+        with self._lock:
+            self._pending.update(user_contexts)
+            for user_id, user_context in user_contexts.items():
+                self._local.set(user_id, (user_context, None))
+            if len(self._pending) >= self._batch_size:
+                # the flusher writes the batch, errors of the backend aren't raised to the agent
+                self._is_full.set()
+
+    def flush(self) -> None:
+        """Writes collected contexts to the backend."""
+
+        with self._flush_lock:
+            with self._lock:
+                if not self._pending:
+                    return
+                self._flushing, self._pending = self._pending, {}
+
+            try:
+                self._write(self._flushing, None)
+            except Exception:
+                self.failed_flushes += 1
+                with self._lock:
+                    # contexts set during the flush are newer
+                    self._flushing.update(self._pending)
+                    self._pending, self._flushing = self._flushing, {}
+                raise
+
+            with self._lock:
+                self._flushing = {}
+            self.flushes += 1
+
+    def close(self) -> None:
+        """Stops the periodic flush and writes the rest."""
+
+        self._closed.set()
+        self._is_full.set()
+        if self._flusher is not None:
+            self._flusher.join()
+            self._flusher = None
+        self.flush()
+
+    def _write(
+        self,
+        user_contexts: Dict[str, dict],
+        changes: Optional[Dict[str, UserContextChanges]],
+    ) -> None:
+        if changes is None:
+            self._backend.set_many(user_contexts)
+        else:
+            self._backend.update_many(user_contexts, changes)
+
+        # versions are bumped after the write, so a reader never caches an old context
+        # with the new version
+        versions = self._versions.bump_many(list(user_contexts)) if self._versions else {}
+
+        with self._lock:
+            for user_id, user_context in user_contexts.items():
+                if user_id not in self._pending:
+                    self._local.set(user_id, (user_context, versions.get(user_id)))
+
+    def _flush_periodically(self, flush_interval: float) -> None:
+        while not self._closed.is_set():
+            self._is_full.wait(flush_interval)
+            self._is_full.clear()
+            if self._closed.is_set():
+                return
+
+            try:
+                self.flush()
+            except Exception:  # counted in failed_flushes, contexts are retried
+                pass
@@ -18,3 +18,13 @@ class BaseTimeoutsBroker(ABC):
     @abstractmethod
     def execute(self, user_id: str, timeout: int, timeout_uid: str):
         pass
+
+
+class BaseAsyncTimeoutsBroker(ABC):
+
+    def generate_timeout_uid(self, user_id: str, timeout: int) -> str:
+        return str(uuid.uuid4())
+
+    @abstractmethod
+    async def execute(self, user_id: str, timeout: int, timeout_uid: str):
+        pass
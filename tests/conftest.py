@@ -1,5 +1,8 @@
+from typing import Callable
+
 import pytest
 from redis import Redis
+from redis.asyncio import Redis as AsyncRedis
 
 
 @pytest.fixture
@@ -8,3 +11,43 @@ def redis() -> Redis:
     redis.flushdb()
     yield redis
     redis.flushdb()
+
+
+@pytest.fixture
+def async_redis(redis: Redis) -> AsyncRedis:
+    return AsyncRedis()
+
+
+@pytest.fixture
+def empty_user_context() -> dict:
+    return dict(
+        skill_names=[],
+        state_names=[],
+        history=[],
+        context={},
+        calls_history={},
+        timeout_uid=None,
+        frame=None,
+    )
+
+
+@pytest.fixture
+def make_user_context(empty_user_context: dict) -> Callable[[str], dict]:
+    """Returns a factory of user contexts of a dialogue with one message."""
+
+    def make_user_context(message: str) -> dict:
+        return dict(
+            empty_user_context,
+            skill_names=['EchoSkill'],
+            state_names=[None],
+            history=[message],
+        )
+
+    return make_user_context
+
+
+@pytest.fixture
+def storage_path(tmp_path) -> str:
+    """Path of a file or a directory of a context manager which stores contexts on disk."""
+
+    return str(tmp_path / 'contexts')
@@ -1,10 +1,16 @@
+import itertools
 import random
+import sys
+import time
 from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
 from typing import Any, Dict, List
 from unittest import mock
 
-from millet import Agent, BaseSkill, Conversation
+from millet import Agent, BaseSkill, Conversation, Event
+from millet.context import RAMContextManager
 from millet.skill import BaseSkillClassifier
+from millet.sqlite import SQLiteContextManager
 
 
 class TestConversation:
@@ -749,6 +755,50 @@ class TestAgent:
 
         randint_mock.assert_called_once_with(0, 100)
 
+    def test_checkpoint_mode(self):
+
+        class CounterSkill(BaseSkill):
+
+            checkpoint_mode = True
+
+            side_functions = [
+                'random.randint',
+            ]
+
+            calls = 0
+
+            def execute(self, message: str, user_id: str):
+                CounterSkill.calls += 1
+                self.context['total'] = self.context.get('total', 0) + random.randint(1, 1)
+                if message == 'stop':
+                    self.say(f'Total: {self.context["total"]}')
+                    return
+                self.ask(f'Total: {self.context["total"]}')
+
+        class SkillClassifier(BaseSkillClassifier):
+            @property
+            def skills_map(self) -> Dict[str, BaseSkill]:
+                return {
+                    'counter': CounterSkill(),
+                }
+
+            def classify(self, message: Any, user_id: str) -> List[str]:
+                return ['counter']
+
+        skill_classifier = SkillClassifier()
+
+        agent = Agent(skill_classifier=skill_classifier)
+
+        for i in range(1, 51):
+            answers = agent.process_message(message='next', user_id=self.default_user_id)
+            assert answers == [f'Total: {i}']
+
+        # every turn runs the state once, no matter how deep the dialogue is
+        assert CounterSkill.calls == 50
+
+        answers = agent.process_message(message='stop', user_id=self.default_user_id)
+        assert answers == ['Total: 51']
+
     def test_user_id(self):
         class UserIdSkill(BaseSkill):
             def execute(self, message: str, user_id: str):
@@ -880,3 +930,288 @@ class TestAgent:
             user_id=self.default_user_id,
         )
         assert answers == ['echo click']
+
+
+class TestAgentClassifyCache:
+
+    def test_message_is_classified_once_per_turn(self):
+
+        class EchoSkill(BaseSkill):
+            def execute(self, message: str, user_id: str):
+                self.say(message)
+
+        class SkillClassifier(BaseSkillClassifier):
+            calls = 0
+
+            @property
+            def skills_map(self) -> Dict[str, BaseSkill]:
+                return {
+                    'echo': EchoSkill(),
+                }
+
+            def classify(self, message: Any, user_id: str) -> List[str]:
+                self.calls += 1
+                return ['echo'] if message != 'unknown' else []
+
+        skill_classifier = SkillClassifier()
+        agent = Agent(skill_classifier=skill_classifier)
+
+        # the action branch and the branch of a new dialogue share the classification
+        answers = agent.process_action(message='unknown', user_id='bob')
+        assert answers == []
+        assert skill_classifier.calls == 1
+
+        answers = agent.process_message(message='hello', user_id='bob')
+        assert answers == ['hello']
+        answers = agent.process_message(message='hello', user_id='bob')
+        assert answers == ['hello']
+        assert skill_classifier.calls == 3
+        assert agent.classify_cache is None
+
+    def test_deterministic_classifier(self):
+
+        class EchoSkill(BaseSkill):
+            def execute(self, message: Any, user_id: str):
+                self.say(message)
+
+        class SkillClassifier(BaseSkillClassifier):
+            is_deterministic = True
+            classify_cache_size = 2
+            calls = 0
+
+            @property
+            def skills_map(self) -> Dict[str, BaseSkill]:
+                return {
+                    'echo': EchoSkill(),
+                }
+
+            def classify(self, message: Any, user_id: str) -> List[str]:
+                self.calls += 1
+                return ['echo']
+
+            def normalize_message(self, message: Any) -> Any:
+                if isinstance(message, str):
+                    return message.strip().lower()
+                return message
+
+        skill_classifier = SkillClassifier()
+        agent = Agent(skill_classifier=skill_classifier)
+
+        assert agent.process_message(message='Hello', user_id='bob') == ['Hello']
+        assert agent.process_message(message=' hello', user_id='alice') == [' hello']
+        assert skill_classifier.calls == 1
+        assert agent.classify_cache.hits == 1
+
+        # unhashable messages aren't cached
+        agent.process_message(message={'text': 'hello'}, user_id='bob')
+        agent.process_message(message={'text': 'hello'}, user_id='bob')
+        assert skill_classifier.calls == 3
+
+        agent.process_message(message='hi', user_id='bob')
+        agent.process_message(message='bye', user_id='bob')
+        agent.process_message(message='hello', user_id='bob')
+        assert skill_classifier.calls == 6
+        assert len(agent.classify_cache) == 2
+
+
+class TestAgentBatch:
+
+    def test_process_batch(self):
+
+        class MeetingSkill(BaseSkill):
+            def execute(self, message: str, user_id: str):
+                name = self.ask(f'{user_id}: what is your name?')
+                self.say(f'{user_id}: nice to meet you {name}!')
+
+        class SkillClassifier(BaseSkillClassifier):
+            @property
+            def skills_map(self) -> Dict[str, BaseSkill]:
+                return {
+                    'meeting': MeetingSkill(),
+                }
+
+            def classify(self, message: Any, user_id: str) -> List[str]:
+                return ['meeting']
+
+        skill_classifier = SkillClassifier()
+        skill_classifier.classify_batch = mock.Mock(wraps=skill_classifier.classify_batch)
+
+        context_manager = mock.Mock(wraps=RAMContextManager())
+        agent = Agent(skill_classifier=skill_classifier, context_manager=context_manager)
+
+        answers = agent.process_batch([
+            Event(user_id='alice', message='hello'),
+            Event(user_id='bob', message='hello'),
+            Event(user_id='alice', message='Alice'),
+        ])
+
+        assert answers == [
+            ['alice: what is your name?'],
+            ['bob: what is your name?'],
+            ['alice: nice to meet you Alice!'],
+        ]
+        skill_classifier.classify_batch.assert_called_once_with(['hello', 'hello'], ['alice', 'bob'])
+        context_manager.get_many.assert_called_once_with(['alice', 'bob'])
+        context_manager.update_many.assert_called_once()
+        context_manager.get_user_context.assert_not_called()
+        context_manager.set_user_context.assert_not_called()
+
+        answers = agent.process_message(message='Bob', user_id='bob')
+        assert answers == ['bob: nice to meet you Bob!']
+
+
+class TestAgentDirtyTracking:
+
+    def test_unchanged_user_context_isnt_written(self):
+
+        class EchoSkill(BaseSkill):
+            def execute(self, message: str, user_id: str):
+                self.say(message)
+
+        class MeetingSkill(BaseSkill):
+            def execute(self, message: str, user_id: str):
+                name = self.ask('What is your name?')
+                self.say(f'Nice to meet you {name}!')
+
+        class SkillClassifier(BaseSkillClassifier):
+            @property
+            def skills_map(self) -> Dict[str, BaseSkill]:
+                return {
+                    'echo': EchoSkill(),
+                    'meeting': MeetingSkill(),
+                }
+
+            def classify(self, message: Any, user_id: str) -> List[str]:
+                return ['meeting'] if message == 'meet' else ['echo']
+
+        context_manager = mock.Mock(wraps=RAMContextManager())
+        agent = Agent(skill_classifier=SkillClassifier(), context_manager=context_manager)
+
+        assert agent.process_message('hello', 'bob') == ['hello']
+        assert agent.process_message('hi', 'bob') == ['hi']
+        context_manager.update_user_context.assert_not_called()
+        assert agent.avoided_writes == 2
+
+        assert agent.process_message('meet', 'bob') == ['What is your name?']
+        assert agent.process_message('Bob', 'bob') == ['Nice to meet you Bob!']
+        assert context_manager.update_user_context.call_count == 2
+        assert agent.avoided_writes == 2
+
+        assert agent.process_batch([Event(user_id='alice', message='hello')]) == [['hello']]
+        context_manager.update_many.assert_not_called()
+        assert agent.avoided_writes == 3
+
+    def test_context_changed_in_place_is_written(self):
+
+        class CounterSkill(BaseSkill):
+
+            checkpoint_mode = True
+
+            def execute(self, message: str, user_id: str):
+                self.context['total'] = self.context.get('total', 0) + 1
+                self.ask(f'Total: {self.context["total"]}')
+
+        class SkillClassifier(BaseSkillClassifier):
+            @property
+            def skills_map(self) -> Dict[str, BaseSkill]:
+                return {
+                    'counter': CounterSkill(),
+                }
+
+            def classify(self, message: Any, user_id: str) -> List[str]:
+                return ['counter']
+
+        # contexts are serialized, so a change is kept only if it's written
+        context_manager = SQLiteContextManager(':memory:')
+        agent = Agent(skill_classifier=SkillClassifier(), context_manager=context_manager)
+
+        for i in range(1, 4):
+            assert agent.process_message('next', 'bob') == [f'Total: {i}']
+        assert agent.process_batch([
+            Event(user_id='bob', message='next'),
+            Event(user_id='bob', message='next'),
+        ]) == [['Total: 4'], ['Total: 5']]
+
+        assert context_manager.get_user_context('bob')['context'] == {'total': 5}
+        assert agent.avoided_writes == 0
+
+
+class TestAgentConcurrency:
+
+    def test_process_messages_of_different_users_in_threads(self):
+
+        class NumberSkill(BaseSkill):
+
+            side_functions = [
+                'random.randint',
+            ]
+
+            def execute(self, message: str, user_id: str):
+                self.context['user_id'] = user_id
+                number = random.randint(0, 1000000)
+                name = self.ask(f'{user_id}: what is your name? {number}')
+                time.sleep(0.001)
+                self.say(f'{user_id}: nice to meet you {name}')
+                guess = self.ask(f'{user_id}: guess the number {number}')
+                assert self.context['user_id'] == user_id
+                self.say(f'{user_id}: {name}, {guess}, {number}')
+
+        skill = NumberSkill()
+
+        class SkillClassifier(BaseSkillClassifier):
+            @property
+            def skills_map(self) -> Dict[str, BaseSkill]:
+                return {
+                    'number': skill,
+                }
+
+            def classify(self, message: Any, user_id: str) -> List[str]:
+                return ['number']
+
+        agent = Agent(skill_classifier=SkillClassifier())
+
+        def talk(user_id: str) -> List[List[str]]:
+            conversation = agent.conversation_with_user(user_id)
+            return [
+                conversation.process_message('hello'),
+                conversation.process_message(f'name-{user_id}'),
+                conversation.process_message(f'guess-{user_id}'),
+            ]
+
+        # every call returns a new number, so a repeated call changes the number of a user
+        counter = itertools.count()
+        randint_calls = []
+
+        def randint(a: int, b: int) -> int:
+            number = next(counter)
+            randint_calls.append(number)
+            return number
+
+        user_ids = [str(i) for i in range(200)]
+
+        switch_interval = sys.getswitchinterval()
+        sys.setswitchinterval(1e-6)
+        try:
+            with mock.patch('random.randint', randint), \
+                    ThreadPoolExecutor(max_workers=16) as executor:
+                dialogues = list(executor.map(talk, user_ids))
+        finally:
+            sys.setswitchinterval(switch_interval)
+
+        numbers = set()
+        for user_id, dialogue in zip(user_ids, dialogues):
+            assert len(dialogue[0]) == 1
+            question = f'{user_id}: what is your name? '
+            assert dialogue[0][0].startswith(question)
+            number = dialogue[0][0][len(question):]
+
+            assert dialogue[1] == [
+                f'{user_id}: nice to meet you name-{user_id}',
+                f'{user_id}: guess the number {number}',
+            ]
+            assert dialogue[2] == [f'{user_id}: name-{user_id}, guess-{user_id}, {number}']
+            numbers.add(number)
+
+        # the side function was called once per user and replayed afterwards
+        assert len(randint_calls) == len(user_ids)
+        assert numbers == {str(number) for number in randint_calls}
@@ -0,0 +1,447 @@
+import asyncio
+from typing import Any, Dict, List
+from unittest import mock
+
+import pytest
+from redis.asyncio import Redis as AsyncRedis
+
+from millet import (
+    Agent,
+    AsyncAgent,
+    BaseAsyncSkill,
+    BaseAsyncSkillClassifier,
+    BaseGeneratorSkill,
+    BaseSkill,
+    BaseSkillClassifier,
+    Event
+)
+from millet.cache import NegativeCache
+from millet.context import (
+    AsyncFieldRedisContextManager,
+    AsyncRedisContextManager,
+    BaseAsyncContextManager
+)
+from millet.timeouts import BaseAsyncTimeoutsBroker, MessageTimeOutException
+
+
+async def fetch_number() -> int:
+    await asyncio.sleep(0)
+    return 42
+
+
+class AsyncRAMContextManager(BaseAsyncContextManager):
+
+    def __init__(self):
+        self.storage = {}
+
+    async def set_user_context(self, user_id: str, user_context: dict) -> None:
+        await asyncio.sleep(0)
+        self.storage[user_id] = user_context
+
+    async def get_user_context(self, user_id: str) -> dict:
+        await asyncio.sleep(0)
+        return self.storage.get(user_id, self._empty_user_context)
+
+
+class TestAsyncSkill:
+
+    def test_ask(self):
+
+        class MeetingSkill(BaseAsyncSkill):
+            async def execute(self, message: str, user_id: str):
+                await asyncio.sleep(0)
+                name = self.ask('What is your name?')
+                self.say(f'Nice to meet you {name}!')
+
+        skill = MeetingSkill()
+
+        result = asyncio.run(skill.run(
+            message='hello', user_id='100500', history=[], state_name=None, context={}
+        ))
+
+        assert result.answers == ['What is your name?']
+        assert result.is_relevant
+        assert not result.is_finished
+
+        result = asyncio.run(skill.run(
+            message='Bob', user_id='100500', history=['hello'], state_name=None, context={}
+        ))
+
+        assert result.answers == ['Nice to meet you Bob!']
+        assert result.is_finished
+
+
+class TestAsyncAgent:
+
+    default_user_id = 'bob'
+
+    def test_async_skill_classifier_and_context_manager(self):
+
+        class MeetingSkill(BaseAsyncSkill):
+            async def execute(self, message: str, user_id: str):
+                try:
+                    name = self.ask('What is your name?', timeout=10)
+                except MessageTimeOutException:
+                    name = self.ask('I repeat the question: what is your name?')
+
+                await asyncio.sleep(0)
+                return f'Nice to meet you {name}!'
+
+        class SkillClassifier(BaseAsyncSkillClassifier):
+            @property
+            def skills_map(self) -> Dict[str, BaseSkill]:
+                return {
+                    'meeting': MeetingSkill(),
+                }
+
+            async def classify(self, message: Any, user_id: str) -> List[str]:
+                await asyncio.sleep(0)
+                return ['meeting']
+
+        async_task_mock = mock.Mock()
+
+        class FakeTimeoutsBroker(BaseAsyncTimeoutsBroker):
+            async def execute(self, user_id: str, timeout: int, timeout_uid: str):
+                async_task_mock(user_id, timeout, timeout_uid)
+
+            def generate_timeout_uid(self, user_id: str, timeout: int) -> str:
+                return '12345'
+
+        agent = AsyncAgent(
+            skill_classifier=SkillClassifier(),
+            context_manager=AsyncRAMContextManager(),
+            timeouts_broker=FakeTimeoutsBroker(),
+        )
+        conversation = agent.conversation_with_user(self.default_user_id)
+
+        async def talk():
+            return [
+                await conversation.process_message('hello'),
+                await conversation.process_timeout('12345'),
+                await conversation.process_message('Bob'),
+            ]
+
+        assert asyncio.run(talk()) == [
+            ['What is your name?'],
+            ['I repeat the question: what is your name?'],
+            ['Nice to meet you Bob!'],
+        ]
+        async_task_mock.assert_called_once_with(self.default_user_id, 10, '12345')
+
+    def test_sync_skills_and_async_side_function(self):
+        fetch_number_mock = mock.AsyncMock(return_value=35)
+
+        class NumberSkill(BaseAsyncSkill):
+
+            side_functions = [
+                'fetch_number',
+            ]
+
+            async def execute(self, message: str, user_id: str):
+                number_expected = await fetch_number()  # async side function
+                number_actual = int(self.ask('Whats number?'))
+                self.say('ok' if number_actual == number_expected else 'wrong')
+
+        class EchoSkill(BaseSkill):
+            def execute(self, message: str, user_id: str):
+                self.say(message)
+
+        class AgeSkill(BaseGeneratorSkill):
+            def execute(self, message: str, user_id: str):
+                age = yield self.ask('How old are you?')
+                self.say(f'You are {age} years old')
+
+        class SkillClassifier(BaseSkillClassifier):
+            @property
+            def skills_map(self) -> Dict[str, BaseSkill]:
+                return {
+                    'number': NumberSkill(),
+                    'echo': EchoSkill(),
+                    'age': AgeSkill(),
+                }
+
+            def classify(self, message: Any, user_id: str) -> List[str]:
+                if message == 'number':
+                    return ['echo', 'number']
+                return ['age']
+
+        agent = AsyncAgent(skill_classifier=SkillClassifier())
+
+        async def talk():
+            return [
+                await agent.process_message('number', self.default_user_id),
+                await agent.process_message('35', self.default_user_id),
+                await agent.process_message('age', self.default_user_id),
+                await agent.process_message('24', self.default_user_id),
+            ]
+
+        with mock.patch(f'{__name__}.fetch_number', fetch_number_mock):
+            assert asyncio.run(talk()) == [
+                ['number', 'Whats number?'],
+                ['ok'],
+                ['How old are you?'],
+                ['You are 24 years old'],
+            ]
+
+        fetch_number_mock.assert_awaited_once_with()
+
+    def test_many_concurrent_conversations(self):
+
+        class MeetingSkill(BaseAsyncSkill):
+            async def execute(self, message: str, user_id: str):
+                await asyncio.sleep(0)
+                name = self.ask(f'{user_id}: what is your name?')
+                await asyncio.sleep(0)
+                self.say(f'{user_id}: nice to meet you {name}!')
+
+        class SkillClassifier(BaseSkillClassifier):
+            @property
+            def skills_map(self) -> Dict[str, BaseSkill]:
+                return {
+                    'meeting': MeetingSkill(),
+                }
+
+            def classify(self, message: Any, user_id: str) -> List[str]:
+                return ['meeting']
+
+        agent = AsyncAgent(
+            skill_classifier=SkillClassifier(),
+            context_manager=AsyncRAMContextManager(),
+        )
+
+        async def talk(user_id: str):
+            conversation = agent.conversation_with_user(user_id)
+            return [
+                await conversation.process_message('hello'),
+                await conversation.process_message(f'name-{user_id}'),
+            ]
+
+        async def talk_all(user_ids: List[str]):
+            return await asyncio.gather(*[talk(user_id) for user_id in user_ids])
+
+        user_ids = [str(i) for i in range(2000)]
+        dialogues = asyncio.run(talk_all(user_ids))
+
+        for user_id, dialogue in zip(user_ids, dialogues):
+            assert dialogue == [
+                [f'{user_id}: what is your name?'],
+                [f'{user_id}: nice to meet you name-{user_id}!'],
+            ]
+
+    def test_process_batch(self):
+
+        class MeetingSkill(BaseAsyncSkill):
+            async def execute(self, message: str, user_id: str):
+                await asyncio.sleep(0)
+                name = self.ask(f'{user_id}: what is your name?')
+                self.say(f'{user_id}: nice to meet you {name}!')
+
+        class SkillClassifier(BaseSkillClassifier):
+            @property
+            def skills_map(self) -> Dict[str, BaseSkill]:
+                return {
+                    'meeting': MeetingSkill(),
+                }
+
+            def classify(self, message: Any, user_id: str) -> List[str]:
+                return ['meeting']
+
+        context_manager = AsyncRAMContextManager()
+        agent = AsyncAgent(skill_classifier=SkillClassifier(), context_manager=context_manager)
+
+        answers = asyncio.run(agent.process_batch([
+            Event(user_id='alice', message='hello'),
+            Event(user_id='bob', message='hello'),
+            Event(user_id='alice', message='Alice'),
+        ]))
+
+        assert answers == [
+            ['alice: what is your name?'],
+            ['bob: what is your name?'],
+            ['alice: nice to meet you Alice!'],
+        ]
+        # the dialogue of alice is finished, her empty context isn't written
+        assert set(context_manager.storage) == {'bob'}
+        assert agent.avoided_writes == 1
+
+        answers = asyncio.run(agent.process_message(message='Bob', user_id='bob'))
+        assert answers == ['bob: nice to meet you Bob!']
+
+    def test_deterministic_async_classifier(self):
+
+        class EchoSkill(BaseSkill):
+            def execute(self, message: str, user_id: str):
+                self.say(message)
+
+        class SkillClassifier(BaseAsyncSkillClassifier):
+            is_deterministic = True
+            calls = 0
+
+            @property
+            def skills_map(self) -> Dict[str, BaseSkill]:
+                return {
+                    'echo': EchoSkill(),
+                }
+
+            async def classify(self, message: Any, user_id: str) -> List[str]:
+                self.calls += 1
+                return ['echo']
+
+        skill_classifier = SkillClassifier()
+        agent = AsyncAgent(skill_classifier=skill_classifier)
+
+        async def talk():
+            return [
+                await agent.process_message('hello', 'bob'),
+                await agent.process_message('hello', 'alice'),
+            ]
+
+        assert asyncio.run(talk()) == [['hello'], ['hello']]
+        assert skill_classifier.calls == 1
+
+    def test_async_skill_in_sync_agent(self):
+
+        class EchoSkill(BaseAsyncSkill):
+            async def execute(self, message: str, user_id: str):
+                self.say(message)
+
+        class SkillClassifier(BaseSkillClassifier):
+            @property
+            def skills_map(self) -> Dict[str, BaseSkill]:
+                return {
+                    'echo': EchoSkill(),
+                }
+
+            def classify(self, message: Any, user_id: str) -> List[str]:
+                return ['echo']
+
+        agent = Agent(skill_classifier=SkillClassifier())
+
+        with pytest.raises(TypeError):
+            agent.process_message('hello', self.default_user_id)
+
+
+class TestAsyncRedisContextManager:
+
+    def test_reload_user_context(self, async_redis: AsyncRedis):
+        user_context = dict(
+            skill_names=['GreetingSkill', 'BuySkill'],
+            state_names=[None, 'payment'],
+            history=['hello, i want to buy iPhone'],
+            context={'age': '25'},
+            calls_history={},
+            timeout_uid=None,
+            frame=None,
+        )
+
+        async def reload():
+            context_manager = AsyncRedisContextManager(redis=async_redis)
+            await context_manager.set_user_context('Bob', user_context)
+
+            context_manager = AsyncRedisContextManager(redis=async_redis)
+            return [
+                await context_manager.get_user_context('Bob'),
+                await context_manager.get_user_context('Alice'),
+            ]
+
+        reloaded_user_context, other_user_context = asyncio.run(reload())
+
+        assert reloaded_user_context == user_context
+        assert other_user_context == AsyncRAMContextManager()._empty_user_context
+
+
+class TestAsyncRedisContextManagerNegativeCache:
+
+    def test_user_context_is_set_by_other_worker(self, async_redis: AsyncRedis):
+        user_context = dict(
+            skill_names=['GreetingSkill'],
+            state_names=[None],
+            history=[],
+            context={},
+            calls_history={},
+            timeout_uid=None,
+            frame=None,
+        )
+
+        async def reload():
+            context_manager = AsyncRedisContextManager(
+                redis=async_redis,
+                negative_cache=NegativeCache(),
+            )
+            other_context_manager = AsyncRedisContextManager(
+                redis=async_redis,
+                invalidation_channel=AsyncRedisContextManager.default_invalidation_channel,
+            )
+
+            empty_user_context = await context_manager.get_user_context('Bob')
+            is_cached = 'Bob' in context_manager.negative_cache
+            await other_context_manager.set_user_context('Bob', user_context)
+
+            for _ in range(500):
+                if 'Bob' not in context_manager.negative_cache:
+                    break
+                await asyncio.sleep(0.01)
+
+            reloaded_user_context = await context_manager.get_user_context('Bob')
+            await context_manager.close()
+            return empty_user_context, is_cached, reloaded_user_context
+
+        empty_user_context, is_cached, reloaded_user_context = asyncio.run(reload())
+
+        assert empty_user_context == AsyncRAMContextManager()._empty_user_context
+        assert is_cached
+        assert reloaded_user_context == user_context
+
+    def test_concurrent_reads_start_one_listener(self, async_redis: AsyncRedis):
+
+        async def read():
+            context_manager = AsyncRedisContextManager(
+                redis=async_redis,
+                negative_cache=NegativeCache(),
+            )
+            with mock.patch.object(
+                context_manager,
+                '_listen',
+                wraps=context_manager._listen,
+            ) as listen:
+                await asyncio.gather(*[
+                    context_manager.get_user_context(f'user{i}') for i in range(10)
+                ])
+            await context_manager.close()
+            return listen.call_count
+
+        assert asyncio.run(read()) == 1
+
+
+class TestAsyncFieldRedisContextManager:
+
+    def test_process_message(self, async_redis: AsyncRedis):
+
+        class MeetingSkill(BaseSkill):
+            def execute(self, message: str, user_id: str):
+                name = self.ask('What is your name?')
+                self.say(f'Nice to meet you {name}!')
+
+        class SkillClassifier(BaseSkillClassifier):
+            @property
+            def skills_map(self) -> Dict[str, BaseSkill]:
+                return {
+                    'meeting': MeetingSkill(),
+                }
+
+            def classify(self, message: Any, user_id: str) -> List[str]:
+                return ['meeting']
+
+        async def process():
+            context_manager = AsyncFieldRedisContextManager(redis=async_redis)
+            agent = AsyncAgent(skill_classifier=SkillClassifier(), context_manager=context_manager)
+            answers = [await agent.process_message('hello', 'Bob')]
+            user_context = await context_manager.get_user_context('Bob')
+            answers.append(await agent.process_message('Bob', 'Bob'))
+            return answers, user_context
+
+        answers, user_context = asyncio.run(process())
+
+        assert answers == [['What is your name?'], ['Nice to meet you Bob!']]
+        assert user_context['skill_names'] == ['meeting']
+        assert user_context['history'] == ['hello']
@@ -0,0 +1,166 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List
+
+import pytest
+
+from millet import Agent, AsyncAgent, BaseSkill
+from millet.batching import (
+    AsyncMicroBatchingSkillClassifier,
+    MicroBatchingSkillClassifier
+)
+from millet.skill import BaseAsyncSkillClassifier, BaseSkillClassifier
+
+
+class EchoSkill(BaseSkill):
+    def execute(self, message: str, user_id: str):
+        self.say(f'{user_id}: {message}')
+
+
+class SkillClassifier(BaseSkillClassifier):
+
+    def __init__(self):
+        self.batches = []
+
+    @property
+    def skills_map(self) -> Dict[str, BaseSkill]:
+        return {
+            'echo': EchoSkill(),
+        }
+
+    def classify(self, message: Any, user_id: str) -> List[str]:
+        raise AssertionError('classify_batch must be used')
+
+    def classify_batch(self, messages: List[Any], user_ids: List[str]) -> List[List[str]]:
+        if 'error' in messages:
+            raise ValueError('error')
+
+        self.batches.append(list(messages))
+        time.sleep(0.001)
+        if 'short' in messages:
+            return [['echo']]
+        return [['echo'] for _ in messages]
+
+
+class AsyncSkillClassifier(BaseAsyncSkillClassifier):
+
+    def __init__(self):
+        self.batches = []
+
+    @property
+    def skills_map(self) -> Dict[str, BaseSkill]:
+        return {
+            'echo': EchoSkill(),
+        }
+
+    async def classify(self, message: Any, user_id: str) -> List[str]:
+        raise AssertionError('classify_batch must be used')
+
+    async def classify_batch(self, messages: List[Any], user_ids: List[str]) -> List[List[str]]:
+        await asyncio.sleep(0)
+        self.batches.append(list(messages))
+        return [['echo'] for _ in messages]
+
+
+class TestMicroBatchingSkillClassifier:
+
+    def test_concurrent_conversations_share_batches(self):
+        skill_classifier = SkillClassifier()
+        agent = Agent(
+            skill_classifier=MicroBatchingSkillClassifier(skill_classifier, window=0.05),
+        )
+
+        user_ids = [str(i) for i in range(32)]
+        with ThreadPoolExecutor(max_workers=32) as executor:
+            answers = list(executor.map(
+                lambda user_id: agent.process_message('hello', user_id),
+                user_ids,
+            ))
+
+        assert answers == [[f'{user_id}: hello'] for user_id in user_ids]
+        assert sum(len(batch) for batch in skill_classifier.batches) == 32
+        assert len(skill_classifier.batches) < 32
+
+    def test_max_batch_size(self):
+        skill_classifier = SkillClassifier()
+        classifier = MicroBatchingSkillClassifier(skill_classifier, window=10, max_batch_size=4)
+
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            results = list(executor.map(lambda i: classifier.classify(i, str(i)), range(4)))
+
+        assert results == [['echo']] * 4
+        assert (classifier.batches, classifier.batched_messages) == (1, 4)
+        assert classifier.mean_batch_size == 4
+
+    def test_error(self):
+        classifier = MicroBatchingSkillClassifier(SkillClassifier(), window=0)
+
+        with pytest.raises(ValueError):
+            classifier.classify('error', 'bob')
+
+    def test_too_few_results(self):
+        classifier = MicroBatchingSkillClassifier(SkillClassifier(), window=10, max_batch_size=2)
+
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            futures = [
+                executor.submit(classifier.classify, message, 'bob')
+                for message in ['short', 'hello']
+            ]
+
+        for future in futures:
+            with pytest.raises(ValueError):
+                future.result(timeout=1)
+
+
+class TestAsyncMicroBatchingSkillClassifier:
+
+    def test_concurrent_conversations_share_batches(self):
+        skill_classifier = AsyncSkillClassifier()
+        agent = AsyncAgent(
+            skill_classifier=AsyncMicroBatchingSkillClassifier(skill_classifier, max_batch_size=50),
+        )
+
+        user_ids = [str(i) for i in range(200)]
+
+        async def talk_all():
+            return await asyncio.gather(*[
+                agent.process_message('hello', user_id) for user_id in user_ids
+            ])
+
+        answers = asyncio.run(talk_all())
+
+        assert answers == [[f'{user_id}: hello'] for user_id in user_ids]
+        assert [len(batch) for batch in skill_classifier.batches] == [50, 50, 50, 50]
+        assert agent._skill_classifier.batches == 4
+        assert not agent._skill_classifier._tasks
+
+    def test_sync_classifier_and_error(self):
+        classifier = AsyncMicroBatchingSkillClassifier(SkillClassifier(), window=0.001)
+
+        async def classify():
+            return await asyncio.gather(
+                classifier.classify('hello', 'bob'),
+                classifier.classify('error', 'alice'),
+                return_exceptions=True,
+            )
+
+        results = asyncio.run(classify())
+
+        assert isinstance(results[0], ValueError)
+        assert isinstance(results[1], ValueError)
+
+    def test_too_few_results(self):
+        classifier = AsyncMicroBatchingSkillClassifier(SkillClassifier(), max_batch_size=2)
+
+        async def classify():
+            return await asyncio.wait_for(asyncio.gather(
+                classifier.classify('short', 'bob'),
+                classifier.classify('hello', 'alice'),
+                return_exceptions=True,
+            ), timeout=1)
+
+        results = asyncio.run(classify())
+
+        assert isinstance(results[0], ValueError)
+        assert isinstance(results[1], ValueError)
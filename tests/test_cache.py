@@ -0,0 +1,67 @@
+from unittest import mock
+
+import pytest
+
+from millet.cache import LRUCache, NegativeCache
+
+
+class TestLRUCache:
+
+    def test_least_recently_used_item_is_evicted(self):
+        cache = LRUCache(max_size=2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+
+        assert cache.get('a') == 1
+
+        cache.set('c', 3)
+
+        assert 'b' not in cache
+        assert cache.get('a') == 1
+        assert cache.get('c') == 3
+        assert cache.get('b') is None
+        assert (cache.hits, cache.misses) == (3, 1)
+
+    def test_invalid_max_size(self):
+        with pytest.raises(ValueError):
+            LRUCache(max_size=0)
+
+
+class TestNegativeCache:
+
+    def test_entries_expire(self):
+        cache = NegativeCache(ttl=10)
+
+        with mock.patch('millet.cache.time.monotonic', return_value=100):
+            cache.add('bob')
+            assert 'bob' in cache
+
+        with mock.patch('millet.cache.time.monotonic', return_value=110):
+            assert 'bob' not in cache
+            assert len(cache) == 0
+
+        assert (cache.hits, cache.misses) == (1, 1)
+
+    def test_key_isnt_added_after_invalidation(self):
+        cache = NegativeCache()
+        generation = cache.generation
+
+        cache.invalidate('alice')
+        cache.add('bob', generation)
+
+        assert 'bob' not in cache
+
+        cache.add('bob', cache.generation)
+        cache.invalidate('bob')
+
+        assert 'bob' not in cache
+
+    def test_oldest_key_is_evicted(self):
+        cache = NegativeCache(max_size=2)
+        cache.add('a')
+        cache.add('b')
+        cache.add('c')
+
+        assert 'a' not in cache
+        assert 'b' in cache
+        assert 'c' in cache
@@ -0,0 +1,94 @@
+from typing import Any, Dict, List, Tuple
+
+import pytest
+
+from millet import Agent, BaseSkill
+from millet.cascade import CascadeSkillClassifier, CascadeStage
+from millet.keywords import ExactSkillClassifier, KeywordSkillClassifier
+from millet.skill import BaseSkillClassifier
+
+
+class EchoSkill(BaseSkill):
+    def execute(self, message: str, user_id: str):
+        self.say(message)
+
+
+class ModelSkillClassifier(BaseSkillClassifier):
+
+    def __init__(self):
+        self.messages = []
+
+    @property
+    def skills_map(self) -> Dict[str, BaseSkill]:
+        return {
+            'weather': EchoSkill(),
+            'smalltalk': EchoSkill(),
+        }
+
+    def classify(self, message: Any, user_id: str) -> List[str]:
+        return self.score(message, user_id)[0]
+
+    def score(self, message: Any, user_id: str) -> Tuple[List[str], float]:
+        self.messages.append(message)
+        if 'rain' in message:
+            return ['weather'], 0.9
+        return ['smalltalk'], 0.3
+
+
+class TestCascadeSkillClassifier:
+
+    def setup_method(self):
+        self.model = ModelSkillClassifier()
+        self.skill_classifier = CascadeSkillClassifier([
+            CascadeStage(
+                ExactSkillClassifier({'buy': EchoSkill()}, messages={'buy:iphone': ['buy']}),
+                name='exact',
+            ),
+            CascadeStage(
+                KeywordSkillClassifier({'weather': EchoSkill()}, triggers={'weather': ['weather']}),
+                name='keywords',
+            ),
+            CascadeStage(self.model, threshold=0.5, name='model'),
+        ])
+
+    def test_decide(self):
+        assert self.skill_classifier.decide('buy:iphone', 'bob') == (['buy'], 1.0, 'exact')
+        assert self.skill_classifier.decide('weather today', 'bob') == (['weather'], 1.0, 'keywords')
+        assert self.skill_classifier.decide('will it rain', 'bob') == (['weather'], 0.9, 'model')
+        assert self.skill_classifier.decide('how are you', 'bob') == ([], 0.0, None)
+
+        assert self.model.messages == ['will it rain', 'how are you']
+        assert self.skill_classifier.stage_hits == {
+            'exact': 1,
+            'keywords': 1,
+            'model': 1,
+            None: 1,
+        }
+
+    def test_classify_batch(self):
+        messages = ['buy:iphone', 'weather today', 'will it rain', {'payload': 'unknown'}]
+
+        skill_names_batch = self.skill_classifier.classify_batch(messages, ['bob'] * 4)
+
+        assert skill_names_batch == [['buy'], ['weather'], ['weather'], []]
+        assert self.model.messages == ['will it rain', {'payload': 'unknown'}]
+        assert self.skill_classifier.stage_hits == {
+            'exact': 1,
+            'keywords': 1,
+            'model': 1,
+            None: 1,
+        }
+
+    def test_skills_map_and_agent(self):
+        assert set(self.skill_classifier.skills_map) == {'buy', 'weather', 'smalltalk'}
+        assert not self.skill_classifier.is_deterministic
+
+        agent = Agent(skill_classifier=self.skill_classifier)
+        assert agent.process_action('buy:iphone', 'bob') == ['buy:iphone']
+
+    def test_stages_with_same_names(self):
+        with pytest.raises(ValueError):
+            CascadeSkillClassifier([
+                CascadeStage(self.model),
+                CascadeStage(self.model),
+            ])
@@ -1,11 +1,23 @@
+import time
+from unittest import mock
+
 import pytest
 from redis import Redis
 
+from millet import Agent, BaseSkill
+from millet.cache import NegativeCache
 from millet.context import (
+    BoundedRAMContextManager,
+    CopyOnReadContext,
+    FieldRedisContextManager,
     PickleSerializer,
     RAMContextManager,
-    RedisContextManager
+    RedisContextManager,
+    UserContextChanges
 )
+from millet.history import History
+from millet.serializers import BinarySerializer
+from millet.skill import BaseSkillClassifier
 
 _empty_user_context = dict(
     skill_names=[],
@@ -14,6 +26,7 @@ _empty_user_context = dict(
     context={},
     calls_history={},
     timeout_uid=None,
+    frame=None,
 )
 
 
@@ -69,6 +82,61 @@ class TestRAMContextManager:
         assert reloaded_user_context == _empty_user_context
 
 
+class TestBoundedRAMContextManager:
+
+    def test_least_recently_used_user_context_is_evicted(
+        self,
+        empty_user_context,
+        make_user_context,
+    ):
+        context_manager = BoundedRAMContextManager(max_size=2)
+        context_manager.set_user_context('Alice', make_user_context('hello'))
+        context_manager.set_user_context('Bob', make_user_context('hi'))
+        context_manager.get_user_context('Alice')
+
+        context_manager.set_user_context('Eve', make_user_context('hey'))
+
+        assert 'Bob' not in context_manager
+        assert context_manager.get_user_context('Alice') == make_user_context('hello')
+        assert context_manager.get_user_context('Bob') == empty_user_context
+        assert (context_manager.hits, context_manager.misses) == (2, 1)
+        assert context_manager.evictions == 1
+
+    def test_byte_budget(self, make_user_context):
+        context_manager = BoundedRAMContextManager(max_size=None, max_bytes=250, sizeof=lambda _: 100)
+        for user_id in ['Alice', 'Bob', 'Eve']:
+            context_manager.set_user_context(user_id, make_user_context('hello'))
+
+        assert len(context_manager) == 2
+        assert context_manager.bytes == 200
+        assert 'Alice' not in context_manager
+
+    def test_idle_user_contexts_expire(self, empty_user_context, make_user_context):
+        context_manager = BoundedRAMContextManager(ttl=60)
+
+        with mock.patch('millet.context.time.monotonic', return_value=100):
+            context_manager.set_user_context('Alice', make_user_context('hello'))
+        with mock.patch('millet.context.time.monotonic', return_value=130):
+            context_manager.set_user_context('Bob', make_user_context('hi'))
+        with mock.patch('millet.context.time.monotonic', return_value=170):
+            assert context_manager.get_user_context('Alice') == empty_user_context
+            assert context_manager.get_user_context('Bob') == make_user_context('hi')
+
+        assert context_manager.expirations == 1
+        assert len(context_manager) == 1
+
+    def test_finished_dialogue_isnt_stored(self, empty_user_context, make_user_context):
+        context_manager = BoundedRAMContextManager(max_bytes=10000)
+        context_manager.set_user_context('Bob', make_user_context('hello'))
+        assert context_manager.bytes > 0
+
+        context_manager.set_user_context('Bob', dict(empty_user_context))
+
+        assert len(context_manager) == 0
+        assert context_manager.bytes == 0
+        assert context_manager.get_user_context('Bob') == empty_user_context
+
+
 class TestPickleSerializer:
 
     def test_reload(self):
@@ -141,3 +209,310 @@ class TestRedisContextManager:
         reloaded_user_context = context_manager.get_user_context('Bob')
 
         assert reloaded_user_context == user_context
+
+    def test_get_many_and_set_many(self):
+        user_context = dict(
+            skill_names=['GreetingSkill', 'BuySkill'],
+            state_names=[None, 'payment'],
+            history=['hello, i want to buy iPhone'],
+            context={'age': '25'},
+            calls_history={},
+            timeout_uid=None,
+        )
+        self.context_manager.set_many({'Bob': user_context})
+
+        context_manager = RedisContextManager(redis=self.redis)
+        user_contexts = context_manager.get_many(['Bob', 'Alice'])
+
+        assert user_contexts == {'Bob': user_context, 'Alice': _empty_user_context}
+
+    def test_reload_user_context__written_by_pickle_serializer(self):
+        user_context = dict(
+            skill_names=['GreetingSkill', 'BuySkill'],
+            state_names=[None, 'payment'],
+            history=['hello, i want to buy iPhone'],
+            context={'age': '25'},
+            calls_history={},
+            timeout_uid=None,
+        )
+        self.redis.set('Bob', PickleSerializer().dumps(user_context))
+
+        reloaded_user_context = self.context_manager.get_user_context('Bob')
+
+        assert reloaded_user_context == user_context
+
+    def test_reload_user_context__lz4(self):
+        pytest.importorskip('lz4')
+        user_context = dict(
+            skill_names=['GreetingSkill'],
+            state_names=[None],
+            history=['hello'] * 1000,
+            context={},
+            calls_history={},
+            timeout_uid=None,
+        )
+        serializer = BinarySerializer(compression='lz4')
+        context_manager = RedisContextManager(redis=self.redis, serializer=serializer)
+        context_manager.set_user_context('Bob', user_context)
+
+        reloaded_user_context = self.context_manager.get_user_context('Bob')
+
+        assert reloaded_user_context == user_context
+
+
+class TestRedisContextManagerNegativeCache:
+
+    @pytest.fixture(autouse=True)
+    def setup_method_fixture(self, redis: Redis):
+        self.redis = redis
+        self.context_manager = RedisContextManager(redis=redis, negative_cache=NegativeCache())
+        yield
+        self.context_manager.close()
+
+    def test_get_user_context__user_context_doesnt_exist(self):
+        with mock.patch.object(self.redis, 'mget', wraps=self.redis.mget) as mget:
+            assert self.context_manager.get_user_context('Bob') == _empty_user_context
+            assert self.context_manager.get_many(['Bob']) == {'Bob': _empty_user_context}
+
+        mget.assert_called_once_with(['Bob'])
+        assert self.context_manager.negative_cache.hits == 1
+
+    def test_set_and_delete_user_context(self):
+        user_context = dict(_empty_user_context, skill_names=['GreetingSkill'], state_names=[None])
+        self.context_manager.get_user_context('Bob')
+
+        self.context_manager.set_user_context('Bob', user_context)
+        assert self.context_manager.get_user_context('Bob') == user_context
+
+        self.context_manager.delete_user_context('Bob')
+        assert self.context_manager.get_user_context('Bob') == _empty_user_context
+
+    def test_empty_user_context_is_deleted(self):
+        user_context = dict(_empty_user_context, skill_names=['GreetingSkill'], state_names=[None])
+        self.context_manager.set_user_context('Bob', user_context)
+        assert 'Bob' not in self.context_manager.negative_cache
+
+        self.context_manager.set_many({'Bob': _empty_user_context})
+
+        assert not self.redis.exists('Bob')
+        with mock.patch.object(self.redis, 'mget') as mget:
+            assert self.context_manager.get_user_context('Bob') == _empty_user_context
+        mget.assert_not_called()
+
+    def test_user_context_is_set_by_other_worker(self):
+        user_context = dict(_empty_user_context, skill_names=['GreetingSkill'], state_names=[None])
+        other_context_manager = RedisContextManager(redis=self.redis, invalidation_channel=(
+            RedisContextManager.default_invalidation_channel
+        ))
+        self.context_manager.get_user_context('Bob')
+        assert 'Bob' in self.context_manager.negative_cache
+
+        other_context_manager.set_user_context('Bob', user_context)
+
+        deadline = time.monotonic() + 5
+        while 'Bob' in self.context_manager.negative_cache and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+        assert self.context_manager.get_user_context('Bob') == user_context
+
+
+class TestUserContextChanges:
+
+    def test_between__appended_messages(self):
+        history = History(['hello'])
+        user_context = dict(
+            skill_names=['MeetingSkill'],
+            state_names=[None],
+            history=history,
+            context={},
+            calls_history={'get_name': History(['Bob'])},
+            timeout_uid=None,
+        )
+        new_user_context = dict(
+            user_context,
+            state_names=['name'],
+            history=history.append('Bob'),
+            calls_history={'get_name': user_context['calls_history']['get_name'].append('Alice')},
+        )
+
+        changes = UserContextChanges.between(user_context, new_user_context)
+
+        assert changes.fields == {'state_names': ['name']}
+        assert changes.removed_fields == []
+        assert changes.history == ['Bob']
+        assert not changes.history_rewritten
+        assert changes.calls == [('get_name', 'Alice')]
+        assert not changes.calls_rewritten
+        assert not changes.is_empty
+
+    def test_between__rewritten_history(self):
+        user_context = dict(_empty_user_context, history=['hello', 'Bob'])
+        new_user_context = dict(_empty_user_context, history=['Alice'])
+        del new_user_context['frame']
+
+        changes = UserContextChanges.between(user_context, new_user_context)
+
+        assert changes.fields == {}
+        assert changes.removed_fields == ['frame']
+        assert changes.history == ['Alice']
+        assert changes.history_rewritten
+
+    def test_between__same_context(self):
+        user_context = dict(_empty_user_context, history=History(['hello']))
+
+        changes = UserContextChanges.between(user_context, dict(user_context))
+
+        assert changes.is_empty
+
+
+class TestCopyOnReadContext:
+
+    def test_values_are_copied_when_read(self):
+        loaded_context = {'names': ['Bob'], 'form': {'age': 25}, 'answers': [], 'count': 1}
+        context = CopyOnReadContext(loaded_context)
+
+        context['names'].append('Alice')
+        context.get('form')['age'] = 26
+        context.setdefault('cities', []).append('Paris')
+        context['count'] += 1
+
+        assert loaded_context == {'names': ['Bob'], 'form': {'age': 25}, 'answers': [], 'count': 1}
+        assert context == {
+            'names': ['Bob', 'Alice'],
+            'form': {'age': 26},
+            'answers': [],
+            'count': 2,
+            'cities': ['Paris'],
+        }
+        # a value which wasn't read is shared with the loaded context
+        assert dict(context)['answers'] is loaded_context['answers']
+
+    def test_items_are_copied(self):
+        loaded_context = {'names': ['Bob']}
+        context = CopyOnReadContext(loaded_context)
+
+        for _, value in context.items():
+            value.append('Alice')
+        context.pop('names').append('Eve')
+
+        assert loaded_context == {'names': ['Bob']}
+        assert context == {}
+
+
+class TestFieldRedisContextManager:
+
+    @pytest.fixture(autouse=True)
+    def setup_method_fixture(self, redis: Redis):
+        self.redis = redis
+        self.context_manager = FieldRedisContextManager(redis=redis)
+
+    def test_reload_user_context(self):
+        user_context = dict(
+            skill_names=['GreetingSkill', 'BuySkill'],
+            state_names=[None, 'payment'],
+            history=['hello, i want to buy iPhone'],
+            context={'age': '25'},
+            calls_history={'get_price': [100, 200]},
+            timeout_uid=None,
+            frame=None,
+        )
+        self.context_manager.set_user_context('Bob', user_context)
+
+        context_manager = FieldRedisContextManager(redis=self.redis)
+        user_contexts = context_manager.get_many(['Bob', 'Alice'])
+
+        assert user_contexts == {'Bob': user_context, 'Alice': _empty_user_context}
+
+    def test_update_user_context__appends_history(self):
+        user_context = dict(_empty_user_context, skill_names=['EchoSkill'], history=History())
+        self.context_manager.set_user_context('Bob', user_context)
+
+        for message in ['hello', 'how are you?', 'bye']:
+            user_context = self.context_manager.get_user_context('Bob')
+            new_user_context = dict(
+                user_context,
+                history=user_context['history'].append(message),
+                calls_history={'echo': History.of(
+                    user_context['calls_history'].get('echo', ())
+                ).append(message)},
+            )
+            changes = UserContextChanges.between(user_context, new_user_context)
+            with mock.patch.object(self.redis, 'pipeline', wraps=self.redis.pipeline) as pipeline:
+                self.context_manager.update_user_context('Bob', new_user_context, changes)
+
+            assert changes.fields == {}
+            assert changes.history == [message]
+            pipeline.assert_called_once()
+
+        reloaded_user_context = self.context_manager.get_user_context('Bob')
+
+        assert reloaded_user_context['history'] == ['hello', 'how are you?', 'bye']
+        assert reloaded_user_context['calls_history'] == {'echo': ['hello', 'how are you?', 'bye']}
+        assert self.redis.llen('Bob:history') == 3
+        assert self.redis.llen('Bob:calls') == 3
+
+    def test_update_user_context__rewrites_history(self):
+        user_context = dict(_empty_user_context, skill_names=['EchoSkill'], history=['hello'])
+        self.context_manager.set_user_context('Bob', user_context)
+        new_user_context = dict(_empty_user_context, history=['bye'])
+
+        self.context_manager.update_user_context(
+            'Bob',
+            new_user_context,
+            UserContextChanges.between(user_context, new_user_context),
+        )
+
+        assert self.context_manager.get_user_context('Bob') == new_user_context
+
+    def test_agent(self):
+
+        class EchoSkill(BaseSkill):
+            def execute(self, message: str, user_id: str):
+                name = self.ask('What is your name?')
+                self.say(f'Nice to meet you {name}!')
+
+        class SkillClassifier(BaseSkillClassifier):
+            @property
+            def skills_map(self):
+                return {'echo': EchoSkill()}
+
+            def classify(self, message, user_id):
+                return ['echo']
+
+        agent = Agent(skill_classifier=SkillClassifier(), context_manager=self.context_manager)
+
+        assert agent.process_message('hello', 'Bob') == ['What is your name?']
+        assert self.redis.llen('Bob:history') == 1
+        assert agent.process_message('Bob', 'Bob') == ['Nice to meet you Bob!']
+        assert self.context_manager.get_user_context('Bob') == _empty_user_context
+        # keys of the finished dialogue are deleted
+        assert self.redis.keys('Bob:*') == []
+
+    def test_agent__context_changed_in_place(self):
+
+        class FormSkill(BaseSkill):
+            def execute(self, message: str, user_id: str):
+                self.context['a'] = 1
+                self.ask('First?', direct_to=self.second)
+
+            def second(self, message: str, user_id: str):
+                self.context['b'] = message
+                self.ask('Second?', direct_to=self.third)
+
+            def third(self, message: str, user_id: str):
+                self.say(str(sorted(self.context.items())))
+
+        class SkillClassifier(BaseSkillClassifier):
+            @property
+            def skills_map(self):
+                return {'form': FormSkill()}
+
+            def classify(self, message, user_id):
+                return ['form']
+
+        agent = Agent(skill_classifier=SkillClassifier(), context_manager=self.context_manager)
+
+        assert agent.process_message('hello', 'Bob') == ['First?']
+        assert agent.process_message('B', 'Bob') == ['Second?']
+        assert self.context_manager.get_user_context('Bob')['context'] == {'a': 1, 'b': 'B'}
+        assert agent.process_message('C', 'Bob') == ["[('a', 1), ('b', 'B')]"]
@@ -0,0 +1,124 @@
+import zlib
+from typing import List
+
+import pytest
+
+from millet import Agent, BaseSkill
+
+np = pytest.importorskip('numpy')
+
+from millet.embedding import EmbeddingIndex, EmbeddingSkillClassifier  # noqa: E402
+
+DIMENSION = 64
+
+
+def encode(texts: List[str]):
+    """Bag of words with hashed words."""
+
+    vectors = np.zeros((len(texts), DIMENSION), dtype=np.float32)
+    for row, text in enumerate(texts):
+        for word in text.lower().split():
+            vectors[row, zlib.crc32(word.encode()) % DIMENSION] += 1
+    return vectors
+
+
+class EchoSkill(BaseSkill):
+    def execute(self, message: str, user_id: str):
+        self.say(message)
+
+
+examples = {
+    'weather': ['what is the weather', 'will it rain tomorrow', 'weather forecast'],
+    'buy': ['i want to buy a phone', 'order a pizza'],
+    'empty': [],
+}
+
+skills_map = {
+    'weather': EchoSkill,
+    'buy': EchoSkill,
+    'empty': EchoSkill,
+}
+
+
+class TestEmbeddingIndex:
+
+    def test_build(self):
+        index = EmbeddingIndex.build(examples, encode)
+
+        assert index.skill_names == ['weather', 'buy']
+        assert index.offsets.tolist() == [0, 3]
+        assert index.vectors.dtype == np.float32
+        assert index.vectors.shape == (5, DIMENSION)
+        assert index.vectors.flags['C_CONTIGUOUS']
+
+    def test_save_and_load(self, tmp_path):
+        index = EmbeddingIndex.build(examples, encode)
+        index.save(str(tmp_path))
+
+        loaded_index = EmbeddingIndex.load(str(tmp_path))
+
+        assert isinstance(loaded_index.vectors, np.memmap)
+        assert loaded_index.skill_names == index.skill_names
+        assert np.array_equal(loaded_index.vectors, index.vectors)
+
+    def test_without_examples(self):
+        with pytest.raises(ValueError):
+            EmbeddingIndex.build({'empty': []}, encode)
+
+
+class TestEmbeddingSkillClassifier:
+
+    def setup_method(self):
+        self.skill_classifier = EmbeddingSkillClassifier(
+            skills_map=skills_map,
+            index=EmbeddingIndex.build(examples, encode),
+            encoder=encode,
+            threshold=0.4,
+        )
+
+    def test_classify(self):
+        assert self.skill_classifier.classify('what weather tomorrow', 'bob') == ['weather']
+        assert self.skill_classifier.classify('buy pizza', 'bob') == ['buy']
+        assert self.skill_classifier.classify('hello there', 'bob') == []
+        assert self.skill_classifier.classify({'text': 'weather'}, 'bob') == []
+
+    def test_classify_batch(self):
+        skill_names_batch = self.skill_classifier.classify_batch(
+            ['what weather tomorrow', None, 'buy pizza'],
+            ['bob', 'bob', 'alice'],
+        )
+
+        assert skill_names_batch == [['weather'], [], ['buy']]
+
+    def test_top_k(self):
+        skill_classifier = EmbeddingSkillClassifier(
+            skills_map=skills_map,
+            index=EmbeddingIndex.build(examples, encode),
+            encoder=encode,
+            threshold=0,
+            top_k=5,
+        )
+
+        ranked = skill_classifier.rank_batch(['i want the weather forecast'])[0]
+
+        assert [skill_name for skill_name, _ in ranked] == ['weather', 'buy']
+        assert ranked[0][1] > ranked[1][1]
+
+    def test_unknown_skill(self):
+        with pytest.raises(ValueError):
+            EmbeddingSkillClassifier(
+                skills_map={'weather': EchoSkill},
+                index=EmbeddingIndex.build(examples, encode),
+                encoder=encode,
+            )
+
+    def test_agent(self, tmp_path):
+        EmbeddingIndex.build(examples, encode).save(str(tmp_path))
+
+        agent = Agent(skill_classifier=EmbeddingSkillClassifier(
+            skills_map=skills_map,
+            index=EmbeddingIndex.load(str(tmp_path)),
+            encoder=encode,
+        ))
+
+        assert agent.process_message('weather forecast', 'bob') == ['weather forecast']
@@ -0,0 +1,374 @@
+import random
+from typing import Any, Dict, List
+
+from millet import Agent, BaseGeneratorSkill, BaseSkill, BaseSkillClassifier
+from millet.context import RAMContextManager
+from millet.skill import SkillFrames
+from millet.timeouts import MessageTimeOut, MessageTimeOutException
+
+
+class TestGeneratorSkill:
+
+    def setup_method(self):
+        self.frames = SkillFrames()
+
+    def test_say(self):
+
+        class EchoSkill(BaseGeneratorSkill):
+            def execute(self, message: str, user_id: str):
+                self.say(message)
+
+        skill = EchoSkill()
+
+        result = skill.run(
+            message='hello', user_id='100500', history=[], state_name=None, context={},
+            frames=self.frames,
+        )
+
+        assert result.answers == ['hello']
+        assert result.is_relevant
+        assert result.is_finished
+        assert result.direct_to is None
+        assert result.frame is None
+
+    def test_ask(self):
+
+        class MeetingSkill(BaseGeneratorSkill):
+            def execute(self, message: str, user_id: str):
+                name = yield self.ask('What is your name?')
+                age = yield self.ask(f'{name}, how old are you?')
+                return f'{name} is {age} years old'
+
+        skill = MeetingSkill()
+
+        result = skill.run(
+            message='hello', user_id='100500', history=[], state_name=None, context={},
+            frames=self.frames,
+        )
+
+        assert result.answers == ['What is your name?']
+        assert result.is_relevant
+        assert not result.is_finished
+        assert result.direct_to is None
+        assert result.frame['state'] == 'execute'
+        assert result.frame['message'] == 'hello'
+
+        result = skill.run(
+            message='Bob', user_id='100500', history=[], state_name=None, context={},
+            frame=result.frame, frames=self.frames,
+        )
+
+        assert result.answers == ['Bob, how old are you?']
+        assert not result.is_finished
+        assert result.frame['message'] == 'hello'
+
+        result = skill.run(
+            message='24', user_id='100500', history=[], state_name=None, context={},
+            frame=result.frame, frames=self.frames,
+        )
+
+        assert result.answers == ['Bob is 24 years old']
+        assert result.is_finished
+        assert result.frame is None
+        assert len(self.frames) == 0
+
+    def test_ask_with_direct_to(self):
+
+        class MeetingSkillWithStates(BaseGeneratorSkill):
+
+            def execute(self, message: str, user_id: str):
+                self.context['greeting'] = 'Nice to meet you'
+                yield self.ask('What is your name?', direct_to=self.meeting)
+
+            def meeting(self, name: str, user_id: str):
+                self.say(f'{self.context["greeting"]} {name}!')
+
+        skill = MeetingSkillWithStates()
+
+        result = skill.run(
+            message='hello', user_id='100500', history=[], state_name=None, context={},
+            frames=self.frames,
+        )
+
+        assert result.answers == ['What is your name?']
+        assert result.direct_to == 'meeting'
+        assert result.frame is None
+        assert len(self.frames) == 0
+
+        result = skill.run(
+            message='Bob', user_id='100500', history=[], state_name='meeting',
+            context=result.context, frames=self.frames,
+        )
+
+        assert result.answers == ['Nice to meet you Bob!']
+        assert result.is_finished
+
+    def test_specify(self):
+
+        class AgeSkill(BaseGeneratorSkill):
+            def execute(self, message: str, user_id: str):
+                age = message
+                while not age.isdigit():
+                    age = yield self.specify('Send a number pls')
+
+                self.say(f'You are {age} years old')
+
+        skill = AgeSkill()
+
+        result = skill.run(
+            message='twenty four', user_id='100500', history=[], state_name=None, context={},
+            frames=self.frames,
+        )
+
+        assert result.answers == ['Send a number pls']
+        assert not result.is_relevant
+        assert not result.is_finished
+
+        result = skill.run(
+            message='24', user_id='100500', history=[], state_name=None, context={},
+            frame=result.frame, frames=self.frames,
+        )
+
+        assert result.answers == ['You are 24 years old']
+        assert result.is_finished
+
+    def test_timeout(self):
+
+        class MeetingSkill(BaseGeneratorSkill):
+            def execute(self, message: str, user_id: str):
+                try:
+                    name = yield self.ask('What is your name?', timeout=10)
+                except MessageTimeOutException:
+                    name = yield self.ask('I repeat the question: what is your name?')
+
+                return f'Nice to meet you {name}!'
+
+        skill = MeetingSkill()
+
+        result = skill.run(
+            message='hello', user_id='100500', history=[], state_name=None, context={},
+            frames=self.frames,
+        )
+
+        assert result.answers == ['What is your name?']
+        assert result.timeout == 10
+
+        result = skill.run(
+            message=MessageTimeOut(), user_id='100500', history=[], state_name=None, context={},
+            frame=result.frame, frames=self.frames,
+        )
+
+        assert result.answers == ['I repeat the question: what is your name?']
+        assert result.timeout is None
+
+    def test_lost_frame_starts_state_again(self):
+
+        class MeetingSkill(BaseGeneratorSkill):
+            def execute(self, message: str, user_id: str):
+                name = yield self.ask(f'{message}? What is your name?')
+                age = yield self.ask(f'{name}, how old are you?')
+                return f'{name} is {age} years old'
+
+        skill = MeetingSkill()
+
+        result = skill.run(
+            message='hello', user_id='100500', history=[], state_name=None, context={},
+            frames=self.frames,
+        )
+        result = skill.run(
+            message='Bob', user_id='100500', history=[], state_name=None, context={},
+            frame=result.frame, frames=self.frames,
+        )
+        assert result.answers == ['Bob, how old are you?']
+
+        result = skill.run(
+            message='24', user_id='100500', history=[], state_name=None, context={},
+            frame=result.frame, frames=SkillFrames(),
+        )
+
+        # the answer isn't taken as the initial message of the state
+        assert result.answers == ['hello? What is your name?']
+        assert result.frame['message'] == 'hello'
+
+    def test_lost_frame_of_changed_state(self):
+
+        class MeetingSkill(BaseGeneratorSkill):
+            def execute(self, message: str, user_id: str):
+                if self.context.get('known'):
+                    return 'Welcome back!'
+
+                name = yield self.ask('What is your name?')
+                return f'Nice to meet you {name}!'
+
+        skill = MeetingSkill()
+        context = {}
+
+        result = skill.run(
+            message='hello', user_id='100500', history=[], state_name=None, context=context,
+            frames=self.frames,
+        )
+        context['known'] = True
+
+        result = skill.run(
+            message='Bob', user_id='100500', history=[], state_name=None, context=context,
+            frame=result.frame, frames=SkillFrames(),
+        )
+
+        assert result.answers == ['Welcome back!']
+        assert result.is_finished
+
+    def test_frames_are_bounded(self):
+
+        class MeetingSkill(BaseGeneratorSkill):
+            def execute(self, message: str, user_id: str):
+                name = yield self.ask('What is your name?')
+                return f'Nice to meet you {name}!'
+
+        skill = MeetingSkill()
+        frames = SkillFrames(max_size=2)
+
+        for _ in range(3):
+            skill.run(
+                message='hello', user_id='100500', history=[], state_name=None, context={},
+                frames=frames,
+            )
+
+        assert len(frames) == 2
+
+
+class TestAgentWithGeneratorSkill:
+
+    default_user_id = 'bob'
+
+    def test_generator_and_base_skills(self):
+
+        class EchoSkill(BaseSkill):
+            def execute(self, message: str, user_id: str):
+                self.say(message)
+
+        class AgeSkill(BaseGeneratorSkill):
+            def execute(self, message: str, user_id: str):
+                name = yield self.ask('What is your name?')
+                self.say(f'Nice to meet you {name}!')
+
+                age = yield self.ask(f'{name}, how old are you?')
+                while not age.isdigit():
+                    age = yield self.specify(f'{name}, send a number pls')
+
+                self.say(f'You are {age} years old')
+
+        class SkillClassifier(BaseSkillClassifier):
+            @property
+            def skills_map(self) -> Dict[str, BaseSkill]:
+                return {
+                    'echo': EchoSkill(),
+                    'age': AgeSkill(),
+                }
+
+            def classify(self, message: Any, user_id: str) -> List[str]:
+                if 'age' in message:
+                    return ['echo', 'age']
+                if 'echo' in message:
+                    return ['echo']
+                return []
+
+        agent = Agent(skill_classifier=SkillClassifier())
+
+        answers = agent.process_message(message='Ask me about age', user_id=self.default_user_id)
+        assert answers == ['Ask me about age', 'What is your name?']
+
+        answers = agent.process_message(message='Bob', user_id=self.default_user_id)
+        assert answers == ['Nice to meet you Bob!', 'Bob, how old are you?']
+
+        answers = agent.process_message(message='twenty four', user_id=self.default_user_id)
+        assert answers == ['Bob, send a number pls']
+
+        answers = agent.process_message(message='24', user_id=self.default_user_id)
+        assert answers == ['You are 24 years old']
+
+        assert agent._context_manager.get_user_context(self.default_user_id)['frame'] is None
+
+    def test_interrupt_skill(self):
+
+        class EchoSkill(BaseSkill):
+            def execute(self, message: str, user_id: str):
+                self.say(message)
+
+        class AgeSkill(BaseGeneratorSkill):
+            def execute(self, message: str, user_id: str):
+                age = yield self.ask('How old are you?')
+                while not age.isdigit():
+                    age = yield self.specify('Send a number pls')
+
+                self.say(f'You are {age} years old')
+
+        class SkillClassifier(BaseSkillClassifier):
+            @property
+            def skills_map(self) -> Dict[str, BaseSkill]:
+                return {
+                    'echo': EchoSkill(),
+                    'age': AgeSkill(),
+                }
+
+            def classify(self, message: Any, user_id: str) -> List[str]:
+                if 'age' in message:
+                    return ['age']
+                if 'echo' in message:
+                    return ['echo']
+                return []
+
+        agent = Agent(skill_classifier=SkillClassifier())
+
+        answers = agent.process_message(message='Ask me about age', user_id=self.default_user_id)
+        assert answers == ['How old are you?']
+
+        answers = agent.process_message(message='twenty four', user_id=self.default_user_id)
+        assert answers == ['Send a number pls']
+        assert len(agent._frames) == 1
+
+        answers = agent.process_message(message='echo', user_id=self.default_user_id)
+        assert answers == ['echo']
+        assert len(agent._frames) == 0
+
+    def test_agents_with_shared_storage(self):
+        randint_calls = []
+
+        class NumberSkill(BaseGeneratorSkill):
+
+            side_functions = [
+                'random.randint',
+            ]
+
+            def execute(self, message: str, user_id: str):
+                number = random.randint(0, 1000000)
+                randint_calls.append(number)
+                yield self.ask(f'Remember {number}')
+                yield self.ask(f'Again? {number}')
+                return f'Number was {number}'
+
+        class SkillClassifier(BaseSkillClassifier):
+            @property
+            def skills_map(self) -> Dict[str, BaseSkill]:
+                return {'number': NumberSkill()}
+
+            def classify(self, message: Any, user_id: str) -> List[str]:
+                return ['number']
+
+        context_manager = RAMContextManager()
+        agent = Agent(skill_classifier=SkillClassifier(), context_manager=context_manager)
+        other_agent = Agent(skill_classifier=SkillClassifier(), context_manager=context_manager)
+
+        answers = agent.process_message(message='hello', user_id=self.default_user_id)
+        assert answers == [f'Remember {randint_calls[0]}']
+
+        # the generator lives in the first agent, so the state starts over
+        # instead of continuing with a number which was never shown
+        answers = other_agent.process_message(message='ok', user_id=self.default_user_id)
+        assert answers == [f'Remember {randint_calls[1]}']
+
+        answers = other_agent.process_message(message='ok', user_id=self.default_user_id)
+        assert answers == [f'Again? {randint_calls[1]}']
+
+        answers = other_agent.process_message(message='ok', user_id=self.default_user_id)
+        assert answers == [f'Number was {randint_calls[1]}']
+        assert len(randint_calls) == 2
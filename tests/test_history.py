@@ -0,0 +1,58 @@
+import pickle
+
+import pytest
+
+from millet.history import History
+
+
+class TestHistory:
+
+    def test_append(self):
+        history = History()
+        first = history.append('hello')
+        second = first.append('Bob')
+
+        assert history == []
+        assert first == ['hello']
+        assert second == ['hello', 'Bob']
+        assert second[-1] == 'Bob'
+        assert second[:1] == ['hello']
+
+    def test_append_shares_items(self):
+        history = History(['hello']).append('Bob')
+
+        first = history.append('Alice')
+        second = history.append('Alice')
+
+        assert first._items is history._items
+        assert second._items is history._items
+
+    def test_append_to_old_history(self):
+        history = History(['hello'])
+        first = history.append('Bob')
+        second = history.append('Alice')
+
+        assert first == ['hello', 'Bob']
+        assert second == ['hello', 'Alice']
+        assert second._items is not first._items
+
+    def test_extend(self):
+        history = History(['hello']).extend(['Bob', 'Alice'])
+        assert history == ['hello', 'Bob', 'Alice']
+
+    def test_index_out_of_range(self):
+        history = History(['hello'])
+        history.append('Bob')
+
+        assert history[0] == 'hello'
+        with pytest.raises(IndexError):
+            history[1]
+
+    def test_pickle(self):
+        history = History(['hello', 'Bob'])
+        history.append('Alice')
+
+        reloaded_history = pickle.loads(pickle.dumps(history, 0))
+
+        assert reloaded_history == ['hello', 'Bob']
+        assert isinstance(reloaded_history, History)
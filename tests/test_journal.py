@@ -0,0 +1,151 @@
+import os
+import threading
+import time
+
+import pytest
+
+from millet.journal import JournaledRAMContextManager
+
+
+class SlowToPickle:
+    """Takes `delay` seconds to be pickled."""
+
+    delay = 0.0
+
+    def __reduce__(self):
+        time.sleep(self.delay)
+        return SlowToPickle, ()
+
+
+class TestJournaledRAMContextManager:
+
+    def test_restore_from_journal(self, storage_path, empty_user_context, make_user_context):
+        context_manager = JournaledRAMContextManager(storage_path, fsync='always')
+        context_manager.set_user_context('Alice', make_user_context('hello'))
+        context_manager.set_user_context('Bob', make_user_context('hi'))
+        context_manager.set_user_context('Bob', make_user_context('bye'))
+        context_manager.set_user_context('Alice', dict(empty_user_context))
+        context_manager.close()
+
+        context_manager = JournaledRAMContextManager(storage_path)
+
+        assert context_manager.get_user_context('Bob') == make_user_context('bye')
+        assert context_manager.get_user_context('Alice') == empty_user_context
+        assert 'Alice' not in context_manager._storage
+        context_manager.close()
+
+    def test_restore_from_snapshot_and_journal(
+        self,
+        storage_path,
+        empty_user_context,
+        make_user_context,
+    ):
+        context_manager = JournaledRAMContextManager(storage_path, snapshot_every=None)
+        context_manager.set_many({f'user{i}': make_user_context(str(i)) for i in range(25)})
+        context_manager.snapshot()
+        context_manager.set_user_context('user0', make_user_context('bye'))
+        context_manager.delete_user_context('user1')
+        context_manager.close()
+
+        assert sorted(os.listdir(storage_path)) == ['journal-00000002.log', 'snapshot-00000002.pickle']
+
+        context_manager = JournaledRAMContextManager(storage_path)
+
+        assert len(context_manager._storage) == 24
+        assert context_manager.get_user_context('user0') == make_user_context('bye')
+        assert context_manager.get_user_context('user1') == empty_user_context
+        assert context_manager.get_user_context('user2') == make_user_context('2')
+        context_manager.close()
+
+    def test_snapshot_in_background(self, storage_path, make_user_context):
+        context_manager = JournaledRAMContextManager(storage_path, snapshot_every=10)
+        for i in range(10):
+            context_manager.set_user_context(f'user{i}', make_user_context(str(i)))
+
+        with context_manager._snapshot_lock:
+            pass
+        context_manager.close()
+
+        assert context_manager.snapshots == 1
+        assert 'journal-00000001.log' not in os.listdir(storage_path)
+
+    def test_snapshot_is_not_changed_in_place(self, storage_path, make_user_context):
+        context_manager = JournaledRAMContextManager(storage_path, snapshot_every=None)
+        user_context = make_user_context('hello')
+        context_manager.set_user_context('Bob', user_context)
+        lock = context_manager._lock
+
+        class ModifyingLock:
+            """Modifies the stored context in place right after the snapshot releases the lock."""
+
+            def __enter__(self):
+                lock.acquire()
+
+            def __exit__(self, *args):
+                lock.release()
+                user_context['history'].append('bye')
+
+        context_manager._lock = ModifyingLock()
+        context_manager.snapshot()
+        context_manager._lock = lock
+        context_manager.close()
+
+        context_manager = JournaledRAMContextManager(storage_path)
+
+        assert context_manager.get_user_context('Bob') == make_user_context('hello')
+        context_manager.close()
+
+    def test_snapshot_doesnt_block_writes(self, storage_path, monkeypatch, make_user_context):
+        context_manager = JournaledRAMContextManager(storage_path, snapshot_every=None)
+        for i in range(100):
+            user_context = make_user_context(str(i))
+            user_context['context'] = {'value': SlowToPickle()}
+            context_manager.set_user_context(f'user{i}', user_context)
+
+        # pickling the stored contexts again would take a second
+        monkeypatch.setattr(SlowToPickle, 'delay', 0.01)
+        snapshot = threading.Thread(target=context_manager.snapshot)
+        snapshot.start()
+
+        latencies = []
+        while snapshot.is_alive() or not latencies:
+            started_at = time.perf_counter()
+            context_manager.set_user_context('Bob', make_user_context('hi'))
+            latencies.append(time.perf_counter() - started_at)
+        snapshot.join()
+        context_manager.close()
+
+        assert context_manager.snapshots == 1
+        assert max(latencies) < 0.1
+
+        context_manager = JournaledRAMContextManager(storage_path)
+
+        assert len(context_manager._storage) == 101
+        user_context = context_manager.get_user_context('user0')
+        assert isinstance(user_context['context']['value'], SlowToPickle)
+        context_manager.close()
+
+    def test_torn_record_is_dropped(self, storage_path, empty_user_context, make_user_context):
+        context_manager = JournaledRAMContextManager(storage_path, fsync='never')
+        context_manager.set_user_context('Alice', make_user_context('hello'))
+        context_manager.set_user_context('Bob', make_user_context('hi'))
+        context_manager.close()
+
+        path = os.path.join(storage_path, 'journal-00000001.log')
+        with open(path, 'r+b') as f:
+            f.truncate(os.path.getsize(path) - 3)
+
+        context_manager = JournaledRAMContextManager(storage_path)
+        context_manager.set_user_context('Eve', make_user_context('hey'))
+        context_manager.close()
+
+        context_manager = JournaledRAMContextManager(storage_path)
+
+        assert context_manager.get_user_context('Alice') == make_user_context('hello')
+        assert context_manager.get_user_context('Bob') == empty_user_context
+        assert context_manager.get_user_context('Eve') == make_user_context('hey')
+        context_manager.close()
+
+    def test_invalid_fsync(self, storage_path):
+        with pytest.raises(ValueError):
+            JournaledRAMContextManager(storage_path, fsync='sometimes')
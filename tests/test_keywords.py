@@ -0,0 +1,100 @@
+from typing import Any
+
+import pytest
+
+from millet import Agent, BaseSkill
+from millet.keywords import AhoCorasick, KeywordSkillClassifier
+
+
+class TestAhoCorasick:
+
+    def test_search(self):
+        automaton = AhoCorasick([('he', 1), ('she', 2), ('his', 3), ('hers', 4)])
+
+        occurrences = list(automaton.search('ushers'))
+
+        assert sorted(occurrences) == [(1, 4, 2), (2, 4, 1), (2, 6, 4)]
+
+    def test_empty_phrase(self):
+        with pytest.raises(ValueError):
+            AhoCorasick([('', 1)])
+
+
+class WeatherSkill(BaseSkill):
+
+    triggers = ['weather', 'forecast']
+    commands = ['/weather']
+
+    def execute(self, message: str, user_id: str):
+        self.say('sunny')
+
+
+class BuySkill(BaseSkill):
+
+    triggers = ['buy', 'order']
+    patterns = [r'\bi want (an? )?iphone\b']
+
+    def execute(self, message: str, user_id: str):
+        self.say('ok')
+
+
+class TestKeywordSkillClassifier:
+
+    def setup_method(self):
+        self.skill_classifier = KeywordSkillClassifier(
+            skills_map={
+                'weather': WeatherSkill(),
+                'buy': BuySkill,
+                'greeting': BaseSkill,
+            },
+            triggers={
+                'greeting': ['hello', 'good morning'],
+            },
+        )
+
+    @pytest.mark.parametrize('message, skill_names', [
+        ('What is the weather?', ['weather']),
+        ('Good Morning! I want to ORDER an umbrella', ['buy', 'greeting']),
+        ('I want an iPhone', ['buy']),
+        ('Show me the forecast and buy a coat, hello', ['weather', 'buy', 'greeting']),
+        ('/weather', ['weather']),
+        ('/weather@millet_bot tomorrow', ['weather']),
+        ('/weathers', []),
+        ('buying', []),
+        ('', []),
+    ])
+    def test_classify(self, message: Any, skill_names: list):
+        assert self.skill_classifier.classify(message, 'bob') == skill_names
+
+    def test_not_text_message(self):
+        assert self.skill_classifier.classify({'text': 'weather'}, 'bob') == []
+
+    def test_substrings(self):
+        skill_classifier = KeywordSkillClassifier(
+            skills_map={'buy': BuySkill()},
+            whole_words=False,
+            case_sensitive=True,
+        )
+
+        assert skill_classifier.classify('buying', 'bob') == ['buy']
+        assert skill_classifier.classify('Buy', 'bob') == []
+
+    def test_overlapping_patterns(self):
+        skill_classifier = KeywordSkillClassifier(
+            skills_map={'buy': BuySkill, 'model': BaseSkill, 'call': BaseSkill, 'help': BaseSkill},
+            patterns={
+                'model': [r'iphone \d+'],
+                'call': [r'phone', r'call me'],
+                'help': [r'^help'],
+            },
+        )
+
+        assert skill_classifier.classify('I want an iPhone 15', 'bob') == ['buy', 'model', 'call']
+        assert skill_classifier.classify('help, call me', 'bob') == ['call', 'help']
+        assert skill_classifier.classify('no help', 'bob') == []
+
+    def test_agent(self):
+        agent = Agent(skill_classifier=self.skill_classifier)
+
+        assert agent.process_message('weather please', 'bob') == ['sunny']
+        assert agent.process_message('buy it', 'bob') == ['ok']
@@ -0,0 +1,137 @@
+import multiprocessing
+import os
+from typing import Callable
+
+import pytest
+
+from millet.context import RAMContextManager
+from millet.mmap_store import MmapContextManager
+from millet.serializers import JSONSerializer
+
+
+def _write_user_contexts(
+    path: str,
+    worker: int,
+    make_user_context: Callable[[str], dict],
+) -> None:
+    context_manager = MmapContextManager(path, slots=64, slot_size=512)
+    for i in range(20):
+        context_manager.set_user_context(f'user{worker}-{i}', make_user_context(f'{worker}-{i}'))
+        context_manager.set_user_context('shared', make_user_context(str(worker)))
+    context_manager.close()
+
+
+class TestMmapContextManager:
+
+    def test_user_context_is_shared(self, storage_path, empty_user_context, make_user_context):
+        context_manager = MmapContextManager(storage_path, slots=16, slot_size=512)
+        other_context_manager = MmapContextManager(storage_path)
+
+        context_manager.set_user_context('Bob', make_user_context('hello'))
+        other_context_manager.set_user_context('Bob', make_user_context('bye'))
+
+        assert other_context_manager.slots == 16
+        assert context_manager.get_user_context('Bob') == make_user_context('bye')
+        assert context_manager.get_user_context('Alice') == empty_user_context
+
+        context_manager.close()
+        other_context_manager.close()
+
+    def test_colliding_user_ids_and_deleted_slots(
+        self,
+        storage_path,
+        empty_user_context,
+        make_user_context,
+    ):
+        context_manager = MmapContextManager(storage_path, slots=4, slot_size=512)
+        for user_id in ['a', 'b', 'c', 'd']:
+            context_manager.set_user_context(user_id, make_user_context(user_id))
+
+        with pytest.raises(RuntimeError):
+            context_manager.set_user_context('e', make_user_context('e'))
+
+        context_manager.delete_user_context('b')
+        context_manager.set_user_context('e', make_user_context('e'))
+
+        assert context_manager.get_many(['a', 'b', 'c', 'd', 'e']) == {
+            'a': make_user_context('a'),
+            'b': empty_user_context,
+            'c': make_user_context('c'),
+            'd': make_user_context('d'),
+            'e': make_user_context('e'),
+        }
+        context_manager.close()
+
+    def test_finished_dialogues_are_deleted(
+        self,
+        storage_path,
+        empty_user_context,
+        make_user_context,
+    ):
+        context_manager = MmapContextManager(storage_path, slots=8, slot_size=512)
+
+        for i in range(100):
+            context_manager.set_user_context(f'user{i}', make_user_context('hello'))
+            context_manager.set_user_context(f'user{i}', dict(empty_user_context))
+
+        assert context_manager.get_user_context('user0') == empty_user_context
+        # deleted slots before empty ones are emptied, so chains don't grow
+        states = [context_manager._mmap[context_manager._offset(slot)] for slot in range(8)]
+        assert states.count(0) >= 7
+        context_manager.close()
+
+    def test_large_user_context(self, storage_path, empty_user_context, make_user_context):
+        overflow = RAMContextManager()
+        context_manager = MmapContextManager(storage_path, slots=16, slot_size=256, overflow=overflow)
+        user_context = make_user_context(os.urandom(1000).hex())
+
+        context_manager.set_user_context('Bob', user_context)
+
+        assert context_manager.get_user_context('Bob') == user_context
+        assert overflow.get_user_context('Bob') == user_context
+
+        context_manager.set_user_context('Bob', make_user_context('bye'))
+        assert context_manager.get_user_context('Bob') == make_user_context('bye')
+        assert overflow.get_user_context('Bob') == empty_user_context
+
+        context_manager.set_user_context('Bob', user_context)
+        context_manager.delete_user_context('Bob')
+        assert context_manager.get_user_context('Bob') == empty_user_context
+        assert overflow.get_user_context('Bob') == empty_user_context
+
+        with pytest.raises(ValueError):
+            MmapContextManager(storage_path).set_user_context('Alice', user_context)
+        context_manager.close()
+
+    def test_json_serializer(self, storage_path, make_user_context):
+        context_manager = MmapContextManager(storage_path, slots=16, serializer=JSONSerializer())
+
+        context_manager.set_user_context('Bob', make_user_context('hello'))
+
+        assert context_manager.get_user_context('Bob') == make_user_context('hello')
+        context_manager.close()
+
+    def test_processes(self, storage_path, make_user_context):
+        MmapContextManager(storage_path, slots=64, slot_size=512).close()
+
+        processes = [
+            multiprocessing.get_context('fork').Process(
+                target=_write_user_contexts,
+                args=(storage_path, worker, make_user_context),
+            )
+            for worker in range(3)
+        ]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+            assert process.exitcode == 0
+
+        context_manager = MmapContextManager(storage_path)
+        for worker in range(3):
+            for i in range(20):
+                assert context_manager.get_user_context(f'user{worker}-{i}') == (
+                    make_user_context(f'{worker}-{i}')
+                )
+        assert context_manager.get_user_context('shared')['history'] in [['0'], ['1'], ['2']]
+        context_manager.close()
@@ -0,0 +1,159 @@
+from typing import Any, Dict, List
+
+import pytest
+
+from millet import Agent, BaseSkill
+from millet.registry import ActionRoutes, SkillRegistry
+from millet.skill import BaseSkillClassifier
+
+
+class EchoSkill(BaseSkill):
+    def execute(self, message: str, user_id: str):
+        self.say(message)
+
+
+class TestSkillRegistry:
+
+    def test_skills_map_is_read_once(self):
+
+        class SkillClassifier(BaseSkillClassifier):
+            skills_map_reads = 0
+
+            @property
+            def skills_map(self) -> Dict[str, BaseSkill]:
+                self.skills_map_reads += 1
+                return {
+                    'echo': EchoSkill(),
+                }
+
+            def classify(self, message: Any, user_id: str) -> List[str]:
+                return ['echo']
+
+        skill_classifier = SkillClassifier()
+        agent = Agent(skill_classifier=skill_classifier)
+
+        assert agent.process_message('hello', 'bob') == ['hello']
+        assert agent.process_message('hi', 'bob') == ['hi']
+        assert skill_classifier.skills_map_reads == 1
+        assert agent.skill_registry['echo'] is agent.skill_registry['echo']
+        assert agent.skill_registry.skills_map_time is not None
+
+    def test_lazy_factory(self):
+        built = []
+
+        class VocabularySkill(BaseSkill):
+            def __init__(self):
+                built.append(self)
+
+            def execute(self, message: str, user_id: str):
+                self.say('word')
+
+        class SkillClassifier(BaseSkillClassifier):
+            @property
+            def skills_map(self) -> Dict[str, BaseSkill]:
+                return {
+                    'echo': EchoSkill(),
+                    'vocabulary': VocabularySkill,
+                }
+
+            def classify(self, message: Any, user_id: str) -> List[str]:
+                return [message]
+
+        agent = Agent(skill_classifier=SkillClassifier())
+
+        assert agent.process_message('echo', 'bob') == ['echo']
+        assert built == []
+        assert agent.skill_registry.construction_times == {}
+
+        assert agent.process_message('vocabulary', 'bob') == ['word']
+        assert agent.process_message('vocabulary', 'bob') == ['word']
+        assert len(built) == 1
+        assert set(agent.skill_registry.construction_times) == {'vocabulary'}
+
+    def test_preload_and_reset(self):
+
+        class SkillClassifier(BaseSkillClassifier):
+            @property
+            def skills_map(self) -> Dict[str, BaseSkill]:
+                return {
+                    'echo': EchoSkill,
+                }
+
+            def classify(self, message: Any, user_id: str) -> List[str]:
+                return ['echo']
+
+        registry = SkillRegistry(SkillClassifier())
+        registry.preload()
+
+        skill = registry['echo']
+        assert 'echo' in registry
+        assert set(registry.construction_times) == {'echo'}
+
+        registry.reset()
+        assert registry['echo'] is not skill
+
+    def test_invalid_skill(self):
+
+        class SkillClassifier(BaseSkillClassifier):
+            @property
+            def skills_map(self) -> Dict[str, BaseSkill]:
+                return {
+                    'echo': 'EchoSkill',
+                }
+
+            def classify(self, message: Any, user_id: str) -> List[str]:
+                return ['echo']
+
+        with pytest.raises(TypeError):
+            SkillRegistry(SkillClassifier())['echo']
+
+
+class TestActionRoutes:
+
+    def test_route(self):
+        action_routes = ActionRoutes()
+        action_routes.add('buy', actions=['buy', ('buy', 1)], action_prefixes=['buy:'])
+        action_routes.add('buy_phone', actions=[], action_prefixes=['buy:phone:'])
+        action_routes.add('cancel', actions=['cancel', 'buy'], action_prefixes=[])
+
+        assert action_routes.route('buy') == ['buy', 'cancel']
+        assert action_routes.route(('buy', 1)) == ['buy']
+        assert action_routes.route('buy:tv:1') == ['buy']
+        assert action_routes.route('buy:phone:1') == ['buy_phone']
+        assert action_routes.route('sell') == []
+        assert action_routes.route({'payload': 'buy'}) == []
+
+    def test_empty_prefix(self):
+        with pytest.raises(ValueError):
+            ActionRoutes().add('buy', actions=[], action_prefixes=[''])
+
+    def test_agent_routes_actions_without_classifier(self):
+
+        class BuySkill(BaseSkill):
+            actions = ['buy']
+            action_prefixes = ['buy:']
+
+            def execute(self, message: str, user_id: str):
+                self.say(f'buying {message}')
+
+        class SkillClassifier(BaseSkillClassifier):
+            messages = []
+
+            @property
+            def skills_map(self) -> Dict[str, BaseSkill]:
+                return {
+                    'echo': EchoSkill(),
+                    'buy': BuySkill,
+                }
+
+            def classify(self, message: Any, user_id: str) -> List[str]:
+                self.messages.append(message)
+                return ['echo']
+
+        skill_classifier = SkillClassifier()
+        agent = Agent(skill_classifier=skill_classifier)
+
+        assert agent.process_action('buy:iphone', 'bob') == ['buying buy:iphone']
+        assert agent.process_action('buy', 'bob') == ['buying buy']
+        assert agent.process_action('sell', 'bob') == ['sell']
+        assert skill_classifier.messages == ['sell']
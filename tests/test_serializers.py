@@ -0,0 +1,162 @@
+import pickle
+
+import pytest
+
+from millet.context import PickleSerializer
+from millet.history import History
+from millet.serializers import (
+    BinarySerializer,
+    CodecRegistry,
+    JSONSerializer,
+    MsgpackSerializer,
+    SerializationError,
+    default_codecs
+)
+from millet.timeouts import MessageTimeOut
+
+user_context = dict(
+    skill_names=['GreetingSkill', 'BuySkill'],
+    state_names=[None, 'payment'],
+    history=History(['hello, i want to buy iPhone'] * 100),
+    context={'age': '25'},
+    calls_history={'randint': History([1, 2, 3])},
+    timeout_uid=None,
+    frame=None,
+)
+
+
+class TestBinarySerializer:
+
+    @pytest.mark.parametrize('compression', [None, 'zlib', 'lz4'])
+    def test_reload(self, compression):
+        if compression == 'lz4':
+            pytest.importorskip('lz4')
+
+        serializer = BinarySerializer(compression=compression, compression_threshold=0)
+        serialized_user_context = serializer.dumps(user_context)
+
+        assert isinstance(serialized_user_context, bytes)
+        assert serialized_user_context[:3] == bytes((
+            BinarySerializer.marker,
+            BinarySerializer.version,
+            BinarySerializer._compressions[compression],
+        ))
+        assert BinarySerializer().loads(serialized_user_context) == user_context
+
+    def test_small_payload_isnt_compressed(self):
+        serializer = BinarySerializer(compression='zlib', compression_threshold=1024)
+        serialized_param = serializer.dumps({'a': 1})
+
+        assert serialized_param[2] == 0
+        assert serializer.loads(serialized_param) == {'a': 1}
+
+    def test_smaller_than_pickle_serializer(self):
+        legacy_size = len(PickleSerializer().dumps(user_context).encode())
+        assert len(BinarySerializer(compression=None).dumps(user_context)) < legacy_size / 1.5
+
+    def test_load_pickle_serializer_data(self):
+        serialized_user_context = PickleSerializer().dumps(user_context)
+
+        serializer = BinarySerializer()
+
+        assert serializer.loads(serialized_user_context) == user_context
+        assert serializer.loads(serialized_user_context.encode()) == user_context
+        assert serializer.loads(pickle.dumps(user_context, 4)) == user_context
+
+    def test_unsupported_version(self):
+        serialized_param = BinarySerializer().dumps({'a': 1})
+        serialized_param = serialized_param[:1] + bytes((BinarySerializer.version + 1,)) + serialized_param[2:]
+
+        with pytest.raises(SerializationError):
+            BinarySerializer().loads(serialized_param)
+
+    def test_unknown_compression(self):
+        with pytest.raises(ValueError):
+            BinarySerializer(compression='bz2')
+
+
+class Update:
+
+    def __init__(self, update_id: int, text: str) -> None:
+        self.update_id = update_id
+        self.text = text
+
+    def __eq__(self, other):
+        return isinstance(other, Update) and vars(self) == vars(other)
+
+
+def codecs() -> CodecRegistry:
+    codecs = default_codecs()
+    codecs.register(
+        Update,
+        'tests.Update',
+        encode=lambda update: [update.update_id, update.text],
+        decode=lambda value: Update(*value),
+    )
+    return codecs
+
+
+safe_serializers = [
+    pytest.param(lambda: MsgpackSerializer(codecs=codecs()), id='msgpack'),
+    pytest.param(lambda: JSONSerializer(codecs=codecs()), id='orjson'),
+    pytest.param(lambda: JSONSerializer(codecs=codecs(), use_orjson=False), id='json'),
+]
+
+
+class TestSafeSerializers:
+
+    @pytest.fixture(autouse=True)
+    def skip_without_dependencies(self):
+        pytest.importorskip('msgpack')
+        pytest.importorskip('orjson')
+
+    @pytest.mark.parametrize('make_serializer', safe_serializers)
+    def test_reload(self, make_serializer):
+        user_context = dict(
+            skill_names=['GreetingSkill', 'BuySkill'],
+            state_names=[None, 'payment'],
+            history=History([Update(1, 'hello'), MessageTimeOut(), 'Bob']),
+            context={'age': 25, 'cart': [{'sku': 'iphone', 'price': 999.9}]},
+            calls_history={'random.randint': History([1, 2])},
+            timeout_uid='uid',
+            frame={'frame_id': 'id', 'state': 'execute', 'message': 'hello'},
+        )
+        serializer = make_serializer()
+
+        reloaded_user_context = serializer.loads(serializer.dumps(user_context))
+
+        history = reloaded_user_context.pop('history')
+        assert isinstance(history, History)
+        assert history[0] == Update(1, 'hello')
+        assert isinstance(history[1], MessageTimeOut)
+        assert history[2] == 'Bob'
+        assert isinstance(reloaded_user_context['calls_history']['random.randint'], History)
+
+        del user_context['history']
+        assert reloaded_user_context == user_context
+
+    @pytest.mark.parametrize('make_serializer', safe_serializers)
+    def test_missing_and_extra_fields(self, make_serializer):
+        user_context = dict(
+            skill_names=[],
+            state_names=[],
+            history=[],
+            context={},
+            calls_history={},
+            timeout_uid=None,
+            language='en',
+        )
+        serializer = make_serializer()
+
+        assert serializer.loads(serializer.dumps(user_context)) == user_context
+
+    @pytest.mark.parametrize('make_serializer', safe_serializers)
+    def test_unknown_type(self, make_serializer):
+        user_context = dict(history=[object()])
+
+        with pytest.raises(SerializationError):
+            make_serializer().dumps(user_context)
+
+    def test_codec_name_is_unique(self):
+        with pytest.raises(ValueError):
+            codecs().register(Update, 'tests.Update', encode=str, decode=str)
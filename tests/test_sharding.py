@@ -0,0 +1,240 @@
+import asyncio
+import threading
+from collections import Counter
+from typing import Dict, List
+from unittest import mock
+
+import pytest
+
+from millet.context import BaseAsyncContextManager, RAMContextManager, UserContextChanges
+from millet.sharding import AsyncShardedContextManager, HashRing, ShardedContextManager
+
+
+class AsyncRAMContextManager(BaseAsyncContextManager):
+
+    def __init__(self):
+        self._context_manager = RAMContextManager()
+
+    async def get_user_context(self, user_id: str) -> dict:
+        return self._context_manager.get_user_context(user_id)
+
+    async def set_user_context(self, user_id: str, user_context: dict) -> None:
+        self._context_manager.set_user_context(user_id, user_context)
+
+
+class TestHashRing:
+
+    def test_keys_are_spread_evenly(self):
+        ring = HashRing(['a', 'b', 'c', 'd'])
+
+        counts = Counter(ring.node(f'user{i}') for i in range(10000))
+
+        assert set(counts) == {'a', 'b', 'c', 'd'}
+        assert all(1500 < count < 3500 for count in counts.values())
+
+    def test_added_node_takes_keys_from_others_only(self):
+        ring = HashRing(['a', 'b', 'c', 'd'])
+        keys = [f'user{i}' for i in range(10000)]
+        nodes = {key: ring.node(key) for key in keys}
+
+        ring.add('e')
+
+        moved = [key for key in keys if ring.node(key) != nodes[key]]
+        assert all(ring.node(key) == 'e' for key in moved)
+        # about 1/5 of keys
+        assert 1000 < len(moved) < 3000
+
+        ring.remove('e')
+        assert {key: ring.node(key) for key in keys} == nodes
+
+    def test_positions_are_stable(self):
+        assert HashRing(['a', 'b']).node('Bob') == HashRing(['b', 'a']).node('Bob')
+
+    def test_invalid_nodes(self):
+        ring = HashRing(['a'])
+
+        with pytest.raises(ValueError):
+            ring.add('a')
+        with pytest.raises(KeyError):
+            ring.remove('b')
+
+        ring.remove('a')
+        with pytest.raises(LookupError):
+            ring.node('Bob')
+
+
+class TestShardedContextManager:
+
+    @staticmethod
+    def _shards(count: int) -> Dict[str, mock.Mock]:
+        return {f'shard{i}': mock.Mock(wraps=RAMContextManager()) for i in range(count)}
+
+    def test_user_is_stored_in_its_shard(self, empty_user_context, make_user_context):
+        shards = self._shards(3)
+        context_manager = ShardedContextManager(shards)
+
+        context_manager.set_user_context('Bob', make_user_context('hello'))
+
+        assert context_manager.get_user_context('Bob') == make_user_context('hello')
+        assert context_manager.get_user_context('Alice') == empty_user_context
+        shard = context_manager.shard('Bob')
+        assert shard is shards[context_manager.shard_name('Bob')]
+        assert shard.get_user_context('Bob') == make_user_context('hello')
+        for other_shard in shards.values():
+            if other_shard is not shard:
+                other_shard.set_user_context.assert_not_called()
+
+    def test_bulk_operations_are_split_by_shards(self, make_user_context):
+        shards = self._shards(3)
+        context_manager = ShardedContextManager(shards)
+        user_ids = [f'user{i}' for i in range(30)]
+        user_contexts = {user_id: make_user_context(user_id) for user_id in user_ids}
+
+        context_manager.set_many(user_contexts)
+        assert list(context_manager.get_many(user_ids)) == user_ids
+        assert context_manager.get_many(user_ids) == user_contexts
+
+        for name, shard in shards.items():
+            shard_user_ids = [
+                user_id for user_id in user_ids if context_manager.shard_name(user_id) == name
+            ]
+            assert shard_user_ids
+            shard.set_many.assert_called_once_with(
+                {user_id: user_contexts[user_id] for user_id in shard_user_ids}
+            )
+            shard.get_many.assert_called_with(shard_user_ids)
+
+        context_manager.close()
+
+    def test_bulk_operations_of_shards_run_concurrently(self, empty_user_context):
+        barrier = threading.Barrier(2, timeout=5)
+
+        class SlowRAMContextManager(RAMContextManager):
+
+            def get_many(self, user_ids: List[str]) -> Dict[str, dict]:
+                # both shards have to be inside get_many at once
+                barrier.wait()
+                return super().get_many(user_ids)
+
+        context_manager = ShardedContextManager({
+            'a': SlowRAMContextManager(),
+            'b': SlowRAMContextManager(),
+        })
+        user_ids = [f'user{i}' for i in range(20)]
+
+        assert context_manager.get_many(user_ids) == {
+            user_id: empty_user_context for user_id in user_ids
+        }
+        context_manager.close()
+
+    def test_own_executor_grows_with_added_shards(self, empty_user_context):
+        barriers = []
+
+        class SlowRAMContextManager(RAMContextManager):
+
+            def get_many(self, user_ids: List[str]) -> Dict[str, dict]:
+                # all shards have to be inside get_many at once
+                for barrier in barriers:
+                    barrier.wait()
+                return super().get_many(user_ids)
+
+        context_manager = ShardedContextManager({
+            'a': SlowRAMContextManager(),
+            'b': SlowRAMContextManager(),
+        })
+        user_ids = [f'user{i}' for i in range(30)]
+        context_manager.get_many(user_ids)
+
+        context_manager.add_shard('c', SlowRAMContextManager())
+        barriers.append(threading.Barrier(3, timeout=5))
+
+        assert context_manager.get_many(user_ids) == {
+            user_id: empty_user_context for user_id in user_ids
+        }
+        context_manager.close()
+
+    def test_update_many__changes_are_split_by_shards(self, empty_user_context, make_user_context):
+        shards = self._shards(2)
+        context_manager = ShardedContextManager(shards)
+        user_contexts = {f'user{i}': make_user_context('hello') for i in range(10)}
+        changes = {
+            user_id: UserContextChanges.between(empty_user_context, user_context)
+            for user_id, user_context in user_contexts.items()
+        }
+
+        context_manager.update_many(user_contexts, changes)
+
+        for name, shard in shards.items():
+            shard_user_ids = [user_id for user_id in user_contexts
+                              if context_manager.shard_name(user_id) == name]
+            shard.update_many.assert_called_once_with(
+                {user_id: user_contexts[user_id] for user_id in shard_user_ids},
+                {user_id: changes[user_id] for user_id in shard_user_ids},
+            )
+        context_manager.close()
+
+    def test_add_shard(self):
+        context_manager = ShardedContextManager({
+            'a': RAMContextManager(),
+            'b': RAMContextManager(),
+        })
+        user_ids = [f'user{i}' for i in range(1000)]
+        shard_names = {user_id: context_manager.shard_name(user_id) for user_id in user_ids}
+
+        context_manager.add_shard('c', RAMContextManager())
+
+        moved = [user_id for user_id in user_ids
+                 if context_manager.shard_name(user_id) != shard_names[user_id]]
+        assert {context_manager.shard_name(user_id) for user_id in moved} == {'c'}
+        assert len(moved) < 500
+        assert list(context_manager.shards) == ['a', 'b', 'c']
+
+        shard = context_manager.shards['c']
+        with pytest.raises(ValueError):
+            context_manager.add_shard('c', RAMContextManager())
+        assert context_manager.shards['c'] is shard
+
+    def test_shard_removed_during_lookup(self, empty_user_context):
+        shard = RAMContextManager()
+        context_manager = ShardedContextManager({'a': RAMContextManager(), 'b': shard})
+        user_id = next(
+            user_id for user_id in (f'user{i}' for i in range(100))
+            if context_manager.shard_name(user_id) == 'b'
+        )
+        node = HashRing.node
+
+        def node_and_remove_shard(ring: HashRing, key: str) -> str:
+            # the shard is removed right after the ring has routed the user to it
+            name = node(ring, key)
+            if 'b' in context_manager.shards:
+                context_manager.remove_shard('b')
+            return name
+
+        with mock.patch.object(HashRing, 'node', autospec=True, side_effect=node_and_remove_shard):
+            assert context_manager.get_many([user_id]) == {user_id: empty_user_context}
+
+        assert list(context_manager.shards) == ['a']
+        assert context_manager.shard(user_id) is not shard
+
+    def test_no_shards(self):
+        with pytest.raises(ValueError):
+            ShardedContextManager({})
+
+
+class TestAsyncShardedContextManager:
+
+    def test_bulk_operations_are_split_by_shards(self, make_user_context):
+        shards = {name: AsyncRAMContextManager() for name in ('a', 'b', 'c')}
+        context_manager = AsyncShardedContextManager(shards)
+        user_contexts = {f'user{i}': make_user_context(f'hello {i}') for i in range(30)}
+
+        async def run():
+            await context_manager.set_many(user_contexts)
+            return await context_manager.get_many(list(user_contexts))
+
+        assert asyncio.run(run()) == user_contexts
+        for name, shard in shards.items():
+            assert shard._context_manager._storage == {
+                user_id: user_context for user_id, user_context in user_contexts.items()
+                if context_manager.shard_name(user_id) == name
+            }
@@ -0,0 +1,184 @@
+import random
+import sys
+from typing import Any, Dict, List
+from unittest import mock
+
+import pytest
+
+from millet import Agent, BaseSkill, BaseSkillClassifier
+from millet.side_effects import get_interception_plan
+
+
+class Dice:
+
+    @classmethod
+    def roll(cls, sides: int) -> int:
+        return random.randint(1, sides)
+
+    @staticmethod
+    def flip() -> int:
+        return random.randint(0, 1)
+
+
+class DiceSkill(BaseSkill):
+
+    side_methods = [
+        (Dice, 'roll'),
+        (Dice, 'flip'),
+    ]
+
+    def execute(self, message: str, user_id: str):
+        expected = Dice.roll(6) + Dice.flip()
+        actual = int(self.ask('Whats number?'))
+        self.say('ok' if actual == expected else 'wrong')
+
+
+class SkillClassifier(BaseSkillClassifier):
+
+    def __init__(self, skill: BaseSkill):
+        self._skill = skill
+
+    @property
+    def skills_map(self) -> Dict[str, BaseSkill]:
+        return {
+            'skill': self._skill,
+        }
+
+    def classify(self, message: Any, user_id: str) -> List[str]:
+        return ['skill']
+
+
+def test_plan_is_compiled_once():
+    skill = DiceSkill()
+
+    plan = get_interception_plan(skill)
+
+    assert get_interception_plan(skill) is plan
+    assert len(plan.interceptions) == 2
+
+
+@mock.patch('random.randint')
+def test_cached_side_cls_and_static_methods_with_arguments(randint_mock):
+    randint_mock.return_value = 1
+
+    agent = Agent(skill_classifier=SkillClassifier(DiceSkill()))
+
+    with mock.patch('unittest.mock.patch') as patch_mock:
+        answers = agent.process_message(message='start', user_id='bob')
+        assert answers == ['Whats number?']
+
+        answers = agent.process_message(message='2', user_id='bob')
+        assert answers == ['ok']
+
+    patch_mock.assert_not_called()
+    assert randint_mock.call_args_list == [mock.call(1, 6), mock.call(0, 1)]
+
+
+@mock.patch('random.randint')
+def test_side_methods_are_transparent_outside_of_skills(randint_mock):
+    randint_mock.return_value = 1
+
+    agent = Agent(skill_classifier=SkillClassifier(DiceSkill()))
+    agent.process_message(message='start', user_id='bob')
+
+    assert Dice.roll(6) == 1
+    assert Dice().flip() == 1
+    assert randint_mock.call_count == 4
+
+
+def test_unknown_side_function():
+
+    class NumberSkill(BaseSkill):
+
+        side_functions = [
+            'random.unknown',
+        ]
+
+        def execute(self, message: str, user_id: str):
+            self.say('ok')
+
+    agent = Agent(skill_classifier=SkillClassifier(NumberSkill()))
+
+    with pytest.raises(ValueError):
+        agent.process_message(message='start', user_id='bob')
+
+
+def test_side_methods_are_put_back_after_turn():
+    roll, flip = Dice.__dict__['roll'], Dice.__dict__['flip']
+
+    agent = Agent(skill_classifier=SkillClassifier(DiceSkill()))
+    agent.process_message(message='start', user_id='bob')
+
+    assert Dice.__dict__['roll'] is roll
+    assert Dice.__dict__['flip'] is flip
+
+
+def test_side_method_patched_after_compilation_is_cached():
+    roll = Dice.__dict__['roll']
+
+    agent = Agent(skill_classifier=SkillClassifier(DiceSkill()))
+    agent.process_message(message='start', user_id='alice')
+
+    with mock.patch.object(Dice, 'roll', side_effect=[1, 2]) as roll_mock, \
+            mock.patch.object(Dice, 'flip', return_value=0):
+        assert agent.process_message(message='start', user_id='bob') == ['Whats number?']
+        assert agent.process_message(message='1', user_id='bob') == ['ok']
+
+    roll_mock.assert_called_once_with(6)
+    assert Dice.__dict__['roll'] is roll
+
+
+def roll() -> int:
+    return random.randint(1, 6)
+
+
+def test_side_function_replaced_after_compilation_is_cached():
+
+    class RollSkill(BaseSkill):
+
+        side_functions = [
+            'roll',
+        ]
+
+        def execute(self, message: str, user_id: str):
+            number = roll()
+            self.ask(f'rolled {number}')
+            self.ask(f'again {number}')
+            self.say(f'done {number}')
+
+    agent = Agent(skill_classifier=SkillClassifier(RollSkill()))
+    # the plan is compiled and applied before the patch
+    agent.process_message(message='start', user_id='alice')
+
+    with mock.patch(f'{__name__}.roll', side_effect=[1, 2, 3]) as roll_mock:
+        assert agent.process_message(message='start', user_id='bob') == ['rolled 1']
+        assert agent.process_message(message='next', user_id='bob') == ['again 1']
+        assert agent.process_message(message='next', user_id='bob') == ['done 1']
+
+    roll_mock.assert_called_once_with()
+
+
+def test_side_functions_of_modules_are_intercepted_for_skill_only():
+    randint = random.randint
+
+    class NumberSkill(BaseSkill):
+
+        side_functions = [
+            'random.randint',
+        ]
+
+        def execute(self, message: str, user_id: str):
+            # functions of the skill module are intercepted as well
+            number = random.randint(0, 100) + roll()
+            self.ask('Whats number?')
+            self.say(str(number))
+
+    agent = Agent(skill_classifier=SkillClassifier(NumberSkill()))
+
+    with mock.patch('random.randint', side_effect=[35, 1, 2, 3]) as randint_mock:
+        assert agent.process_message(message='start', user_id='bob') == ['Whats number?']
+        assert agent.process_message(message='36', user_id='bob') == ['36']
+
+    assert randint_mock.call_args_list == [mock.call(0, 100), mock.call(1, 6)]
+    assert random is sys.modules['random']
+    assert random.randint is randint
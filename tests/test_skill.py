@@ -334,3 +334,53 @@ class TestSkill:
         assert result.is_finished
         assert result.direct_to is None
         assert result.context == {'greeting': 'Nice to meet you'}
+
+    def test_checkpoint_mode(self):
+
+        class AgeSkill(BaseSkill):
+
+            checkpoint_mode = True
+
+            def execute(self, message: str, user_id: str):
+                self.ask('How old are you?', direct_to=self.wait_age)
+
+            def wait_age(self, age: str, user_id: str):
+                try:
+                    age = int(age)
+                except ValueError:
+                    self.specify(question='Send a number pls')
+
+                self.say(f'You are {age} years old')
+
+        skill = AgeSkill()
+
+        result = skill.run(
+            message='hello', user_id='100500', history=[], state_name=None, context={}
+        )
+
+        assert result.answers == ['How old are you?']
+        assert result.is_relevant
+        assert not result.is_finished
+        assert result.direct_to == 'wait_age'
+        assert result.context == {}
+
+        result = skill.run(
+            message='twenty four', user_id='100500', history=[],
+            state_name='wait_age', context=result.context,
+        )
+
+        assert result.answers == ['Send a number pls']
+        assert not result.is_relevant
+        assert not result.is_finished
+        assert result.direct_to == 'wait_age'
+        assert result.context == {}
+
+        result = skill.run(
+            message='24', user_id='100500', history=[], state_name='wait_age', context=result.context
+        )
+
+        assert result.answers == ['You are 24 years old']
+        assert result.is_relevant
+        assert result.is_finished
+        assert result.direct_to is None
+        assert result.context == {}
@@ -0,0 +1,70 @@
+import sqlite3
+
+import pytest
+
+from millet.sqlite import SQLiteContextManager
+
+
+class TestSQLiteContextManager:
+
+    def test_reload_user_context(self, storage_path, empty_user_context, make_user_context):
+        context_manager = SQLiteContextManager(storage_path)
+        context_manager.set_user_context('Bob', make_user_context('hello'))
+        context_manager.set_user_context('Bob', make_user_context('bye'))
+        context_manager.close()
+
+        context_manager = SQLiteContextManager(storage_path)
+
+        assert context_manager.get_user_context('Bob') == make_user_context('bye')
+        assert context_manager.get_user_context('Alice') == empty_user_context
+        assert context_manager.get_many(['Alice', 'Bob']) == {
+            'Alice': empty_user_context,
+            'Bob': make_user_context('bye'),
+        }
+        assert sqlite3.connect(storage_path).execute('PRAGMA journal_mode').fetchone() == ('wal',)
+
+    def test_get_many_and_set_many(self, storage_path, make_user_context):
+        context_manager = SQLiteContextManager(storage_path)
+        user_contexts = {f'user{i}': make_user_context(str(i)) for i in range(1500)}
+
+        context_manager.set_many(user_contexts)
+
+        assert context_manager.get_many(list(user_contexts)) == user_contexts
+        assert context_manager.commits == 1
+
+    def test_delete_user_context(self, storage_path, empty_user_context, make_user_context):
+        context_manager = SQLiteContextManager(storage_path)
+        context_manager.set_user_context('Bob', make_user_context('hello'))
+
+        context_manager.delete_user_context('Bob')
+
+        assert context_manager.get_user_context('Bob') == empty_user_context
+
+    def test_group_commit(self, storage_path, make_user_context):
+        context_manager = SQLiteContextManager(
+            storage_path,
+            group_commit=True,
+            commit_interval=60,
+            commit_batch_size=3,
+        )
+        other_connection = sqlite3.connect(storage_path)
+
+        context_manager.set_user_context('Alice', make_user_context('hello'))
+        context_manager.set_user_context('Bob', make_user_context('hi'))
+
+        assert context_manager.get_user_context('Bob') == make_user_context('hi')
+        assert other_connection.execute('SELECT COUNT(*) FROM user_contexts').fetchone() == (0,)
+
+        context_manager.set_user_context('Eve', make_user_context('hey'))
+
+        assert other_connection.execute('SELECT COUNT(*) FROM user_contexts').fetchone() == (3,)
+        assert context_manager.commits == 1
+
+        context_manager.set_user_context('Bob', make_user_context('bye'))
+        context_manager.close()
+
+        assert SQLiteContextManager(storage_path).get_user_context('Bob') == make_user_context('bye')
+
+    def test_invalid_table(self, storage_path):
+        with pytest.raises(ValueError):
+            SQLiteContextManager(storage_path, table='user_contexts; DROP TABLE users')
@@ -0,0 +1,128 @@
+import time
+from typing import Callable
+from unittest import mock
+
+import pytest
+from redis import Redis
+
+from millet.context import RAMContextManager, UserContextChanges
+from millet.tiered import RedisContextVersions, TieredContextManager
+
+
+class TestTieredContextManager:
+
+    def test_reads_are_served_locally(self, empty_user_context, make_user_context):
+        backend = mock.Mock(wraps=RAMContextManager())
+        context_manager = TieredContextManager(backend=backend)
+
+        context_manager.set_user_context('Bob', make_user_context('hello'))
+        backend.set_many.assert_called_once_with({'Bob': make_user_context('hello')})
+
+        for _ in range(3):
+            assert context_manager.get_user_context('Bob') == make_user_context('hello')
+        assert context_manager.get_many(['Alice']) == {'Alice': empty_user_context}
+
+        backend.get_many.assert_called_once_with(['Alice'])
+        assert (context_manager.hits, context_manager.misses) == (3, 1)
+
+    def test_update_user_context__changes_are_passed_to_backend(
+        self,
+        empty_user_context,
+        make_user_context,
+    ):
+        backend = mock.Mock(wraps=RAMContextManager())
+        context_manager = TieredContextManager(backend=backend)
+        new_user_context = make_user_context('hello')
+        changes = UserContextChanges.between(empty_user_context, new_user_context)
+
+        context_manager.update_user_context('Bob', new_user_context, changes)
+
+        backend.update_many.assert_called_once_with({'Bob': new_user_context}, {'Bob': changes})
+
+    def test_stale_local_copy_is_loaded_again(self, redis: Redis, make_user_context):
+        backend = RAMContextManager()
+        worker = TieredContextManager(backend=backend, versions=RedisContextVersions(redis))
+        other_worker = TieredContextManager(backend=backend, versions=RedisContextVersions(redis))
+
+        worker.set_user_context('Bob', make_user_context('hello'))
+        assert worker.get_user_context('Bob') == make_user_context('hello')
+        assert worker.hits == 1
+
+        # routing has changed, the user is handled by the other worker
+        assert other_worker.get_user_context('Bob') == make_user_context('hello')
+        other_worker.set_user_context('Bob', make_user_context('bye'))
+
+        assert worker.get_user_context('Bob') == make_user_context('bye')
+        assert worker.stale == 1
+        assert worker.get_user_context('Bob') == make_user_context('bye')
+        assert worker.hits == 2
+
+    def test_write_behind(self, make_user_context):
+        backend = mock.Mock(wraps=RAMContextManager())
+        context_manager = TieredContextManager(
+            backend=backend,
+            write_behind=True,
+            flush_interval=60,
+            batch_size=2,
+        )
+
+        context_manager.set_user_context('Alice', make_user_context('hello'))
+        assert context_manager.get_user_context('Alice') == make_user_context('hello')
+        backend.set_many.assert_not_called()
+
+        context_manager.set_user_context('Bob', make_user_context('hi'))
+        _wait_for(lambda: context_manager.flushes == 1)
+        backend.set_many.assert_called_once_with({
+            'Alice': make_user_context('hello'),
+            'Bob': make_user_context('hi'),
+        })
+
+        context_manager.set_user_context('Eve', make_user_context('hey'))
+        context_manager.close()
+
+        assert backend.set_many.call_count == 2
+        assert backend.get_user_context('Eve') == make_user_context('hey')
+        assert context_manager.flushes == 2
+        backend.get_many.assert_not_called()
+
+    def test_write_behind__failed_flush_is_retried(self, make_user_context):
+        backend = mock.Mock(wraps=RAMContextManager())
+        backend.set_many.side_effect = [ConnectionError, None]
+        context_manager = TieredContextManager(backend=backend, write_behind=True, flush_interval=60)
+        context_manager.set_user_context('Bob', make_user_context('hello'))
+
+        with pytest.raises(ConnectionError):
+            context_manager.flush()
+        assert context_manager.get_user_context('Bob') == make_user_context('hello')
+
+        context_manager.close()
+
+        assert context_manager.failed_flushes == 1
+        assert backend.set_many.call_args_list[-1] == mock.call({'Bob': make_user_context('hello')})
+
+    def test_write_behind__full_batch_is_flushed_in_background(self, make_user_context):
+        backend = mock.Mock(wraps=RAMContextManager())
+        backend.set_many.side_effect = [ConnectionError, None]
+        context_manager = TieredContextManager(
+            backend=backend,
+            write_behind=True,
+            flush_interval=60,
+            batch_size=1,
+        )
+
+        # the failed write isn't raised to the caller, the batch is kept for the next flush
+        context_manager.set_user_context('Bob', make_user_context('hello'))
+        _wait_for(lambda: context_manager.failed_flushes == 1)
+        assert context_manager.get_user_context('Bob') == make_user_context('hello')
+
+        context_manager.set_user_context('Bob', make_user_context('bye'))
+        _wait_for(lambda: context_manager.flushes == 1)
+        context_manager.close()
+
+        assert backend.set_many.call_args_list[-1] == mock.call({'Bob': make_user_context('bye')})
+
+
+def _wait_for(condition: Callable[[], bool]) -> None:
+    deadline = time.monotonic() + 5
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)